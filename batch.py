@@ -0,0 +1,308 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Batched scenario runner: many light positions and initial states in one pass
+
+# Checking robustness means rerunning simStage2.py/simStage3.py for every
+# BRIGHT_LIGHT position and pair of initial states. ScenarioBatch steps all of
+# them together: the state is a (scenarios, vehicles, 4) array, the leader
+# sign checks, follower delays and safety rule of Swarm run across the
+# scenario axis, and the follower delay reads a ring of the last
+# FOLLOW_STEPS + 1 controls of every scenario instead of a full history.
+# Scenarios whose leaders reach the light, loop around it MAX_ORBITS times
+# or whose followers break a violation distance (the stop conditions of
+# stopping.py) are taken out of the working arrays, so finished scenarios
+# stop costing anything
+#
+# Run "python batch.py" for a check against the stage simulations and a 10000
+# scenario timing
+
+import numpy as np
+
+import simStage2
+import simStage3
+from stopping import turn_angle
+from swarm import heading_sign, turn_velocity
+
+class ScenarioBatch(object):
+    """A batch of independent leader/follower scenarios sharing one topology
+    with the following properties:
+
+    Attributes:
+        N_SCENARIOS: an int representing the number of scenarios
+        N_VEHICLES: an int representing the vehicles in every scenario
+        leader_index: an int array with -1 for leaders and the index of the
+            vehicle being followed for followers, shared by every scenario
+        FOLLOW_STEPS: an int representing the steps a follower is behind
+        GOAL_RADIUS: distance in meters from the light at which a scenario's
+            leaders have reached it, None to never stop for the goal
+        VIOLATION_DISTANCE: distance in meters a follower must keep from the
+            vehicle it follows, None to never stop for a violation
+        MAX_ORBITS: a float representing the full circles turned by every
+            leader after which a scenario stops, None to never stop for
+            orbiting
+        final_state: (N_SCENARIOS, N_VEHICLES, 4) array of the last state of
+            every scenario
+        steps: an int array of the steps every scenario ran
+        goal_step: an int array of the step every scenario reached the goal,
+            -1 if it did not
+        violation_step: an int array of the step of every scenario's safety
+            violation, -1 if there was none
+        orbits: an array of the full circles turned by the leader of every
+            scenario that turned the least, only counted with MAX_ORBITS
+        closest_approach: an array of every scenario's smallest distance
+            between a follower and the vehicle it follows
+        l2_overrides: an int array counting every scenario's level 2 turns
+        state: (N_SCENARIOS, N_STEPS, N_VEHICLES, 4) array of every state,
+            NaN after a scenario stopped, only kept with record=True
+        turn_control: (N_SCENARIOS, N_STEPS, N_VEHICLES) array of every turn
+            control, only kept with record=True
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE,
+                 SAFE_FOLLOW_DISTANCE, INITIAL_STATES, leader_index, FOLLOW_STEPS,
+                 TIME_STEP, GOAL_RADIUS=None, VIOLATION_DISTANCE=None, MAX_ORBITS=None):
+        """Return a batch of the scenarios in *INITIAL_STATES*, shape
+        (scenarios, vehicles, 4). *CONSTANT_VELOCITY*, *L1_HEADING_CHANGE*,
+        *L2_HEADING_CHANGE* and *SAFE_FOLLOW_DISTANCE* have the units of
+        Vehicle and can be scalars, one value per vehicle or a (scenarios,
+        vehicles) array. *leader_index* is the Swarm topology of every
+        scenario
+        """
+        INITIAL_STATES = np.asarray(INITIAL_STATES, dtype=float)
+        self.N_SCENARIOS, self.N_VEHICLES = S, N = INITIAL_STATES.shape[:2]
+        self.INITIAL_STATES = INITIAL_STATES
+        self.leader_index = np.asarray(leader_index, dtype=np.intp)
+        if self.leader_index.shape != (N,):
+            raise ValueError('leader_index needs one entry per vehicle')
+        self._leaders = np.flatnonzero(self.leader_index < 0)
+        self._followers = np.flatnonzero(self.leader_index >= 0)
+        self._followed = self.leader_index[self._followers]
+        if FOLLOW_STEPS < 1:
+            raise ValueError('followers need a delay of at least 1 step')
+        self.FOLLOW_STEPS = FOLLOW_STEPS
+        self.TIME_STEP = TIME_STEP
+        self.GOAL_RADIUS = GOAL_RADIUS
+        self.VIOLATION_DISTANCE = VIOLATION_DISTANCE
+        self.MAX_ORBITS = MAX_ORBITS
+
+        # per scenario and vehicle constants, as in Swarm
+        per_vehicle = lambda value: np.broadcast_to(np.asarray(value, dtype=float), (S, N))
+        V = per_vehicle(CONSTANT_VELOCITY)
+        L1_HEADING_CHANGE_PER_STEP = per_vehicle(L1_HEADING_CHANGE) * TIME_STEP
+        L2_HEADING_CHANGE_PER_STEP = per_vehicle(L2_HEADING_CHANGE) * TIME_STEP
+        L1_CROSS = V * np.sin(L1_HEADING_CHANGE_PER_STEP)
+        L2_CROSS = V * np.sin(L2_HEADING_CHANGE_PER_STEP)
+        self._constants = {
+            'CONSTANT_VELOCITY': V,
+            'L1_ALONG': np.sqrt(V ** 2 - L1_CROSS ** 2), 'L1_CROSS': L1_CROSS,
+            'L2_ALONG': np.sqrt(V ** 2 - L2_CROSS ** 2), 'L2_CROSS': L2_CROSS,
+            'SAFE_FOLLOW_DISTANCE': per_vehicle(SAFE_FOLLOW_DISTANCE)[:, self._followers],
+        }
+
+    def _separation(self, state):
+        """Distance from every follower to the vehicle it follows"""
+        follower_to_leader = state[:, self._followed, 0:2] - state[:, self._followers, 0:2]
+        return np.sqrt(follower_to_leader[..., 0] ** 2 + follower_to_leader[..., 1] ** 2), follower_to_leader
+
+    def run(self, bright_light, N_STEPS, record=False):
+        """Run every scenario from its initial state for up to N_STEPS - 1
+        steps
+
+        Args:
+            bright_light: [X, Y] of the light for every scenario, or a
+                (scenarios, 2) array with one light per scenario
+            N_STEPS: an int representing the states in a full run, counting
+                the initial state
+            record: when True, keep every state and turn control in the state
+                and turn_control attributes
+        """
+        S, N = self.N_SCENARIOS, self.N_VEHICLES
+        F = self.FOLLOW_STEPS
+        leaders, followers, followed = self._leaders, self._followers, self._followed
+        light = np.broadcast_to(np.asarray(bright_light, dtype=float), (S, 2))
+
+        self.final_state = self.INITIAL_STATES.copy()
+        self.steps = np.zeros(S, dtype=int)
+        self.goal_step = np.full(S, -1)
+        self.violation_step = np.full(S, -1)
+        self.l2_overrides = np.zeros(S, dtype=int)
+        self.orbits = np.zeros(S)
+        separation, _ = self._separation(self.INITIAL_STATES)
+        self.closest_approach = separation.min(axis=1) if len(followers) else np.full(S, np.inf)
+        if record:
+            self.state = np.full((S, N_STEPS, N, 4), np.nan)
+            self.state[:, 0] = self.INITIAL_STATES
+            self.turn_control = np.zeros((S, N_STEPS, N))
+
+        # working arrays hold only the scenarios still running
+        scenario = np.arange(S)
+        state = self.INITIAL_STATES.copy()
+        light = light.copy()
+        constants = dict((name, np.ascontiguousarray(value)) for name, value in self._constants.items())
+        ring = np.zeros((F + 1, S, N), dtype=np.int8)      # controls of the last F + 1 steps
+        closest = self.closest_approach.copy()
+        overrides = np.zeros(S, dtype=int)
+        angle = np.zeros((S, len(leaders)))     # heading turned by every leader
+        control = np.zeros((S, N))
+
+        for step in range(1, N_STEPS):
+            previous = state
+
+            # leaders - is brighter light on left or right of body along track direction
+            car_to_bright_light = light[:, None, :] - previous[:, leaders, 0:2]
+            control[:, leaders] = np.where(heading_sign(previous[:, leaders, 2:4], car_to_bright_light) >= 0, 1, -1)
+
+            # followers - control of the followed vehicle FOLLOW_STEPS ago
+            if step >= F:
+                control[:, followers] = ring[(step - F) % (F + 1)][:, followed]
+            else:
+                control[:, followers] = 0
+
+            # safety rule, level 2 turn away when too close
+            radius, follower_to_leader = self._separation(previous)
+            too_close = radius <= constants['SAFE_FOLLOW_DISTANCE']
+            if too_close.any():
+                sign_of_heading_angle_to_leader = heading_sign(previous[:, followers, 2:4], follower_to_leader)
+                turn_away = np.where(sign_of_heading_angle_to_leader > 0, -2, 2)
+                control[:, followers] = np.where(too_close, turn_away, control[:, followers])
+                overrides += too_close.sum(axis=1)
+            ring[step % (F + 1)] = control
+
+            state = np.empty_like(previous)
+            state[..., 2:4] = turn_velocity(previous[..., 2:4], control, constants['CONSTANT_VELOCITY'],
+                                            constants['L1_ALONG'], constants['L1_CROSS'],
+                                            constants['L2_ALONG'], constants['L2_CROSS'])
+            state[..., 0:2] = previous[..., 0:2] + state[..., 2:4] * self.TIME_STEP
+            if record:
+                self.state[scenario, step] = state
+                self.turn_control[scenario, step] = control
+
+            # stop conditions
+            done = np.zeros(len(scenario), dtype=bool)
+            if len(followers):
+                radius, _ = self._separation(state)
+                closest = np.minimum(closest, radius.min(axis=1))
+                if self.VIOLATION_DISTANCE is not None:
+                    violated = (radius < self.VIOLATION_DISTANCE).any(axis=1)
+                    self.violation_step[scenario[violated]] = step
+                    done |= violated
+            if self.GOAL_RADIUS is not None:
+                to_light = state[:, leaders, 0:2] - light[:, None, :]
+                reached = ((to_light[..., 0] ** 2 + to_light[..., 1] ** 2) <= self.GOAL_RADIUS ** 2).all(axis=1)
+                self.goal_step[scenario[reached & ~done]] = step
+                done |= reached
+            if self.MAX_ORBITS is not None and len(leaders):
+                angle += turn_angle(previous[:, leaders, 2:4], state[:, leaders, 2:4])
+                done |= np.abs(angle).min(axis=1) >= self.MAX_ORBITS * 2 * np.pi
+            if step == N_STEPS - 1:
+                done[:] = True
+
+            if done.any():
+                finished = scenario[done]
+                self.final_state[finished] = state[done]
+                self.steps[finished] = step
+                self.closest_approach[finished] = closest[done]
+                self.l2_overrides[finished] = overrides[done]
+                if len(leaders):
+                    self.orbits[finished] = np.abs(angle[done]).min(axis=1) / (2 * np.pi)
+                keep = ~done
+                if not keep.any():
+                    break
+                scenario = scenario[keep]
+                state = state[keep]
+                light = light[keep]
+                constants = dict((name, value[keep]) for name, value in constants.items())
+                ring = ring[:, keep]
+                closest = closest[keep]
+                overrides = overrides[keep]
+                angle = angle[keep]
+                control = control[keep]
+
+def stage_batch(BRIGHT_LIGHT, A_INITIAL_STATE=None, B_INITIAL_STATE=None, stage=3,
+                GOAL_RADIUS=None, VIOLATION_DISTANCE=None, MAX_ORBITS=None, record=False,
+                **constants):
+    """Run the Stage 2 or Stage 3 car A/car B scenario for many light
+    positions and initial states at once
+
+    Args:
+        BRIGHT_LIGHT: [X, Y] or a (scenarios, 2) array of light positions
+        A_INITIAL_STATE, B_INITIAL_STATE: [posX, posY, velX, velY] or
+            (scenarios, 4) arrays, the initial states of simStage2.py or
+            simStage3.py when None
+        stage: 2 for simStage2.py (one heading change, no safety rule) or 3
+            for simStage3.py
+        GOAL_RADIUS, VIOLATION_DISTANCE, MAX_ORBITS: stop conditions, see
+            ScenarioBatch
+        record: keep every state, see ScenarioBatch.run()
+        constants: overrides of the stage module constants, e.g. FOLLOW_TIME
+
+    Returns:
+        batch: the ScenarioBatch after the run, car A is vehicle 0 and car B
+            vehicle 1
+    """
+    module = simStage3 if stage == 3 else simStage2
+    names = ['TIME_STEP', 'TIME_FINAL', 'CONSTANT_VELOCITY', 'FOLLOW_TIME', 'INITIAL_CROSS_TRACK_SEPARATION']
+    names += ['L1_HEADING_CHANGE', 'L2_HEADING_CHANGE', 'SAFE_FOLLOW_DISTANCE'] if stage == 3 else ['MAX_HEADING_CHANGE']
+    unknown = set(constants) - set(names)
+    if unknown:
+        raise KeyError('unknown Stage {} constants: {}'.format(stage, ', '.join(sorted(unknown))))
+    params = dict((name, getattr(module, name)) for name in names)
+    params.update(constants)
+    if stage != 3:
+        # Stage 2 turns at one rate and has no safety rule
+        params['L1_HEADING_CHANGE'] = params['L2_HEADING_CHANGE'] = params['MAX_HEADING_CHANGE']
+        params['SAFE_FOLLOW_DISTANCE'] = -np.inf
+
+    TIME_STEP = params['TIME_STEP']
+    V = params['CONSTANT_VELOCITY']
+    N_STEPS = len(np.arange(0., params['TIME_FINAL'] + TIME_STEP, TIME_STEP))
+    FOLLOW_STEPS = int(round(params['FOLLOW_TIME'] / TIME_STEP))
+    FOLLOW_DISTANCE = V * params['FOLLOW_TIME']
+    if A_INITIAL_STATE is None:
+        A_INITIAL_STATE = [0, 0, 0, V]
+    if B_INITIAL_STATE is None:
+        B_INITIAL_STATE = [params['INITIAL_CROSS_TRACK_SEPARATION'], -FOLLOW_DISTANCE, 0, V]
+    BRIGHT_LIGHT = np.asarray(BRIGHT_LIGHT, dtype=float)
+    A_INITIAL_STATE = np.asarray(A_INITIAL_STATE, dtype=float)
+    B_INITIAL_STATE = np.asarray(B_INITIAL_STATE, dtype=float)
+    S = max(len(array) if array.ndim == 2 else 1 for array in (BRIGHT_LIGHT, A_INITIAL_STATE, B_INITIAL_STATE))
+    INITIAL_STATES = np.stack([np.broadcast_to(A_INITIAL_STATE, (S, 4)),
+                               np.broadcast_to(B_INITIAL_STATE, (S, 4))], axis=1)
+
+    batch = ScenarioBatch(V, params['L1_HEADING_CHANGE'], params['L2_HEADING_CHANGE'],
+                          [0, params['SAFE_FOLLOW_DISTANCE']], INITIAL_STATES, [-1, 0],
+                          FOLLOW_STEPS, TIME_STEP, GOAL_RADIUS, VIOLATION_DISTANCE, MAX_ORBITS)
+    batch.run(np.broadcast_to(BRIGHT_LIGHT, (S, 2)), N_STEPS, record)
+    return batch
+
+if __name__ == '__main__':
+    # host side check against the stage simulations and a timing run
+    from time import perf_counter
+
+    rng = np.random.default_rng(0)
+    lights = rng.uniform(-6, 6, (200, 2))
+    for stage, module in ((2, simStage2), (3, simStage3)):
+        batch = stage_batch(lights, stage=stage, record=True)
+        for k in range(0, 200, 7):
+            time, a, b = module.simulate(BRIGHT_LIGHT=lights[k])
+            assert np.array_equal(batch.turn_control[k, :, 0], a.turn_control)
+            assert np.array_equal(batch.turn_control[k, :, 1], b.turn_control)
+            assert np.allclose(batch.state[k, :, 0], a.state, rtol=0, atol=1e-12)
+            assert np.allclose(batch.state[k, :, 1], b.state, rtol=0, atol=1e-12)
+    print('matches simStage2.py and simStage3.py')
+
+    # random lights and headings, car B behind car A along its heading
+    N_SCENARIOS = 10000
+    V = simStage3.CONSTANT_VELOCITY
+    FOLLOW_DISTANCE = V * simStage3.FOLLOW_TIME
+    lights = rng.uniform(-6, 6, (N_SCENARIOS, 2))
+    heading = np.c_[np.cos(rng.uniform(0, 2 * np.pi, N_SCENARIOS)), np.zeros(N_SCENARIOS)]
+    heading[:, 1] = np.sqrt(1 - heading[:, 0] ** 2) * rng.choice([-1, 1], N_SCENARIOS)
+    a_states = np.c_[np.zeros((N_SCENARIOS, 2)), V * heading]
+    b_states = np.c_[-FOLLOW_DISTANCE * heading, V * heading]
+    start = perf_counter()
+    batch = stage_batch(lights, a_states, b_states, TIME_FINAL=60., GOAL_RADIUS=0.3, VIOLATION_DISTANCE=0.1)
+    elapsed = perf_counter() - start
+    print('{} Stage 3 scenarios of 60 s in {:.2f} s: {} reached the light, {} violations, {:.0f} steps on average'.format(
+        N_SCENARIOS, elapsed, np.count_nonzero(batch.goal_step >= 0),
+        np.count_nonzero(batch.violation_step >= 0), batch.steps.mean()))
@@ -0,0 +1,322 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Benchmark suite for the simulations and the board loops
+
+# Fixed scenarios, so numbers from different commits can be compared:
+#   stage1, stage2, stage3   simulate() of simStage1/2/3.py (1 and 2 vehicles)
+#   swarm-N                  a chain of N vehicles (1 leader, each following
+#                            the one in front) in swarm.py, run through a short
+#                            window of steps with Swarm.shift() so long runs
+#                            keep a fixed memory footprint
+#   convoy-N                 a convoy.py chain of N cars with delays of 4 to 6
+#                            steps, sharing one control history buffer
+#   board-stage1             the pitlStage1.py loop on the host pyb stand-in
+#   board-carB               the pitlStage2carB.py loop co-simulated with car A
+#                            over host/cosim.py
+# Every benchmark reports steps (simulation steps or board loop iterations)
+# per second of wall time, the peak memory traced by tracemalloc during a
+# separate run, and percentiles of the wall time between consecutive steps,
+# taken from a profiling.Profiler marking one function called once per step.
+#
+# --suite quick runs in a few seconds, --suite full covers 100 to 1M steps and
+# up to 10k vehicles. Results go to JSON with --out; with --baseline they are
+# compared to an earlier JSON file and the exit status is 1 when any
+# benchmark is slower, or uses more memory, than the baseline by more than
+# --threshold (a fraction)
+#
+# Example, from the command line:
+#   python benchmark.py --out baseline.json
+#   python benchmark.py --baseline baseline.json --threshold 0.2
+#   python benchmark.py --suite full --only swarm --out swarm.json
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+import simStage1
+import simStage2
+import simStage3
+import swarm
+from convoy import Convoy, line_up
+from profiling import NULL_PROFILER, Profiler
+
+HOST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'host')
+
+LATENCY_PERCENTILES = (50, 90, 99)
+LATENCY_SAMPLES = 100000        # steps kept for the latency percentiles
+SWARM_WINDOW = 256              # steps of state held by the swarm benchmarks
+START_MS = 2000                 # board time when the board scripts start
+
+def _host():
+    """Import the host board runner and co-simulation lazily, they put the
+    pyb stand-in first on the import path"""
+    if HOST_DIR not in sys.path:
+        sys.path.insert(0, HOST_DIR)
+    import board
+    import cosim
+    return board, cosim
+
+def stage1(profiler, N_STEPS):
+    """Stage 1, car A alone"""
+    profiler.instrument(simStage1, 'unit')
+    time, _, _ = simStage1.simulate(TIME_FINAL=(N_STEPS - 0.5) * simStage1.TIME_STEP)
+    return len(time) - 1
+
+def stage2(profiler, N_STEPS):
+    """Stage 2, car A and car B Vehicle objects"""
+    profiler.instrument(simStage2, 'Leader.control_direction')
+    time, _, _ = simStage2.simulate(TIME_FINAL=(N_STEPS - 0.5) * simStage2.TIME_STEP)
+    return len(time) - 1
+
+def stage3(profiler, N_STEPS):
+    """Stage 3, car A and car B Vehicle objects with the safety rule"""
+    profiler.instrument(simStage3, 'Leader.control_direction')
+    time, _, _ = simStage3.simulate(TIME_FINAL=(N_STEPS - 0.5) * simStage3.TIME_STEP)
+    return len(time) - 1
+
+def swarm_chain(profiler, N_VEHICLES, N_STEPS):
+    """A chain of *N_VEHICLES* Stage 3 vehicles in one Swarm"""
+    TIME_STEP = simStage3.TIME_STEP
+    CONSTANT_VELOCITY = simStage3.CONSTANT_VELOCITY
+    FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / TIME_STEP))
+    FOLLOW_DISTANCE = CONSTANT_VELOCITY * simStage3.FOLLOW_TIME
+    k = np.arange(N_VEHICLES)
+    INITIAL_STATES = np.zeros((N_VEHICLES, 4))
+    INITIAL_STATES[:, 0] = simStage3.INITIAL_CROSS_TRACK_SEPARATION * (k % 2)
+    INITIAL_STATES[:, 1] = -FOLLOW_DISTANCE * k
+    INITIAL_STATES[:, 3] = CONSTANT_VELOCITY
+    window = min(SWARM_WINDOW, N_STEPS + 1)
+    keep = FOLLOW_STEPS + 1
+    fleet = swarm.Swarm(CONSTANT_VELOCITY, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE,
+                        simStage3.SAFE_FOLLOW_DISTANCE, INITIAL_STATES, k - 1, window, TIME_STEP)
+    profiler.instrument(swarm, 'Swarm.control_direction')
+    done = 0
+    start = 1
+    while done < N_STEPS:
+        stop = min(window, start + N_STEPS - done)
+        fleet.run(simStage3.BRIGHT_LIGHT, FOLLOW_STEPS, TIME_STEP, start, stop)
+        done += stop - start
+        fleet.shift(keep)
+        start = keep
+    return done
+
+def convoy_chain(profiler, N_VEHICLES, N_STEPS):
+    """A Convoy of *N_VEHICLES* Stage 3 cars with mixed follow delays"""
+    TIME_STEP = simStage3.TIME_STEP
+    CONSTANT_VELOCITY = simStage3.CONSTANT_VELOCITY
+    FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / TIME_STEP))
+    INITIAL_STATES = line_up(N_VEHICLES, CONSTANT_VELOCITY, CONSTANT_VELOCITY * simStage3.FOLLOW_TIME,
+                             simStage3.INITIAL_CROSS_TRACK_SEPARATION)
+    convoy = Convoy(CONSTANT_VELOCITY, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE,
+                    simStage3.SAFE_FOLLOW_DISTANCE, INITIAL_STATES,
+                    FOLLOW_STEPS - 1 + np.arange(N_VEHICLES - 1) % 3, TIME_STEP)
+    profiler.instrument(convoy, 'control_direction')
+    convoy.run(simStage3.BRIGHT_LIGHT, N_STEPS)
+    return N_STEPS
+
+def board_stage1(profiler, BOARD_MS):
+    """The pitlStage1.py loop for *BOARD_MS* ms of board time"""
+    board, _ = _host()
+    import pyb
+    import sdlog
+    sd_dir = tempfile.mkdtemp(prefix='benchmark_sd_')
+    try:
+        pyboard = pyb.Board('pyboard', clock=pyb.VirtualClock(START_MS * 1000),
+                            switch_press_ms=START_MS + BOARD_MS, sd_dir=sd_dir)
+        profiler.instrument(sdlog, 'BinaryLog.write6')
+        namespace = board.run_script('pitlStage1.py', pyboard)
+    finally:
+        shutil.rmtree(sd_dir, ignore_errors=True)
+    return namespace['log'].records
+
+def board_car_b(profiler, BOARD_MS):
+    """The pitlStage2carB.py loop, with car A sending over a default link,
+    for *BOARD_MS* ms of board time"""
+    _, cosim = _host()
+    import sdlog
+    profiler.instrument(sdlog, 'BinaryLog.write7')
+    _, _, car_b, _ = cosim.cosimulate(cosim.link_config(DURATION_MS=BOARD_MS), START_MS)
+    return car_b['log'].records
+
+# suite name to list of (benchmark name, function, keyword arguments)
+SUITES = {
+    'quick': [
+        ('stage1-1k', stage1, {'N_STEPS': 1000}),
+        ('stage2-1k', stage2, {'N_STEPS': 1000}),
+        ('stage3-1k', stage3, {'N_STEPS': 1000}),
+        ('swarm-2-1k', swarm_chain, {'N_VEHICLES': 2, 'N_STEPS': 1000}),
+        ('swarm-100-1k', swarm_chain, {'N_VEHICLES': 100, 'N_STEPS': 1000}),
+        ('swarm-10k-100', swarm_chain, {'N_VEHICLES': 10000, 'N_STEPS': 100}),
+        ('convoy-1k-1k', convoy_chain, {'N_VEHICLES': 1000, 'N_STEPS': 1000}),
+        ('board-stage1-10min', board_stage1, {'BOARD_MS': 600000}),
+        ('board-carB-60s', board_car_b, {'BOARD_MS': 60000}),
+    ],
+    'full': [
+        ('stage1-100', stage1, {'N_STEPS': 100}),
+        ('stage1-1M', stage1, {'N_STEPS': 1000000}),
+        ('stage2-100', stage2, {'N_STEPS': 100}),
+        ('stage2-100k', stage2, {'N_STEPS': 100000}),
+        ('stage3-100', stage3, {'N_STEPS': 100}),
+        ('stage3-100k', stage3, {'N_STEPS': 100000}),
+        ('swarm-1-1M', swarm_chain, {'N_VEHICLES': 1, 'N_STEPS': 1000000}),
+        ('swarm-2-1M', swarm_chain, {'N_VEHICLES': 2, 'N_STEPS': 1000000}),
+        ('swarm-100-100k', swarm_chain, {'N_VEHICLES': 100, 'N_STEPS': 100000}),
+        ('swarm-10k-10k', swarm_chain, {'N_VEHICLES': 10000, 'N_STEPS': 10000}),
+        ('convoy-100-100k', convoy_chain, {'N_VEHICLES': 100, 'N_STEPS': 100000}),
+        ('convoy-10k-10k', convoy_chain, {'N_VEHICLES': 10000, 'N_STEPS': 10000}),
+        ('board-stage1-1h', board_stage1, {'BOARD_MS': 3600000}),
+        ('board-carB-1h', board_car_b, {'BOARD_MS': 3600000}),
+    ],
+}
+
+def latency(profiler):
+    """Return the wall time percentiles in microseconds between consecutive
+    step markers recorded by *profiler*"""
+    starts = np.array([event[1] for event in profiler.events])
+    if len(starts) < 2:
+        return {}
+    gaps = np.diff(starts) * 1e6
+    result = dict(('p{}'.format(p), float(value))
+                  for p, value in zip(LATENCY_PERCENTILES, np.percentile(gaps, LATENCY_PERCENTILES)))
+    result['max'] = float(gaps.max())
+    return result
+
+def measure(function, kwargs, repeat=3, memory=True):
+    """Run one benchmark
+
+    Args:
+        function: benchmark function, called as function(profiler, **kwargs)
+            and returning the number of steps it ran
+        kwargs: dictionary of benchmark size arguments
+        repeat: an int representing the number of timed runs, the fastest
+            one is reported
+        memory: when True, one more run under tracemalloc finds the peak
+            memory
+
+    Returns:
+        result: dictionary of steps, seconds, steps_per_s, latency_us
+            percentiles and peak_bytes (None when not measured)
+    """
+    best = None
+    for _ in range(repeat):
+        with Profiler(timeline=True, max_events=LATENCY_SAMPLES) as profiler:
+            start = perf_counter()
+            steps = function(profiler, **kwargs)
+            seconds = perf_counter() - start
+        if best is None or seconds < best[1]:
+            best = (steps, seconds, latency(profiler))
+    steps, seconds, latency_us = best
+    peak_bytes = None
+    if memory:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        function(NULL_PROFILER, **kwargs)
+        peak_bytes = tracemalloc.get_traced_memory()[1] - base
+        if not was_tracing:
+            tracemalloc.stop()
+    return {'steps': steps, 'seconds': seconds,
+            'steps_per_s': steps / seconds if seconds else float('inf'),
+            'latency_us': latency_us, 'peak_bytes': peak_bytes, 'args': kwargs}
+
+def run_suite(benchmarks, repeat=3, memory=True, report=print):
+    """Run (name, function, kwargs) *benchmarks*, returning a dictionary of
+    benchmark name to measure() result"""
+    if any(function in (board_stage1, board_car_b) for _, function, _ in benchmarks):
+        _host()         # keep the import time out of the first timed run
+    results = {}
+    for name, function, kwargs in benchmarks:
+        result = results[name] = measure(function, kwargs, repeat, memory)
+        if report:
+            report(format_result(name, result))
+    return results
+
+def format_result(name, result):
+    """One line report of a measure() result"""
+    latency_us = result['latency_us']
+    peak = result['peak_bytes']
+    return '{:<20}{:>10d} steps{:>14.0f} steps/s  p50 {:>9.1f} us  p99 {:>9.1f} us  peak {:>10}'.format(
+        name, result['steps'], result['steps_per_s'], latency_us.get('p50', float('nan')),
+        latency_us.get('p99', float('nan')), '-' if peak is None else '{:.1f} MB'.format(peak / 1e6))
+
+def environment():
+    """Describe the machine and library versions the results came from"""
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'system': platform.system()}
+
+def compare(results, baseline, threshold):
+    """Compare *results* to the results of a *baseline* run
+
+    Args:
+        results, baseline: dictionaries of benchmark name to measure() result
+        threshold: a float representing the allowed fractional slowdown in
+            steps/s or growth in peak memory
+
+    Returns:
+        lines: list of report lines, one per benchmark in both runs
+        regressions: list of the names of the benchmarks past the threshold
+    """
+    lines = ['{:<20}{:>14}{:>14}{:>9}{:>12}{:>12}{:>9}'.format(
+        'benchmark', 'base steps/s', 'steps/s', 'change', 'base MB', 'peak MB', 'change')]
+    regressions = []
+    for name in sorted(set(results) & set(baseline)):
+        new, old = results[name], baseline[name]
+        speed = new['steps_per_s'] / old['steps_per_s'] - 1 if old['steps_per_s'] else 0.
+        slower = speed < -threshold
+        growth = 0.
+        if new['peak_bytes'] is not None and old['peak_bytes']:
+            growth = float(new['peak_bytes']) / old['peak_bytes'] - 1
+        bigger = growth > threshold
+        if slower or bigger:
+            regressions.append(name)
+        megabytes = lambda value: '-' if value is None else '{:.2f}'.format(value / 1e6)
+        lines.append('{:<20}{:>14.0f}{:>14.0f}{:>+8.1f}%{:>12}{:>12}{:>+8.1f}%{}'.format(
+            name, old['steps_per_s'], new['steps_per_s'], 100 * speed, megabytes(old['peak_bytes']),
+            megabytes(new['peak_bytes']), 100 * growth, '  REGRESSION' if slower or bigger else ''))
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the simulations and the board loops')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--only', action='append', default=[], metavar='TEXT',
+                        help='run only the benchmarks whose name contains TEXT')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, the fastest counts')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory runs')
+    parser.add_argument('--out', default=None, help='json file for the results')
+    parser.add_argument('--baseline', default=None, help='json file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fractional slowdown or memory growth that fails the comparison')
+    args = parser.parse_args(argv)
+
+    benchmarks = [benchmark for benchmark in SUITES[args.suite]
+                  if not args.only or any(text in benchmark[0] for text in args.only)]
+    results = run_suite(benchmarks, args.repeat, not args.no_memory)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump({'suite': args.suite, 'environment': environment(), 'results': results},
+                      out, indent=2, sort_keys=True)
+        print('results saved to {}'.format(args.out))
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        lines, regressions = compare(results, baseline['results'], args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            print('{} regressions past {:.0f}%: {}'.format(
+                len(regressions), 100 * args.threshold, ', '.join(regressions)))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# On disk cache of simulation results, keyed by scenario and code version
+
+# Sweeps and notebooks keep rerunning the same scenarios. ResultCache stores
+# every finished run under the SHA-256 of its full parameter dictionary
+# (canonical JSON, sorted keys, floats written exactly) together with a code
+# version, the hash of the source files that produced it, so editing the
+# simulation invalidates old results by itself. An entry is a trajectory
+# directory in the trajectory.py layout (time.npy, state.npy,
+# turn_control.npy, meta.json with the parameters and summary metrics), so a
+# hit maps the arrays back with open_trajectory() instead of reading them.
+#
+# Entries are written to a temporary directory and renamed into place, so
+# several sweep workers can share a cache. Every hit touches the entry's
+# meta.json, and after each store the least recently used entries are
+# deleted until the cache fits in max_bytes
+#
+# Example:
+#   cache = ResultCache(max_bytes=2e9, version=code_version(simStage3.__file__))
+#   trajectory = cached_stage(simStage3, cache, FOLLOW_TIME=0.8)
+#   print(cache.stats())
+# and from the command line:
+#   python sweep.py --grid FOLLOW_TIME=0.3,0.5,1 --cache ~/.cache/followcar
+#   python cache.py --max-mb 500
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+
+import numpy as np
+
+from trajectory import open_trajectory
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'followcar')
+DEFAULT_MAX_BYTES = 1 << 30
+
+def code_version(*paths):
+    """Return a short hash of the source files *paths*, e.g. module __file__
+    values, that changes whenever one of them is edited"""
+    digest = hashlib.sha256()
+    for path in paths:
+        if path.endswith('.pyc'):
+            path = path[:-1]
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+def _canonical(value):
+    """Turn NumPy values and tuples into plain JSON values"""
+    if isinstance(value, dict):
+        return dict((str(name), _canonical(item)) for name, item in value.items())
+    if isinstance(value, np.ndarray):
+        return _canonical(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def scenario_key(params, version=''):
+    """Return the hex SHA-256 of the parameter dictionary *params* and code
+    *version*"""
+    text = json.dumps({'params': _canonical(params), 'version': version}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class ResultCache(object):
+    """A size bounded LRU cache of simulation results on disk with the
+    following properties:
+
+    Attributes:
+        directory: a string representing the cache directory
+        max_bytes: an int representing the size the cache is trimmed to
+        version: a string representing the code version mixed into every key
+        hits, misses, stores, evictions: ints counting the lookups found and
+            not found, the entries written and the entries deleted by this
+            object
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, version=''):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, params):
+        return scenario_key(params, self.version)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, params):
+        """Look up the run of *params*
+
+        Returns:
+            trajectory: memory mapped Trajectory of the cached run, with the
+                stored metrics in trajectory.meta['metrics'], or None when
+                the run is not cached
+        """
+        path = self._path(self.key(params))
+        try:
+            os.utime(os.path.join(path, 'meta.json'), None)     # most recently used
+            trajectory = open_trajectory(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return trajectory
+
+    def put(self, params, time, state, turn_control, metrics=None):
+        """Store a run of *params*
+
+        Args:
+            params: dictionary of every parameter of the run
+            time: array of shape (T,) of times in seconds
+            state: array of shape (T, N_VEHICLES, 4), time-major like
+                Trajectory.state
+            turn_control: array of shape (T, N_VEHICLES)
+            metrics: JSON serializable summary of the run
+
+        Returns:
+            path: the entry directory
+        """
+        key = self.key(params)
+        path = self._path(key)
+        temp = os.path.join(self.directory, '.tmp-{}-{}'.format(key, os.getpid()))
+        if not os.path.isdir(temp):
+            os.makedirs(temp)
+        try:
+            np.save(os.path.join(temp, 'time.npy'), np.asarray(time, dtype=np.float64))
+            np.save(os.path.join(temp, 'state.npy'), np.asarray(state, dtype=np.float64))
+            np.save(os.path.join(temp, 'turn_control.npy'), np.asarray(turn_control, dtype=np.int8))
+            with open(os.path.join(temp, 'meta.json'), 'w') as meta:
+                json.dump({'params': _canonical(params), 'version': self.version,
+                           'metrics': _canonical(metrics), 'N_VEHICLES': int(np.shape(state)[1])}, meta)
+            os.rename(temp, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(temp, ignore_errors=True)     # another worker stored it first
+        self.stores += 1
+        self.evict(keep=key)
+        return path
+
+    def get_or_run(self, params, run):
+        """Return the cached Trajectory of *params*, calling *run*() for
+        (time, state, turn_control, metrics) and storing them when it is not
+        cached yet"""
+        trajectory = self.get(params)
+        if trajectory is None:
+            self.put(params, *run())
+            trajectory = open_trajectory(self._path(self.key(params)))
+        return trajectory
+
+    def entries(self):
+        """Return a list of (last used time, bytes, key) of every entry"""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(path, 'meta.json'))
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            except OSError:
+                continue        # being evicted by another process
+            entries.append((used, size, key))
+        return entries
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries, other than *keep*, until
+        the cache fits in max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Delete every entry"""
+        for _, _, key in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def stats(self):
+        """Return a dictionary of the hit and miss counts and the cache size"""
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.,
+                'stores': self.stores, 'evictions': self.evictions,
+                'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
+
+def stage_params(module, overrides):
+    """Return every simulate() parameter of stage *module* (simStage2 or
+    simStage3) with *overrides* applied, plus the stage name"""
+    params = dict((name, parameter.default)
+                  for name, parameter in inspect.signature(module.simulate).parameters.items()
+                  if parameter.default is not inspect.Parameter.empty and name not in ('live', 'stop'))
+    unknown = set(overrides) - set(params)
+    if unknown:
+        raise KeyError('unknown parameters of {}.simulate: {}'.format(module.__name__, ', '.join(sorted(unknown))))
+    params.update(overrides)
+    params['stage'] = module.__name__
+    return params
+
+def cached_stage(module, cache, **overrides):
+    """Run simStage2 or simStage3 *module* through *cache*
+
+    Returns:
+        trajectory: memory mapped Trajectory of car A (vehicle 0) and car B
+            (vehicle 1), with metrics closest_approach and l2_overrides
+    """
+    params = stage_params(module, overrides)
+
+    def run():
+        simulate_args = dict(params)
+        del simulate_args['stage']
+        time, a, b = module.simulate(**simulate_args)
+        state = np.stack([a.state, b.state], axis=1)
+        turn_control = np.stack([a.turn_control, b.turn_control], axis=1)
+        separation = np.hypot(*(a.state[:, 0:2] - b.state[:, 0:2]).T)
+        metrics = {'closest_approach': float(separation.min()),
+                   'l2_overrides': int(np.count_nonzero(np.abs(b.turn_control) == 2))}
+        return time, state, turn_control, metrics
+    return cache.get_or_run(params, run)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or clear the simulation result cache')
+    parser.add_argument('--dir', default=DEFAULT_CACHE_DIR, help='cache directory')
+    parser.add_argument('--clear', action='store_true', help='delete every entry')
+    parser.add_argument('--max-mb', type=float, default=None, help='trim the cache to this size now')
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.dir)
+    if args.clear:
+        cache.clear()
+    if args.max_mb is not None:
+        cache.max_bytes = int(args.max_mb * 1e6)
+        cache.evict()
+    stats = cache.stats()
+    print('{}: {} entries, {:.1f} MB'.format(args.dir, stats['entries'], stats['bytes'] / 1e6))
+
+if __name__ == '__main__':
+    main()
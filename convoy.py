@@ -0,0 +1,233 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Convoy mode: a long chain of Stage 3 cars, each following the car ahead
+
+# Car 0 leads toward the bright light and car k follows car k - 1 with its own
+# delay of FOLLOW_STEPS[k - 1] steps, applying the minimum distance safety rule
+# of simStage3.py against the car ahead. Instead of every follower keeping
+# (or indexing) a full turn_control array like Vehicle and Swarm do, all cars
+# share one ring buffer of control history with one row per step and one
+# column per car, only as many rows as the longest delay needs. A follower's
+# control is the element of that buffer its delay points at, so one step of
+# the whole convoy is
+#   one slice copy between two rows, when every car has the same delay
+#   one np.take through precomputed flat offsets, when the delays differ
+# and the buffer and the working arrays are preallocated, so memory and time
+# per car stay flat as the convoy grows, apart from any recorded states.
+#
+# Without safety overrides, car k copies the leader's control from
+# leader_delay[k] = FOLLOW_STEPS[0] + ... + FOLLOW_STEPS[k - 1] steps ago,
+# see leader_delay and the check in __main__
+#
+# Example:
+#   convoy = Convoy(0.5, L1, L2, 0.2, INITIAL_STATES, FOLLOW_STEPS=5, TIME_STEP=0.1)
+#   state, turn_control = convoy.run(BRIGHT_LIGHT, 1000, record=True)
+
+import numpy as np
+
+from profiling import NULL_PROFILER
+from swarm import heading_sign, turn_velocity
+
+class Convoy(object):
+    """A leader and a chain of followers with the following properties:
+
+    Attributes:
+        N_VEHICLES: an int representing the number of cars, car 0 leads
+        FOLLOW_STEPS: an int array of the N_VEHICLES - 1 follow delays in
+            steps, car k follows car k - 1 by FOLLOW_STEPS[k - 1]
+        leader_delay: an int array of how many steps behind the leader's
+            control each car runs when no safety rule fires, 0 for car 0
+        SAFE_FOLLOW_DISTANCE: an array of each follower's safe follow
+            distance from the car ahead in meters
+        history: (H, N_VEHICLES) int8 ring buffer of turn controls, row
+            step % H holds every car's control at that step, H is the longest
+            delay plus one
+        state: the (N_VEHICLES, 4) array of current states
+            [posX, posY, velX, velY]
+        step: an int representing the number of steps run
+        profiler: the profiling.Profiler timing each phase of a step,
+            NULL_PROFILER (off) by default
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE,
+                 SAFE_FOLLOW_DISTANCE, INITIAL_STATES, FOLLOW_STEPS, TIME_STEP):
+        """Return a convoy with one car per row of *INITIAL_STATES*. The
+        vehicle constants are as in Swarm, a scalar or one value per car.
+        *FOLLOW_STEPS* is a scalar or one delay of at least 1 step per
+        follower
+        """
+        INITIAL_STATES = np.asarray(INITIAL_STATES, dtype=float)
+        self.N_VEHICLES = N = len(INITIAL_STATES)
+        self.TIME_STEP = TIME_STEP
+        self.CONSTANT_VELOCITY = np.broadcast_to(np.asarray(CONSTANT_VELOCITY, dtype=float), (N,))
+        L1_HEADING_CHANGE_PER_STEP = np.broadcast_to(np.asarray(L1_HEADING_CHANGE, dtype=float), (N,)) * TIME_STEP
+        L2_HEADING_CHANGE_PER_STEP = np.broadcast_to(np.asarray(L2_HEADING_CHANGE, dtype=float), (N,)) * TIME_STEP
+        self.L1_CONTROL_CROSS_TRACK_VELOCITY = self.CONSTANT_VELOCITY * np.sin(L1_HEADING_CHANGE_PER_STEP)
+        self.L1_CONTROL_ALONG_TRACK_VELOCITY = np.sqrt(self.CONSTANT_VELOCITY ** 2 - self.L1_CONTROL_CROSS_TRACK_VELOCITY ** 2)
+        self.L2_CONTROL_CROSS_TRACK_VELOCITY = self.CONSTANT_VELOCITY * np.sin(L2_HEADING_CHANGE_PER_STEP)
+        self.L2_CONTROL_ALONG_TRACK_VELOCITY = np.sqrt(self.CONSTANT_VELOCITY ** 2 - self.L2_CONTROL_CROSS_TRACK_VELOCITY ** 2)
+        self.SAFE_FOLLOW_DISTANCE = np.broadcast_to(np.asarray(SAFE_FOLLOW_DISTANCE, dtype=float), (N,))[1:]
+
+        self.FOLLOW_STEPS = np.broadcast_to(np.asarray(FOLLOW_STEPS, dtype=np.intp), (N - 1,)).copy()
+        if N > 1 and self.FOLLOW_STEPS.min() < 1:
+            raise ValueError('convoy followers need a delay of at least 1 step')
+        self.leader_delay = np.concatenate([[0], np.cumsum(self.FOLLOW_STEPS)])
+        H = int(self.FOLLOW_STEPS.max()) + 1 if N > 1 else 1
+        self.history = np.zeros((H, N), dtype=np.int8)
+        self._flat = self.history.reshape(-1)       # same memory as history
+        self._uniform = N > 1 and (self.FOLLOW_STEPS == self.FOLLOW_STEPS[0]).all()
+        # flat offset of the delayed control of the car ahead, relative to row 0
+        self._offset = (H - self.FOLLOW_STEPS) * N + np.arange(N - 1)
+        self._index = np.empty(N - 1, dtype=np.intp)
+
+        self.state = INITIAL_STATES.copy()
+        self.step = 0
+        self.profiler = NULL_PROFILER
+
+    def controls(self, step=None):
+        """Return a view of every car's turn control at *step* (the last one
+        run by default), *step* must be within the history"""
+        if step is None:
+            step = self.step
+        if not self.step - len(self.history) < step <= self.step:
+            raise IndexError('step {} is not in the control history'.format(step))
+        return self.history[step % len(self.history)]
+
+    def control_direction(self, bright_light):
+        """Determines every car's turn control for the next step: the leader
+        turns toward *bright_light*, followers copy the control of the car
+        ahead from their delay ago and turn away at level 2 if closer to it
+        than their safe follow distance
+
+        Returns:
+            control: view of the history row written, one control per car
+        """
+        step = self.step + 1
+        H, N = self.history.shape
+        row = step % H
+        control = self.history[row]
+        previous = self.state
+        profiler = self.profiler
+
+        # leader - is brighter light on left or right of body along track direction
+        with profiler.phase('leader rule'):
+            car_to_bright_light = bright_light - previous[0, 0:2]
+            control[0] = 1 if heading_sign(previous[0, 2:4], car_to_bright_light) >= 0 else -1
+        if N == 1:
+            return control
+
+        # followers - all delays at once, before a follower's delay has passed
+        # the ring row it reads has not been written yet and holds 0
+        with profiler.phase('follower delay'):
+            if self._uniform:
+                control[1:] = self.history[(step - self.FOLLOW_STEPS[0]) % H, :-1]
+            else:
+                np.add(self._offset, row * N, out=self._index)
+                np.remainder(self._index, H * N, out=self._index)
+                np.take(self._flat, self._index, out=control[1:])
+
+        # check safety rule and control away from the car ahead if too close,
+        # overriding previous control decision
+        with profiler.phase('safety rule'):
+            follower_to_leader = previous[:-1, 0:2] - previous[1:, 0:2]
+            radius = np.sqrt(follower_to_leader[:, 0] ** 2 + follower_to_leader[:, 1] ** 2)
+            too_close = radius <= self.SAFE_FOLLOW_DISTANCE
+            if too_close.any():
+                sign_of_heading_angle_to_leader = heading_sign(previous[1:, 2:4], follower_to_leader)
+                turn_away = np.where(sign_of_heading_angle_to_leader > 0, -2, 2)
+                control[1:][too_close] = turn_away[too_close]
+        return control
+
+    def new_state(self, control):
+        """Move every car one step under *control*, determining the next
+        velocity and integrating for position"""
+        with self.profiler.phase('integration'):
+            self.state[:, 2:4] = turn_velocity(
+                self.state[:, 2:4], control, self.CONSTANT_VELOCITY,
+                self.L1_CONTROL_ALONG_TRACK_VELOCITY, self.L1_CONTROL_CROSS_TRACK_VELOCITY,
+                self.L2_CONTROL_ALONG_TRACK_VELOCITY, self.L2_CONTROL_CROSS_TRACK_VELOCITY)
+
+            # integrate to determine inertial position
+            self.state[:, 0:2] += self.state[:, 2:4] * self.TIME_STEP
+        self.step += 1
+
+    def run(self, bright_light, N_STEPS, record=False):
+        """Run *N_STEPS* more steps
+
+        Args:
+            bright_light: [posX, posY] of the navigation goal
+            N_STEPS: an int representing the number of steps to run
+            record: when True keep and return every state and control
+
+        Returns:
+            state: (N_VEHICLES, N_STEPS + 1, 4) states, starting with the
+                current one, when *record* is True, otherwise None
+            turn_control: (N_VEHICLES, N_STEPS + 1) controls, same layout
+                as Swarm.turn_control
+        """
+        bright_light = np.asarray(bright_light, dtype=float)
+        state = turn_control = None
+        if record:
+            state = np.empty((self.N_VEHICLES, N_STEPS + 1, 4))
+            turn_control = np.empty((self.N_VEHICLES, N_STEPS + 1))
+            state[:, 0] = self.state
+            turn_control[:, 0] = self.controls()
+        for n in range(1, N_STEPS + 1):
+            control = self.control_direction(bright_light)
+            self.new_state(control)
+            if record:
+                state[:, n] = self.state
+                turn_control[:, n] = control
+        self.profiler.add_steps(N_STEPS)
+        return state, turn_control
+
+def line_up(N_VEHICLES, CONSTANT_VELOCITY, SPACING, CROSS_TRACK_SEPARATION=0.):
+    """Return (N_VEHICLES, 4) initial states of a convoy heading +Y from the
+    origin, *SPACING* meters apart, every other car offset in X by
+    *CROSS_TRACK_SEPARATION*"""
+    k = np.arange(N_VEHICLES)
+    INITIAL_STATES = np.zeros((N_VEHICLES, 4))
+    INITIAL_STATES[:, 0] = CROSS_TRACK_SEPARATION * (k % 2)
+    INITIAL_STATES[:, 1] = -SPACING * k
+    INITIAL_STATES[:, 3] = CONSTANT_VELOCITY
+    return INITIAL_STATES
+
+if __name__ == '__main__':
+    # check against the Swarm engine and the delayed leader control
+    from time import perf_counter
+
+    import simStage3
+    from swarm import Swarm
+
+    TIME_STEP = simStage3.TIME_STEP
+    V = simStage3.CONSTANT_VELOCITY
+    FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / TIME_STEP))
+    N_STEPS = 400
+    INITIAL_STATES = line_up(50, V, V * simStage3.FOLLOW_TIME, simStage3.INITIAL_CROSS_TRACK_SEPARATION)
+    convoy = Convoy(V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE,
+                    simStage3.SAFE_FOLLOW_DISTANCE, INITIAL_STATES, FOLLOW_STEPS, TIME_STEP)
+    state, turn_control = convoy.run(simStage3.BRIGHT_LIGHT, N_STEPS, record=True)
+    swarm = Swarm(V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE, simStage3.SAFE_FOLLOW_DISTANCE,
+                  INITIAL_STATES, np.arange(len(INITIAL_STATES)) - 1, N_STEPS + 1, TIME_STEP)
+    swarm.run(simStage3.BRIGHT_LIGHT, FOLLOW_STEPS, TIME_STEP)
+    print('same controls as Swarm: {}, largest state difference {:.2e}'.format(
+        np.array_equal(turn_control, swarm.turn_control), np.abs(state - swarm.state).max()))
+
+    # without the safety rule every car runs the leader's control late
+    delays = np.random.default_rng(1).integers(1, 8, len(INITIAL_STATES) - 1)
+    convoy = Convoy(V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE, -np.inf,
+                    INITIAL_STATES, delays, TIME_STEP)
+    _, turn_control = convoy.run(simStage3.BRIGHT_LIGHT, N_STEPS, record=True)
+    late = all(np.array_equal(turn_control[k, 1 + d:], turn_control[0, 1:N_STEPS + 1 - d])
+               for k, d in enumerate(convoy.leader_delay))
+    print('mixed delays follow the leader_delay: {}'.format(late))
+
+    for N_VEHICLES in (10, 100, 1000, 10000):
+        convoy = Convoy(V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE, simStage3.SAFE_FOLLOW_DISTANCE,
+                        line_up(N_VEHICLES, V, V * simStage3.FOLLOW_TIME), delays[0] + np.arange(N_VEHICLES - 1) % 3,
+                        TIME_STEP)
+        start = perf_counter()
+        convoy.run(simStage3.BRIGHT_LIGHT, 1000)
+        elapsed = perf_counter() - start
+        print('{:>6} cars: {:6.1f} us/step, {:5.3f} us/car/step, history {} bytes'.format(
+            N_VEHICLES, elapsed / 1000 * 1e6, elapsed / 1000 / N_VEHICLES * 1e6, convoy.history.nbytes))
@@ -0,0 +1,150 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Cooperative task scheduler for the pyboard scripts
+
+# A board loop that blocks in uart.read() for UART_READ_TIME runs everything
+# else at whatever rate the link allows. Scheduler instead runs small tasks
+# in turn, each giving the board back as soon as it is done:
+#   every()   calls a function at a fixed period, on deadlines counted from
+#             the start so the rate doesn't drift with the time the tasks
+#             take; a tick more than a period late is skipped and counted
+#   spawn()   runs a generator, every value it yields is the milliseconds to
+#             sleep before it goes on (0 to just let the others run)
+# Between tasks the board sleeps until the next deadline with pyb.udelay(), so
+# on the host pyb stand-in the virtual clock jumps there. Deadlines and the
+# per-task timing (runs, busy, worst run and worst lateness in microseconds)
+# come from pyb.micros(), the same on the board and on the host, where
+# host/cosim.py reports them for car B.
+#
+# Written without uasyncio: its sleeps don't go through pyb, so it would wait
+# in real time on the host instead of moving the virtual clock. Nothing here
+# allocates once the tasks exist
+#
+# Example:
+#   sched = Scheduler()
+#   sched.every('control', 100, control)
+#   sched.spawn('receive', receive())
+#   sched.run(switch)               # until the switch is pressed
+#   print(sched.report())
+
+import pyb
+
+def ticks_diff(end, start):
+    """Return *end* - *start* in microseconds of the pyb.micros() clock,
+    which wraps at 2 ** 30"""
+    diff = (end - start) & 0x3FFFFFFF
+    if diff >= 0x20000000:
+        diff -= 0x40000000
+    return diff
+
+class Task(object):
+    """One scheduled task with the following properties:
+
+    Attributes:
+        name: a string representing the task name
+        period_us: an int representing the microseconds between the runs of
+            an every() task, 0 for a spawn() task
+        due: pyb.micros() time of the next run
+        done: a bool, True once a spawn() generator has finished
+        runs: an int counting the runs
+        busy_us: an int summing the microseconds spent running
+        max_us: an int representing the longest run in microseconds
+        late_us: an int representing the latest start after the due time in
+            microseconds
+        skipped: an int counting the every() ticks skipped for being late
+    """
+
+    def __init__(self, name, period_us, due, function=None, generator=None):
+        self.name = name
+        self.period_us = period_us
+        self.due = due
+        self.done = False
+        self._function = function
+        self._generator = generator
+        self.runs = self.busy_us = self.max_us = self.late_us = self.skipped = 0
+
+class Scheduler(object):
+    """Cooperative round of tasks with the following properties:
+
+    Attributes:
+        tasks: list of the Task objects in the order added
+        idle_us: an int summing the microseconds spent waiting for a task
+    """
+
+    def __init__(self):
+        self.tasks = []
+        self.idle_us = 0
+
+    def every(self, name, period_ms, function):
+        """Call *function*() every *period_ms* milliseconds, the first time
+        straight away, and return its Task"""
+        task = Task(name, int(period_ms * 1000), pyb.micros(), function=function)
+        self.tasks.append(task)
+        return task
+
+    def spawn(self, name, generator):
+        """Run *generator* until it finishes, sleeping the milliseconds it
+        yields between its steps, and return its Task"""
+        task = Task(name, 0, pyb.micros(), generator=generator)
+        self.tasks.append(task)
+        return task
+
+    def run(self, stop=None):
+        """Run the tasks until *stop*() returns True (for a pyb.Switch) or every
+        task has finished"""
+        tasks = self.tasks
+        while stop is None or not stop():
+            # the task due first, ties go to the task added first
+            task = None
+            now = pyb.micros()
+            wait = 0
+            for candidate in tasks:
+                if candidate.done:
+                    continue
+                late = ticks_diff(now, candidate.due)
+                if task is None or late > wait:
+                    task = candidate
+                    wait = late
+            if task is None:
+                return
+            if wait < 0:
+                pyb.udelay(-wait)
+                self.idle_us -= wait
+                continue
+            self._run(task)
+
+    def _run(self, task):
+        """Run *task* once and work out when it is due next"""
+        start = pyb.micros()
+        late = ticks_diff(start, task.due)
+        if late > task.late_us:
+            task.late_us = late
+        if task.period_us:
+            task._function()
+            task.due = (task.due + task.period_us) & 0x3FFFFFFF
+            end = pyb.micros()
+            while ticks_diff(end, task.due) >= task.period_us:
+                task.due = (task.due + task.period_us) & 0x3FFFFFFF
+                task.skipped += 1
+        else:
+            try:
+                sleep_ms = next(task._generator)
+            except StopIteration:
+                task.done = True
+                sleep_ms = 0
+            end = pyb.micros()
+            task.due = (end + int(sleep_ms * 1000)) & 0x3FFFFFFF
+        busy = ticks_diff(end, start)
+        task.runs += 1
+        task.busy_us += busy
+        if busy > task.max_us:
+            task.max_us = busy
+
+    def report(self):
+        """Return a text table of the timing of every task"""
+        lines = ['{:<10} {:>8} {:>10} {:>8} {:>8} {:>8}'.format('task', 'runs', 'busy us', 'max us', 'late us', 'skipped')]
+        for task in self.tasks:
+            lines.append('{:<10} {:>8} {:>10} {:>8} {:>8} {:>8}'.format(
+                task.name, task.runs, task.busy_us, task.max_us, task.late_us, task.skipped))
+        lines.append('idle {} us'.format(self.idle_us))
+        return '\n'.join(lines)
@@ -0,0 +1,239 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Fixed-point dead reckoning of a car's position on the pyboard
+
+# Vehicle.new_state in simStage3.py gives the car a new velocity of
+#   along * u + control * cross * [-uY, uX]
+# from the unit heading u, with the along and cross track velocities of the
+# L1 or L2 control, then moves it TIME_STEP at that velocity. As
+# along ** 2 + cross ** 2 = CONSTANT_VELOCITY ** 2, that is the heading turned
+# by atan2(cross, along) at constant speed, so the board only needs to keep
+# integers:
+#   state[X], state[Y]  position in micrometers (+-1 km in a small int)
+#   state[HEADING]      heading angle in 1 / 2 ** 28 of a full turn from +X,
+#                       counterclockwise
+# Every step() adds the turn of the control to the heading and moves the
+# speed times the ticks along it, cos and sin coming from a quarter wave Q14
+# table with linear interpolation. An integer heading can't drift off unit
+# length the way a rotated Q14 vector does, and no sqrt is needed.
+#
+# _advance() is a MicroPython viper function: machine words, pointer access to
+# the arrays, no float and no allocation, so the kernel can run at a high
+# rate in the control loop. Under CPython host/micropython.py stands in for
+# the micropython module, its decorators do nothing and the same code is the
+# reference path that "python deadreckon.py" checks against the floating
+# point simulation (swarm.turn_velocity, the batched Vehicle.new_state) over
+# long runs, and benchmarks
+#
+# Example, on the pyboard (1 ms ticks, stepped with the elapsed time):
+#   reckon = DeadReckoner(0.5, math.radians(20), math.radians(30), 0.001)
+#   reckon.step(control, pyb.elapsed_millis(t_last))
+#   x_mm = reckon.state[X] // 1000
+# and from the command line:
+#   python deadreckon.py --steps 36000
+
+import math
+import sys
+from array import array
+
+try:
+    import micropython
+except ImportError:
+    # CPython outside host/board.py: load the stand-in from host/ by its path,
+    # leaving sys.path alone so the other host modules (pyb, board) stay hidden
+    import importlib.util
+    import os
+    _spec = importlib.util.spec_from_file_location(
+        'micropython', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'host', 'micropython.py'))
+    micropython = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(micropython)
+if sys.implementation.name != 'micropython':
+    ptr16 = micropython.ptr16               # viper builtins on the pyboard
+    ptr32 = micropython.ptr32
+
+X = 0
+Y = 1
+HEADING = 2
+ANGLE_BITS = 28
+FULL_TURN = 1 << ANGLE_BITS
+ONE = 1 << 14               # Q14 1.0
+UM_PER_M = 1000000
+
+def _sine_table():
+    """Return the Q14 sine of the first quarter turn in 256 steps, padded by
+    one entry so interpolation at the quarter turn stays in range"""
+    table = array('H', bytes(2 * 258))
+    for i in range(257):
+        table[i] = int(round(math.sin(0.5 * math.pi * i / 256) * ONE))
+    table[257] = table[256]
+    return table
+
+SINE = _sine_table()
+
+@micropython.viper
+def _advance(state, table, control: int, ticks: int):
+    # move state (see DeadReckoner) ticks ticks with turn control, -2 to 2
+    s = ptr32(state)
+    t = ptr16(table)
+    angle = (int(s[2]) + int(s[control + 6]) * ticks) & 0xFFFFFFF
+    distance = int(s[3]) * ticks
+
+    # sin, then cos as the sin of a quarter turn more
+    a = angle
+    r = a & 0x3FFFFFF
+    if a & 0x4000000:
+        r = 0x4000000 - r
+    i = r >> 18
+    low = int(t[i])
+    sin = low + (((int(t[i + 1]) - low) * (r & 0x3FFFF) + 0x20000) >> 18)
+    if a & 0x8000000:
+        sin = -sin
+    a = (angle + 0x4000000) & 0xFFFFFFF
+    r = a & 0x3FFFFFF
+    if a & 0x4000000:
+        r = 0x4000000 - r
+    i = r >> 18
+    low = int(t[i])
+    cos = low + (((int(t[i + 1]) - low) * (r & 0x3FFFF) + 0x20000) >> 18)
+    if a & 0x8000000:
+        cos = -cos
+
+    # distance * cos / ONE rounded, split so no product passes 2 ** 30
+    high = distance >> 8
+    low = distance & 0xFF
+    s[0] = int(s[0]) + ((high * cos + ((low * cos + 128) >> 8) + 32) >> 6)
+    s[1] = int(s[1]) + ((high * sin + ((low * sin + 128) >> 8) + 32) >> 6)
+    s[2] = angle
+
+class DeadReckoner(object):
+    """Fixed-point position of one car with the following properties:
+
+    Attributes:
+        state: array('i') of the position in micrometers and the heading, see
+            X, Y and HEADING, followed by the step distance and the turn of
+            every control used by the kernel
+        TICK: a float representing the seconds in one tick
+        STEP_UM: an int representing the micrometers driven per tick
+        TURN: list of the heading change per tick of the controls -2 to 2, in
+            1 / 2 ** 28 of a turn
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE, TICK,
+                 posX=0., posY=0., velX=0., velY=1.):
+        """Return a dead reckoner for a car of the Vehicle constants, stepped
+        in ticks of *TICK* seconds (TIME_STEP for one step per simulation
+        step), starting at *posX*, *posY* in meters heading along *velX*,
+        *velY*. Allocates, call it before the control loop"""
+        self.TICK = TICK
+        self.STEP_UM = int(round(CONSTANT_VELOCITY * TICK * UM_PER_M))
+        self.TURN = [0] * 5
+        for level, HEADING_CHANGE in ((1, L1_HEADING_CHANGE), (2, L2_HEADING_CHANGE)):
+            # the along and cross track velocities of Vehicle, as a heading change
+            CROSS_TRACK_VELOCITY = CONSTANT_VELOCITY * math.sin(HEADING_CHANGE * TICK)
+            ALONG_TRACK_VELOCITY = math.sqrt(CONSTANT_VELOCITY ** 2 - CROSS_TRACK_VELOCITY ** 2)
+            turn = int(round(math.atan2(CROSS_TRACK_VELOCITY, ALONG_TRACK_VELOCITY) / (2 * math.pi) * FULL_TURN))
+            self.TURN[2 + level] = turn
+            self.TURN[2 - level] = -turn
+        self.state = array('i', [0] * 9)
+        self.state[3] = self.STEP_UM
+        for k in range(5):
+            self.state[4 + k] = self.TURN[k]
+        self.reset(posX, posY, velX, velY)
+
+    def reset(self, posX, posY, velX, velY):
+        """Set the position in meters and the heading along *velX*, *velY*"""
+        self.state[X] = int(round(posX * UM_PER_M))
+        self.state[Y] = int(round(posY * UM_PER_M))
+        self.state[HEADING] = int(round(math.atan2(velY, velX) / (2 * math.pi) * FULL_TURN)) % FULL_TURN
+
+    def step(self, control, ticks=1):
+        """Turn with *control* (0, +-1 or +-2) and drive for *ticks* ticks,
+        at most 2 ** 24 micrometers. Allocates nothing"""
+        _advance(self.state, SINE, control, ticks)
+
+    def floats(self):
+        """Return [posX, posY, velX, velY] in meters and m/s, for the host"""
+        angle = 2 * math.pi * self.state[HEADING] / FULL_TURN
+        speed = self.STEP_UM / (self.TICK * UM_PER_M)
+        return [self.state[X] / UM_PER_M, self.state[Y] / UM_PER_M, speed * math.cos(angle), speed * math.sin(angle)]
+
+def benchmark(reckon, N_STEPS=10000):
+    """Return the microseconds per step() of *reckon*, on the pyboard or the
+    host"""
+    try:
+        from time import ticks_diff, ticks_us
+    except ImportError:
+        from time import perf_counter
+
+        def ticks_us():
+            return int(perf_counter() * 1e6)
+
+        def ticks_diff(end, start):
+            return end - start
+    step = reckon.step
+    start = ticks_us()
+    for k in range(N_STEPS):
+        step(1 if k & 4 else -1)
+    return ticks_diff(ticks_us(), start) / N_STEPS
+
+if __name__ == '__main__':
+    # host side check against the floating point dynamics and benchmark
+    import argparse
+
+    import numpy as np
+
+    import simStage3
+    from swarm import Swarm, turn_velocity
+
+    parser = argparse.ArgumentParser(description='Check the fixed-point kernel against the simulation')
+    parser.add_argument('--steps', type=int, default=36000, help='steps per run, 36000 is an hour at 10 Hz')
+    parser.add_argument('--runs', type=int, default=8, help='runs with random controls')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    V = simStage3.CONSTANT_VELOCITY
+    L1, L2 = simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE
+    TIME_STEP = simStage3.TIME_STEP
+    N = args.steps
+
+    # controls: random runs of 0, +-1 and +-2 held for up to 20 steps, and a
+    # Stage 3 leader driving to the light and circling it
+    random = np.random.default_rng(args.seed)
+    controls = np.repeat(random.integers(-2, 3, size=(args.runs, N)), random.integers(1, 21, size=N), axis=1)[:, :N]
+    leader = Swarm(V, L1, L2, 0., [[0., 0., 0., V]], [-1], N + 1, TIME_STEP)
+    leader.run(simStage3.BRIGHT_LIGHT, 1, TIME_STEP)
+    controls = np.vstack([controls, leader.turn_control[:, 1:].astype(int)])
+
+    # floating point reference, every run at once
+    start_state = np.array([0., 0., 0., V])
+    velocity = np.tile(start_state[2:4], (len(controls), 1))
+    position = np.zeros((len(controls), 2))
+    worst = np.zeros(len(controls))
+    reckoners = [DeadReckoner(V, L1, L2, TIME_STEP, *start_state) for _ in controls]
+    ms_reckoners = [DeadReckoner(V, L1, L2, 0.001, *start_state) for _ in controls]
+    TICKS = int(round(TIME_STEP / 0.001))
+    worst_ms = np.zeros(len(controls))
+    along_cross = []
+    for HEADING_CHANGE in (L1, L2):
+        CROSS = V * math.sin(HEADING_CHANGE * TIME_STEP)
+        along_cross += [math.sqrt(V ** 2 - CROSS ** 2), CROSS]
+    for k in range(N):
+        velocity = turn_velocity(velocity, controls[:, k], V, *along_cross)
+        position += velocity * TIME_STEP
+        for n, (reckon, ms_reckon) in enumerate(zip(reckoners, ms_reckoners)):
+            reckon.step(int(controls[n, k]))
+            ms_reckon.step(int(controls[n, k]), TICKS)
+        fixed = np.array([reckon.state[X:Y + 1] for reckon in reckoners]) / UM_PER_M
+        fixed_ms = np.array([reckon.state[X:Y + 1] for reckon in ms_reckoners]) / UM_PER_M
+        worst = np.maximum(worst, np.hypot(*(fixed - position).T))
+        worst_ms = np.maximum(worst_ms, np.hypot(*(fixed_ms - position).T))
+    heading = np.degrees(np.arctan2(velocity[:, 1], velocity[:, 0]))
+    fixed_heading = np.array([360. * reckon.state[HEADING] / FULL_TURN for reckon in reckoners])
+    heading_error = np.abs((fixed_heading - heading + 180.) % 360. - 180.)
+    travelled = N * V * TIME_STEP
+    print('{} steps ({:.0f} m driven) per run, worst position error:'.format(N, travelled))
+    for n in range(len(controls)):
+        name = 'leader' if n == args.runs else 'random {}'.format(n)
+        print('  {:<9} {:8.3f} mm, {:8.3f} mm in 1 ms ticks, final heading off {:.4f} deg'.format(
+            name, 1000 * worst[n], 1000 * worst_ms[n], heading_error[n]))
+    print('step() {:.2f} us under CPython'.format(benchmark(DeadReckoner(V, L1, L2, 0.001), 100000)))
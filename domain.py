@@ -0,0 +1,401 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Domain decomposition: a very large swarm stepped by several processes
+
+# Swarm steps every vehicle in one process. StripDomain splits the arena into
+# vertical strips, one per worker process, balanced by vehicle count when a
+# run starts. Every array lives in multiprocessing.shared_memory and is
+# indexed by vehicle, so a worker reads the state and control history of any
+# vehicle in place:
+#   state    (2, N, 4) previous and current [posX, posY, velX, velY], a worker
+#            only writes the rows of the vehicles it owns
+#   history  ring of the last FOLLOW_STEPS + 1 turn controls, the follower
+#            delay reads the row of the followed vehicle wherever it is
+# Each step a worker publishes, in its own mailbox, the vehicles that left
+# its strip and its halo: the vehicles within HALO (the largest safe follow
+# distance) of either edge. Its neighbours take the vehicles that moved in
+# and use the halo in their UniformGrid, so the check_neighbours safety rule
+# sees vehicles across strip edges. Migrating a vehicle moves only its index,
+# its state and history stay where they are. Two barriers per step keep the
+# mailboxes and the state buffers from being overwritten while read.
+#
+# The rules are those of Swarm (one FOLLOW_STEPS of at least 1 for all
+# followers) and the result matches it, see the check in __main__. Strips are
+# kept at least HALO plus one step of travel wide, so fewer workers run when
+# the vehicles are bunched up
+#
+# Example:
+#   domain = StripDomain(0.5, L1, L2, 0.2, INITIAL_STATES, leader_index,
+#                        FOLLOW_STEPS=5, TIME_STEP=0.1, N_WORKERS=8)
+#   domain.run(BRIGHT_LIGHT, 1000)
+#   print(domain.state, domain.migrations)
+#   domain.close()
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from spatial import UniformGrid, safety_neighbours, nearest
+from swarm import heading_sign, turn_velocity
+
+# mailbox slots of every worker
+TO_LEFT, TO_RIGHT, HALO_LEFT, HALO_RIGHT = range(4)
+
+# rows of the shared constants array
+CONSTANTS = ['CONSTANT_VELOCITY', 'L1_ALONG', 'L1_CROSS', 'L2_ALONG', 'L2_CROSS', 'SAFE_FOLLOW_DISTANCE']
+
+def strip_edges(x, N_WORKERS, MIN_WIDTH):
+    """
+    Args:
+        x: array of vehicle X positions
+        N_WORKERS: an int representing the most strips to make
+        MIN_WIDTH: a float representing the narrowest strip allowed, apart
+            from the open ended first and last strip
+
+    Returns:
+        edges: array of strip edges from -inf to inf, strip k holds
+            edges[k] <= x < edges[k + 1], each with about as many vehicles
+    """
+    inner = np.quantile(x, np.arange(1, N_WORKERS) / float(N_WORKERS)) if len(x) else []
+    edges = [-np.inf]
+    for edge in inner:
+        if len(edges) == 1 or edge - edges[-1] >= MIN_WIDTH:
+            edges.append(edge)
+    return np.array(edges + [np.inf])
+
+class StripDomain(object):
+    """A swarm of leader and follower vehicles stepped by worker processes,
+    one per strip of the arena, with the following properties:
+
+    Attributes:
+        N_VEHICLES: an int representing the number of vehicles
+        N_WORKERS: an int representing the most worker processes a run uses
+        FOLLOW_STEPS: an int representing the steps a follower is behind
+        TIME_STEP: a float representing the step length in seconds
+        HALO: a float representing the width in meters of the band along a
+            strip edge shared with the neighbouring strip
+        check_neighbours: a bool, True when followers keep their safe follow
+            distance from every vehicle, as in Swarm
+        edges: array of the strip edges of the last run, see strip_edges()
+        state: (N_VEHICLES, 4) view of the current states in shared memory
+        step: an int representing the number of steps run
+        l2_overrides: an int counting the level 2 turns of the last run
+        migrations: an int counting the vehicles that changed strip in the
+            last run
+        owned: an int array of the vehicles in each strip at the end of the
+            last run
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE,
+                 SAFE_FOLLOW_DISTANCE, INITIAL_STATES, leader_index, FOLLOW_STEPS,
+                 TIME_STEP, N_WORKERS=None, check_neighbours=True):
+        """Return a domain with one vehicle per row of *INITIAL_STATES*. The
+        vehicle constants and *leader_index* are as in Swarm, *FOLLOW_STEPS*
+        is at least 1 and *N_WORKERS* is every core when None
+        """
+        INITIAL_STATES = np.asarray(INITIAL_STATES, dtype=float)
+        self.N_VEHICLES = N = len(INITIAL_STATES)
+        self.N_WORKERS = N_WORKERS or multiprocessing.cpu_count()
+        if FOLLOW_STEPS < 1:
+            raise ValueError('followers need a delay of at least 1 step')
+        self.FOLLOW_STEPS = FOLLOW_STEPS
+        self.TIME_STEP = TIME_STEP
+        self.check_neighbours = check_neighbours
+        leader_index = np.asarray(leader_index, dtype=np.int64)
+        if leader_index.shape != (N,):
+            raise ValueError('leader_index needs one entry per vehicle')
+
+        per_vehicle = lambda value: np.broadcast_to(np.asarray(value, dtype=float), (N,))
+        V = per_vehicle(CONSTANT_VELOCITY)
+        L1_CROSS = V * np.sin(per_vehicle(L1_HEADING_CHANGE) * TIME_STEP)
+        L2_CROSS = V * np.sin(per_vehicle(L2_HEADING_CHANGE) * TIME_STEP)
+        SAFE = per_vehicle(SAFE_FOLLOW_DISTANCE)
+        self.HALO = max(float(SAFE.max()), 0.) if N else 0.
+        self._min_width = self.HALO + (float(V.max()) * TIME_STEP if N else 0.)
+
+        self._blocks = {}
+        self._arrays = {}
+        self._layout = {}
+        H = FOLLOW_STEPS + 1
+        W = self.N_WORKERS
+        self._share('state', (2, N, 4), np.float64)
+        self._share('history', (H, N), np.int8)
+        self._share('constants', (len(CONSTANTS), N), np.float64)
+        self._share('leader_index', (N,), np.int64)
+        # room for every vehicle in every mailbox, only the pages written to
+        # take memory
+        self._share('boxes', (W, 4, N), np.int64)
+        self._share('counts', (W, 4), np.int64)
+        self._share('stats', (W, 3), np.int64)
+        self._arrays['state'][0] = INITIAL_STATES
+        self._arrays['history'][:] = 0
+        self._arrays['constants'][:] = [V, np.sqrt(V ** 2 - L1_CROSS ** 2), L1_CROSS,
+                                        np.sqrt(V ** 2 - L2_CROSS ** 2), L2_CROSS, SAFE]
+        self._arrays['leader_index'][:] = leader_index
+        self.step = 0
+        self.edges = np.array([-np.inf, np.inf])
+        self.l2_overrides = self.migrations = 0
+        self.owned = np.array([N])
+
+    def _share(self, name, shape, dtype):
+        """Allocate a shared memory array, recorded by block name for the
+        workers to attach to"""
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self._blocks[name] = block
+        self._arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+        self._layout[name] = (block.name, shape, np.dtype(dtype).str)
+
+    @property
+    def state(self):
+        return self._arrays['state'][self.step % 2]
+
+    def controls(self):
+        """Return a view of every vehicle's turn control at the last step"""
+        return self._arrays['history'][self.step % (self.FOLLOW_STEPS + 1)]
+
+    def run(self, bright_light, N_STEPS):
+        """Run *N_STEPS* more steps with the light at *bright_light*, the
+        strips balanced again for the current positions
+
+        Returns:
+            state: (N_VEHICLES, 4) view of the states after the run
+        """
+        if N_STEPS <= 0:
+            return self.state
+        self.edges = strip_edges(self.state[:, 0], self.N_WORKERS, self._min_width)
+        W = len(self.edges) - 1
+        params = {'edges': self.edges, 'HALO': self.HALO, 'FOLLOW_STEPS': self.FOLLOW_STEPS,
+                  'TIME_STEP': self.TIME_STEP, 'check_neighbours': self.check_neighbours,
+                  'bright_light': np.asarray(bright_light, dtype=float),
+                  'first': self.step + 1, 'stop': self.step + N_STEPS + 1}
+        self._arrays['stats'][:] = 0
+        if W == 1:
+            _Strip(0, self._arrays, params).run(None)
+        else:
+            barrier = multiprocessing.Barrier(W)
+            workers = [multiprocessing.Process(target=_strip_worker, args=(w, self._layout, barrier, params))
+                       for w in range(W)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            failed = [w for w, worker in enumerate(workers) if worker.exitcode != 0]
+            if failed:
+                raise RuntimeError('strip workers {} failed'.format(failed))
+        self.step += N_STEPS
+        stats = self._arrays['stats'][:W]
+        self.l2_overrides = int(stats[:, 0].sum())
+        self.migrations = int(stats[:, 1].sum())
+        self.owned = stats[:, 2].copy()
+        return self.state
+
+    def close(self):
+        """Free the shared memory, the domain can't be run afterwards. Copy
+        state first to keep it"""
+        self._arrays = {}
+        for block in self._blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                pass        # a view is still held, the memory goes with it
+            block.unlink()
+        self._blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _strip_worker(w, layout, barrier, params):
+    """Worker process body: attach to the shared arrays and run strip *w*"""
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in layout.values()]
+    try:
+        arrays = dict((key, np.ndarray(shape, dtype, buffer=block.buf))
+                      for (key, (_, shape, dtype)), block in zip(layout.items(), blocks))
+        _Strip(w, arrays, params).run(barrier)
+    except BaseException:
+        barrier.abort()     # release the other workers
+        raise
+    finally:
+        arrays = None
+        for block in blocks:
+            block.close()
+
+class _Strip(object):
+    """The vehicles of one strip and their constants, local to a worker"""
+
+    def __init__(self, w, arrays, params):
+        self.w = w
+        self.arrays = arrays
+        self.params = params
+        self.W = len(params['edges']) - 1
+        self.low, self.high = params['edges'][w], params['edges'][w + 1]
+        first = params['first']
+        x = arrays['state'][(first - 1) % 2, :, 0]
+        self.ids = np.flatnonzero((x >= self.low) & (x < self.high))
+        self._gather(self.ids)
+        self.halo = np.zeros(0, dtype=np.intp)
+        self.outgoing = np.zeros(0, dtype=np.intp)
+        self.grid = UniformGrid(params['HALO']) if params['check_neighbours'] and params['HALO'] > 0 else None
+        self.l2_overrides = 0
+        self.migrations = 0
+
+    def _gather(self, ids):
+        """Local copies of the constants of vehicles *ids*"""
+        self.constants = self.arrays['constants'][:, ids]
+        self.followed = self.arrays['leader_index'][ids]
+        self.is_leader = self.followed < 0
+
+    def publish(self, previous):
+        """Post the vehicles that left the strip and the halo of each edge"""
+        boxes, counts = self.arrays['boxes'][self.w], self.arrays['counts'][self.w]
+        x = self.arrays['state'][previous, self.ids, 0]
+        left, right = x < self.low, x >= self.high
+        moved = left | right
+        out = [self.ids[left], self.ids[right]]
+        if moved.any():
+            keep = ~moved
+            self.ids = self.ids[keep]
+            self.constants = self.constants[:, keep]
+            self.followed = self.followed[keep]
+            self.is_leader = self.is_leader[keep]
+            x = x[keep]
+        self.outgoing = np.concatenate(out)
+        halo = [self.ids[x < self.low + self.params['HALO']], self.ids[x >= self.high - self.params['HALO']]]
+        for slot, ids in zip((TO_LEFT, TO_RIGHT, HALO_LEFT, HALO_RIGHT), out + halo):
+            boxes[slot, :len(ids)] = ids
+            counts[slot] = len(ids)
+
+    def receive(self):
+        """Take the vehicles that moved in and the neighbouring halos"""
+        boxes, counts = self.arrays['boxes'], self.arrays['counts']
+        incoming, halo = [], [self.outgoing]
+        if self.w > 0:
+            incoming.append(boxes[self.w - 1, TO_RIGHT, :counts[self.w - 1, TO_RIGHT]])
+            halo.append(boxes[self.w - 1, HALO_RIGHT, :counts[self.w - 1, HALO_RIGHT]])
+        if self.w < self.W - 1:
+            incoming.append(boxes[self.w + 1, TO_LEFT, :counts[self.w + 1, TO_LEFT]])
+            halo.append(boxes[self.w + 1, HALO_LEFT, :counts[self.w + 1, HALO_LEFT]])
+        incoming = np.concatenate(incoming) if incoming else np.zeros(0, dtype=np.intp)
+        if len(incoming):
+            self.ids = np.concatenate([self.ids, incoming])
+            self._gather(self.ids)
+            self.migrations += len(incoming)
+        self.halo = np.concatenate(halo)
+
+    def advance(self, step):
+        """Determine the turn controls of the strip's vehicles at *step* and
+        move them, as Swarm.control_direction() and Swarm.new_state()"""
+        state, history = self.arrays['state'], self.arrays['history']
+        F = self.params['FOLLOW_STEPS']
+        H = F + 1
+        previous = state[(step - 1) % 2, self.ids]
+        control = np.zeros(len(self.ids), dtype=np.int8)
+        V, L1_ALONG, L1_CROSS, L2_ALONG, L2_CROSS, SAFE = self.constants
+
+        # leaders - is brighter light on left or right of body along track direction
+        leaders = self.is_leader
+        car_to_bright_light = self.params['bright_light'] - previous[leaders, 0:2]
+        control[leaders] = np.where(heading_sign(previous[leaders, 2:4], car_to_bright_light) >= 0, 1, -1)
+
+        # followers - control of the followed vehicle FOLLOW_STEPS ago, from
+        # whichever strip it is in
+        followers = np.flatnonzero(~leaders)
+        if step >= F:
+            control[followers] = history[(step - F) % H, self.followed[followers]]
+
+        # safety rule, level 2 turn away when too close
+        if self.params['check_neighbours']:
+            if self.grid is not None and len(followers):
+                halo = state[(step - 1) % 2, self.halo]
+                self.grid.build(np.concatenate([previous[:, 0:2], halo[:, 0:2]]))
+                velocities = np.concatenate([previous[:, 2:4], halo[:, 2:4]])
+                i, j, distance, sign = safety_neighbours(self.grid, velocities,
+                                                         np.append(SAFE, np.zeros(len(halo))), followers)
+                if len(i):
+                    closest = nearest(i, distance)
+                    control[i[closest]] = np.where(sign[closest] > 0, -2, 2)
+                    self.l2_overrides += len(closest)
+        elif len(followers):
+            follower_to_leader = state[(step - 1) % 2, self.followed[followers], 0:2] - previous[followers, 0:2]
+            radius = np.sqrt(follower_to_leader[:, 0] ** 2 + follower_to_leader[:, 1] ** 2)
+            too_close = radius <= SAFE[followers]
+            if too_close.any():
+                sign_of_heading_angle_to_leader = heading_sign(previous[followers, 2:4], follower_to_leader)
+                control[followers[too_close]] = np.where(sign_of_heading_angle_to_leader[too_close] > 0, -2, 2)
+                self.l2_overrides += int(too_close.sum())
+
+        history[step % H, self.ids] = control
+        velocity = turn_velocity(previous[:, 2:4], control, V, L1_ALONG, L1_CROSS, L2_ALONG, L2_CROSS)
+        current = state[step % 2]
+        current[self.ids, 2:4] = velocity
+        current[self.ids, 0:2] = previous[:, 0:2] + velocity * self.params['TIME_STEP']
+
+    def run(self, barrier):
+        """Step the strip through the run, exchanging with the neighbouring
+        strips before every step (*barrier* is None for a single strip)"""
+        for step in range(self.params['first'], self.params['stop']):
+            if barrier is not None:
+                self.publish((step - 1) % 2)
+                barrier.wait()      # every mailbox written
+                self.receive()
+                barrier.wait()      # every mailbox read
+            self.advance(step)
+        self.arrays['stats'][self.w] = [self.l2_overrides, self.migrations, len(self.ids)]
+
+if __name__ == '__main__':
+    # check against Swarm, then time a large swarm with 1, 2, ... workers
+    from time import perf_counter
+
+    import simStage3
+    from swarm import Swarm
+
+    def scatter(N_VEHICLES, SIZE, seed=0):
+        """Random leaders and followers behind the vehicle they follow"""
+        rng = np.random.default_rng(seed)
+        V = simStage3.CONSTANT_VELOCITY
+        leader_index = np.arange(N_VEHICLES) - 1
+        leader_index[rng.random(N_VEHICLES) < 0.1] = -1
+        leader_index[0] = -1
+        heading = rng.uniform(0, 2 * np.pi, N_VEHICLES)
+        INITIAL_STATES = np.c_[rng.uniform(0, SIZE, (N_VEHICLES, 2)), V * np.cos(heading), V * np.sin(heading)]
+        for k in np.flatnonzero(leader_index >= 0):
+            ahead = INITIAL_STATES[k - 1]
+            INITIAL_STATES[k] = ahead
+            INITIAL_STATES[k, 0:2] -= ahead[2:4] * simStage3.FOLLOW_TIME
+            INITIAL_STATES[k, 0] += rng.normal(0, 0.1)
+        return INITIAL_STATES, leader_index
+
+    TIME_STEP = simStage3.TIME_STEP
+    FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / TIME_STEP))
+    constants = (simStage3.CONSTANT_VELOCITY, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE,
+                 simStage3.SAFE_FOLLOW_DISTANCE)
+    INITIAL_STATES, leader_index = scatter(3000, 20.)
+    light = np.array([10., 10.])
+    N_STEPS = 200
+    for check_neighbours in (True, False):
+        swarm = Swarm(*constants, INITIAL_STATES=INITIAL_STATES, leader_index=leader_index, N_STEPS=N_STEPS + 1,
+                      TIME_STEP=TIME_STEP, check_neighbours=check_neighbours)
+        swarm.run(light, FOLLOW_STEPS, TIME_STEP)
+        with StripDomain(*constants, INITIAL_STATES=INITIAL_STATES, leader_index=leader_index,
+                         FOLLOW_STEPS=FOLLOW_STEPS, TIME_STEP=TIME_STEP, N_WORKERS=4,
+                         check_neighbours=check_neighbours) as domain:
+            domain.run(light, N_STEPS // 2)
+            domain.run(light, N_STEPS - N_STEPS // 2)      # strips balanced again
+            print('check_neighbours={}: same controls as Swarm: {}, largest state difference {:.2e}, '
+                  '{} migrations, {} strips'.format(
+                      check_neighbours, np.array_equal(domain.controls(), swarm.turn_control[:, -1]),
+                      np.abs(domain.state - swarm.state[:, -1]).max(), domain.migrations, len(domain.owned)))
+
+    INITIAL_STATES, leader_index = scatter(200000, 400.)
+    for N_WORKERS in sorted(set([1, 2, 4, multiprocessing.cpu_count()])):
+        with StripDomain(*constants, INITIAL_STATES=INITIAL_STATES, leader_index=leader_index,
+                         FOLLOW_STEPS=FOLLOW_STEPS, TIME_STEP=TIME_STEP, N_WORKERS=N_WORKERS) as domain:
+            start = perf_counter()
+            domain.run(light, 50)
+            elapsed = perf_counter() - start
+        print('{:>7} vehicles, {:>2} workers: {:7.1f} ms/step'.format(len(INITIAL_STATES), N_WORKERS,
+                                                                     elapsed / 50 * 1e3))
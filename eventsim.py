@@ -0,0 +1,299 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Event driven Stage 3 simulation: jump from one control change to the next
+
+# The stepped simulations do the same work every TIME_STEP even though a
+# vehicle's turn control often stays put for many steps. Between changes a
+# vehicle follows an arc in closed form (integrators.py), so EventSim only
+# stops at the steps where a control can change:
+#   leaders      the step the bang-bang rule flips, from the roots of a sine
+#                (Arc.first_flip)
+#   followers    FOLLOW_STEPS after the followed vehicle changed control, and
+#                the next step the safety rule could trigger. Two vehicles
+#                close in at most (V_follower + V_leader) * TIME_STEP per step,
+#                so from a distance d the rule can't trigger for
+#                ceil((d - SAFE_FOLLOW_DISTANCE) / ((V_f + V_l) TIME_STEP))
+#                steps. Inside the safe distance it is checked every step.
+#                While both turn at the same rate (the follower copying the
+#                leader's control), their distance is a sinusoid, and when its
+#                minimum is clear no check is needed until either one changes
+#                control
+# The rules are the ones of Swarm (and simStage3.py) without check_neighbours,
+# so a mission costs work in proportion to its control switches instead of
+# TIME_FINAL / TIME_STEP. A leader chattering left/right while heading at the
+# light still switches every step or two, but circling or holding a turn is
+# free
+#
+# Run "python eventsim.py" for a check against Swarm and a timing comparison
+
+import cmath
+import heapq
+import math
+
+import numpy as np
+
+from integrators import DiscreteArcIntegrator
+
+class EventSim(object):
+    """An event driven leader/follower simulation with the following
+    properties:
+
+    Attributes:
+        N_VEHICLES: an int representing the number of vehicles
+        CONSTANT_VELOCITY, SAFE_FOLLOW_DISTANCE: arrays of each vehicle's
+            constant velocity magnitude in m/s and safe follow distance in
+            meters
+        leader_index: an int array with -1 for leaders and the index of the
+            vehicle being followed for followers
+        TIME_STEP: a float representing the step length in seconds
+        integrators: list of each vehicle's integrator
+        segments: list per vehicle of (step, turn_control, arc), the control
+            from *step* on and the Arc it follows from the state at step - 1
+        events: an int counting the control evaluations of the last run
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE,
+                 SAFE_FOLLOW_DISTANCE, INITIAL_STATES, leader_index, TIME_STEP,
+                 integrator=DiscreteArcIntegrator):
+        """Return a simulation of the vehicles in *INITIAL_STATES* with the
+        same arguments as Swarm, except that no number of steps is needed.
+        *integrator* is the integrator class building every vehicle's arcs"""
+        INITIAL_STATES = np.asarray(INITIAL_STATES, dtype=float)
+        self.N_VEHICLES = N = len(INITIAL_STATES)
+        self.CONSTANT_VELOCITY = np.broadcast_to(np.asarray(CONSTANT_VELOCITY, dtype=float), (N,))
+        L1_HEADING_CHANGE = np.broadcast_to(np.asarray(L1_HEADING_CHANGE, dtype=float), (N,))
+        L2_HEADING_CHANGE = np.broadcast_to(np.asarray(L2_HEADING_CHANGE, dtype=float), (N,))
+        self.SAFE_FOLLOW_DISTANCE = np.broadcast_to(np.asarray(SAFE_FOLLOW_DISTANCE, dtype=float), (N,))
+        self.leader_index = np.asarray(leader_index, dtype=np.intp)
+        if self.leader_index.shape != (N,):
+            raise ValueError('leader_index needs one entry per vehicle')
+        self.TIME_STEP = TIME_STEP
+        self.integrators = [integrator(float(self.CONSTANT_VELOCITY[k]), float(L1_HEADING_CHANGE[k]),
+                                       float(L2_HEADING_CHANGE[k]), TIME_STEP) for k in range(N)]
+        self.INITIAL_STATES = INITIAL_STATES
+        self.events = 0
+        self._reset()
+
+        # followers of every vehicle, and how deep each vehicle is in the
+        # follow chain so a step is evaluated leaders first
+        self._followers_of = [[] for _ in range(N)]
+        for follower, followed in enumerate(self.leader_index.tolist()):
+            if followed >= 0:
+                self._followers_of[followed].append(follower)
+        self._depth = []
+        for k in range(N):
+            depth, j = 0, int(self.leader_index[k])
+            while j >= 0 and depth < N:
+                depth, j = depth + 1, int(self.leader_index[j])
+            self._depth.append(depth)
+
+    def _reset(self):
+        """Every vehicle back to its initial state with no control"""
+        self.segments = [[(1, 0, self.integrators[k].arc(self.INITIAL_STATES[k], 0))]
+                         for k in range(self.N_VEHICLES)]
+        self._starts = [[1] for _ in range(self.N_VEHICLES)]
+
+    def _segment(self, vehicle, step):
+        """Index of the segment holding the control of *step*"""
+        return max(0, np.searchsorted(self._starts[vehicle], step, side='right') - 1)
+
+    def control_at(self, vehicle, step):
+        """Turn control of *vehicle* at *step*, 0 before the first step"""
+        if step < 1:
+            return 0
+        start, control, _ = self.segments[vehicle][self._segment(vehicle, step)]
+        return control if step >= start else 0
+
+    def _position_at(self, vehicle, step):
+        """Complex position of *vehicle* after *step*, and its velocity scaled
+        to CONSTANT_VELOCITY"""
+        start, _, arc = self.segments[vehicle][self._segment(vehicle, step + 1)]
+        n = step - (start - 1)
+        return complex(arc.position(n)), arc.velocity * cmath.exp(1j * arc.h * n)
+
+    def state_at(self, step):
+        """Return the (N_VEHICLES, 4) states after *step*"""
+        states = np.empty((self.N_VEHICLES, 4))
+        for k in range(self.N_VEHICLES):
+            start, _, arc = self.segments[k][self._segment(k, step + 1)]
+            states[k] = arc.state(step - (start - 1))
+        return states
+
+    def run(self, bright_light, FOLLOW_STEPS, N_STEPS):
+        """Run the simulation for the steps up to N_STEPS - 1, the same span
+        as Swarm.run() over N_STEPS states. With a FOLLOW_STEPS of 0 a
+        follower of a follower copies that follower's control of the same
+        step, where Swarm copies all followers at once and reads 0"""
+        self._reset()
+        target = complex(bright_light[0], bright_light[1])
+        last = N_STEPS - 1
+        is_leader = (self.leader_index < 0).tolist()
+        leader_index = self.leader_index.tolist()
+        # bounds on how fast a follower and the vehicle it follows close in:
+        # at most their summed speed, and from their relative velocity now
+        # plus how far both headings can turn
+        turning = [integrator.CONSTANT_VELOCITY * max(abs(integrator.L1_HEADING_CHANGE_PER_STEP),
+                                                      abs(integrator.L2_HEADING_CHANGE_PER_STEP))
+                   for integrator in self.integrators]
+        closing = [(float(self.CONSTANT_VELOCITY[k]) + float(self.CONSTANT_VELOCITY[max(j, 0)])) * self.TIME_STEP
+                   for k, j in enumerate(leader_index)]
+        turning = [(turning[k] + turning[max(j, 0)]) * self.TIME_STEP for k, j in enumerate(leader_index)]
+        evaluated = [0] * self.N_VEHICLES
+        heap = [(1, self._depth[k], k) for k in range(self.N_VEHICLES)]
+        heapq.heapify(heap)
+        self.events = 0
+
+        while heap:
+            step, depth, vehicle = heapq.heappop(heap)
+            if step > last:
+                break
+            if evaluated[vehicle] == step:
+                continue
+            evaluated[vehicle] = step
+            self.events += 1
+            start, control, arc = self.segments[vehicle][-1]
+            n = step - start            # the state at step - 1 along the arc
+
+            if is_leader[vehicle]:
+                # bright light on the left or the right of the heading
+                new_control = 1 if arc.cross_to(target, n) >= 0 else -1
+            else:
+                followed = leader_index[vehicle]
+                new_control = self.control_at(followed, step - FOLLOW_STEPS)
+                position = complex(arc.position(n))
+                velocity = complex(arc.velocity_at(n))
+                leader_position, leader_velocity = self._position_at(followed, step - 1)
+                follower_to_leader = leader_position - position
+                radius = abs(follower_to_leader)
+                too_close = radius <= self.SAFE_FOLLOW_DISTANCE[vehicle]
+                if too_close:
+                    sign_of_heading_angle_to_leader = (velocity.conjugate() * follower_to_leader).imag
+                    new_control = -2 if sign_of_heading_angle_to_leader > 0 else 2
+
+            if new_control != control:
+                arc = self.integrators[vehicle].arc(arc.state(n), new_control)
+                start, n = step, 0
+                self.segments[vehicle].append((step, new_control, arc))
+                self._starts[vehicle].append(step)
+                for follower in self._followers_of[vehicle]:
+                    # the follower copies this change later, and its distance
+                    # to this vehicle changes from the next state
+                    heapq.heappush(heap, (step + FOLLOW_STEPS, self._depth[follower], follower))
+                    heapq.heappush(heap, (step + 1, self._depth[follower], follower))
+
+            # next step this vehicle's own rule could change its control
+            if is_leader[vehicle]:
+                flip = arc.first_flip(target, new_control > 0, last - start, n + 1)
+                if flip is not None:
+                    heapq.heappush(heap, (start + flip, depth, vehicle))
+            elif too_close:
+                heapq.heappush(heap, (step + 1, depth, vehicle))
+            elif self._clear_on_arcs(vehicle, arc, start, followed, step):
+                pass        # nothing until one of the two changes control
+            else:
+                heapq.heappush(heap, (step + self._steps_clear(
+                    radius - self.SAFE_FOLLOW_DISTANCE[vehicle], closing[vehicle], turning[vehicle],
+                    abs(leader_velocity - arc.velocity * cmath.exp(1j * arc.h * n)) * self.TIME_STEP),
+                    depth, vehicle))
+
+    def _clear_on_arcs(self, vehicle, arc, start, followed, step):
+        """Return True when *vehicle*, on *arc* from the state at start - 1,
+        stays farther than its safe follow distance from *followed* at every
+        state from step - 1 on for as long as both keep their control. Only
+        decided for two arcs turning at the same rate, as when a follower
+        copies its leader, where the distance is a sinusoid or hyperbola"""
+        other_start, _, other = self.segments[followed][self._segment(followed, step)]
+        if other.h != arc.h:
+            return False
+        if arc.radius_vector is None:
+            # straight lines, relative position a + m w m steps after step - 1
+            n = step - start
+            a = complex(other.position(step - other_start)) - complex(arc.position(n))
+            w = (other.velocity - arc.velocity) * self.TIME_STEP
+            m = max(0., -(w.conjugate() * a).real / abs(w) ** 2) if w else 0.
+            closest = abs(a + m * w)
+        else:
+            # circles of the same rate, relative position a + d e^{i h k}
+            a = other.center - arc.center
+            d = (other.radius_vector * cmath.exp(-1j * other.h * (other_start - 1))
+                 - arc.radius_vector * cmath.exp(-1j * arc.h * (start - 1)))
+            closest = abs(abs(a) - abs(d))
+        return closest > self.SAFE_FOLLOW_DISTANCE[vehicle] * (1 + 1e-9)
+
+    @staticmethod
+    def _steps_clear(gap, closing, turning, relative):
+        """Return the first step the distance between two vehicles could
+        shrink by *gap*, when it closes by at most *closing* per step, or by
+        at most relative + n * turning at step n"""
+        linear = gap / closing
+        # relative * m + turning * m (m + 1) / 2 >= gap
+        b = relative + turning / 2
+        if turning > 0:
+            quadratic = (-b + math.sqrt(b * b + 2 * turning * gap)) / turning
+        else:
+            quadratic = gap / relative if relative > 0 else float('inf')
+        return max(1, int(math.ceil(max(linear, quadratic) - 1e-9)))
+
+    def switches(self):
+        """Return the number of control changes in the last run"""
+        return sum(len(segments) - 1 for segments in self.segments)
+
+    def dense(self, N_STEPS):
+        """Return state (N_VEHICLES, N_STEPS, 4) and turn_control
+        (N_VEHICLES, N_STEPS) arrays like Swarm.state and Swarm.turn_control"""
+        state = np.empty((self.N_VEHICLES, N_STEPS, 4))
+        turn_control = np.zeros((self.N_VEHICLES, N_STEPS))
+        for k in range(self.N_VEHICLES):
+            state[k, 0] = self.INITIAL_STATES[k]
+            segments = self.segments[k]
+            for s, (start, control, arc) in enumerate(segments):
+                stop = segments[s + 1][0] if s + 1 < len(segments) else N_STEPS
+                if start >= N_STEPS:
+                    break
+                stop = min(stop, N_STEPS)
+                state[k, start:stop] = arc.state(np.arange(1, stop - start + 1))
+                turn_control[k, start:stop] = control
+        return state, turn_control
+
+if __name__ == '__main__':
+    # host side check against the stepped Swarm and a timing comparison
+    from time import perf_counter
+
+    import simStage3
+    from integrators import ContinuousArcIntegrator
+    from swarm import Swarm
+
+    def stage3(engine, TIME_FINAL, **kwargs):
+        TIME_STEP = simStage3.TIME_STEP
+        V = simStage3.CONSTANT_VELOCITY
+        FOLLOW_DISTANCE = V * simStage3.FOLLOW_TIME
+        states = [[0, 0, 0, V], [simStage3.INITIAL_CROSS_TRACK_SEPARATION, -FOLLOW_DISTANCE, 0, V]]
+        N_STEPS = int(round(TIME_FINAL / TIME_STEP)) + 1
+        args = (V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE,
+                [0, simStage3.SAFE_FOLLOW_DISTANCE], states, [-1, 0])
+        if engine is Swarm:
+            return Swarm(*(args + (N_STEPS, TIME_STEP))), N_STEPS
+        return EventSim(*(args + (TIME_STEP,)), **kwargs), N_STEPS
+
+    FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / simStage3.TIME_STEP))
+    for TIME_FINAL in (simStage3.TIME_FINAL, 600.):
+        swarm, N_STEPS = stage3(Swarm, TIME_FINAL)
+        start = perf_counter()
+        swarm.run(simStage3.BRIGHT_LIGHT, FOLLOW_STEPS, simStage3.TIME_STEP)
+        stepped_time = perf_counter() - start
+
+        sim, _ = stage3(EventSim, TIME_FINAL)
+        start = perf_counter()
+        sim.run(simStage3.BRIGHT_LIGHT, FOLLOW_STEPS, N_STEPS)
+        event_time = perf_counter() - start
+        state, turn_control = sim.dense(N_STEPS)
+        assert np.array_equal(turn_control, swarm.turn_control)
+        error = np.abs(state - swarm.state).max()
+        print('{:.0f} s mission, {} steps: {} switches, {} events, max state difference {:.1e}'.format(
+            TIME_FINAL, N_STEPS - 1, sim.switches(), sim.events, error))
+        print('  stepped {:.3f} s, event driven {:.4f} s ({:.0f}x)'.format(
+            stepped_time, event_time, stepped_time / event_time))
+
+    sim, N_STEPS = stage3(EventSim, simStage3.TIME_FINAL, integrator=ContinuousArcIntegrator)
+    sim.run(simStage3.BRIGHT_LIGHT, FOLLOW_STEPS, N_STEPS)
+    print('continuous arcs: final states\n{}'.format(sim.state_at(N_STEPS - 1)))
@@ -5,6 +5,7 @@
 
 # import modules
 import pyb
+from sdlog import BinaryLog
 
 # creating objects
 green = pyb.LED(2)          # create green LED object
@@ -20,8 +21,7 @@ adc_photo1 = pyb.ADC(pin_photo1_X12)
 
 # initialize data collection 
 green.on()                          # shows recording data
-log = open('/sd/log.csv', 'w+')     # open file on SD 
-log.write('{},{}\n'.format("t","L1"))   # write column descriptions to file 
+log = BinaryLog('/sd/log.bin', ("t", "L1"), 'IH')   # binary log on SD, decode with logreader.py
 
 # setup buffer to send for flashing light on slave
 # buffer = b'1'      # light starts on
@@ -33,7 +33,7 @@ uart.write(b'1')
 while not switch():
     t = pyb.millis()                            # get time
     val_photo1 = adc_photo1.read()              # read value from photo sensor 1
-    log.write('{},{}\n'.format(t,val_photo1))   # write data to file       
+    log.write2(t, val_photo1)                   # buffer record, whole blocks go to the file
     pyb.delay(100)                              # sample about 10 Hz
 #    if buffer == b'1':                          # make buffer toggle high and low
 #        buffer = b'0'
@@ -44,6 +44,6 @@ while not switch():
 #    uart.write(buffer)
     
 # end after switch press
-log.close()                         # close file
+log.close()                         # write buffered records and close file
 green.off()                         # green LED off shows file closed
 pyb.delay(200)                      # delay avoids detection of multiple presses
\ No newline at end of file
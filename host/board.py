@@ -0,0 +1,184 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Run the pyboard scripts on the host against the pyb stand-in in host/pyb.py
+
+# The script runs unmodified: "import pyb" finds host/pyb.py, the repo root is
+# on the import path for sdlog.py, ringbuffer.py and friends, and files opened
+# under /sd or /flash land in host directories. Time is virtual, so a run of an
+# hour of board time finishes in seconds
+#
+# Example, from the command line:
+#   python host/board.py pitlStage1.py --duration 3600000 --sd /tmp/sd
+#   python host/board.py loopback.py --wire 4:2
+#   python host/board.py pitlStage2carB.py --set CONTROL_TIME=50
+#   python host/board.py boot.py --start-ms 0 --duration 1000   # boot, then pyb.main() script
+
+import argparse
+import ast
+import builtins
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+for path in (REPO_DIR, HOST_DIR):       # host/pyb.py must win over any real pyb
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+
+import pyb
+
+_real_open = builtins.open
+_patch_lock = threading.Lock()
+_patch_depth = 0
+
+def _board_open(file, mode='r', *args, **kwargs):
+    """open() that maps /sd and /flash to the calling thread's board
+    directories"""
+    if isinstance(file, str):
+        board = pyb.current_board()
+        for prefix, root in (('/sd/', board.sd_dir), ('/flash/', board.flash_dir)):
+            if file.startswith(prefix):
+                if root is None:
+                    raise OSError('no {} directory for board {}'.format(prefix.strip('/'), board.name))
+                file = os.path.join(root, file[len(prefix):])
+                break
+    return _real_open(file, mode, *args, **kwargs)
+
+@contextmanager
+def board_files():
+    """Route /sd and /flash paths through the active boards while inside"""
+    global _patch_depth
+    with _patch_lock:
+        if _patch_depth == 0:
+            builtins.open = _board_open
+        _patch_depth += 1
+    try:
+        yield
+    finally:
+        with _patch_lock:
+            _patch_depth -= 1
+            if _patch_depth == 0:
+                builtins.open = _real_open
+
+def script_path(script):
+    """Resolve a script name relative to the repo root"""
+    if os.path.exists(script):
+        return script
+    return os.path.join(REPO_DIR, script)
+
+def compile_script(script, constants=None):
+    """Compile a board script, replacing the values of its top level
+    constants
+
+    Args:
+        script: script file, relative to the repo root or a path
+        constants: dictionary of constant name (e.g. 'DELAY_TIME') to the value
+            to assign instead of the one written in the script
+
+    Returns:
+        code: code object of the script
+        replaced: set of the names in *constants* the script assigns
+    """
+    path = script_path(script)
+    with _real_open(path) as source:
+        tree = ast.parse(source.read(), path)
+    replaced = set()
+    for node in tree.body:
+        if (constants and isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id in constants):
+            name = node.targets[0].id
+            node.value = ast.copy_location(ast.Constant(constants[name]), node.value)
+            replaced.add(name)
+    return compile(tree, path, 'exec'), replaced
+
+def run_script(script, board, follow_main=True, constants=None):
+    """Run a board script on *board* in the calling thread
+
+    Args:
+        script: script file, relative to the repo root or a path
+        board: the pyb.Board to run it on
+        follow_main: when the script selects another one with pyb.main() (as
+            boot.py does), run that one next like the pyboard does
+        constants: dictionary of top level constants to override, see
+            compile_script()
+
+    Returns:
+        namespace: the module globals the last script finished with
+    """
+    board.activate()
+    try:
+        with board_files():
+            while True:
+                board.main_script = None
+                code, _ = compile_script(script, constants)
+                namespace = {'__name__': '__main__', '__file__': script_path(script),
+                             '__builtins__': builtins}
+                exec(code, namespace)
+                if not (follow_main and board.main_script):
+                    return namespace
+                script = board.main_script
+    finally:
+        board.deactivate()
+
+def parse_constant(text):
+    """Split a NAME=value command line assignment, the value is read as a
+    Python literal"""
+    name, _, value = text.partition('=')
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError('bad value for {}: {}'.format(name, value))
+
+def make_board(args, name='pyboard'):
+    """Build a Board from the command line options"""
+    for directory in (args.sd, args.flash):
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+    adc_source = None
+    if args.adc is not None:
+        level = args.adc
+        adc_source = lambda pin, t: level
+    return pyb.Board(name, clock=pyb.VirtualClock(args.start_ms * 1000),
+                     switch_press_ms=args.start_ms + args.duration, adc_source=adc_source,
+                     sd_dir=args.sd, flash_dir=args.flash)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a pyboard script on the host with virtual time')
+    parser.add_argument('script', help='board script, e.g. pitlStage1.py')
+    parser.add_argument('--duration', type=int, default=10000,
+                        help='ms of board time before the user switch is pressed')
+    parser.add_argument('--start-ms', type=int, default=2000,
+                        help='board time in ms when the script starts, boot.py takes about 2 s')
+    parser.add_argument('--sd', default=os.path.join(tempfile.gettempdir(), 'pyboard_sd'),
+                        help='host directory for /sd')
+    parser.add_argument('--flash', default=None, help='host directory for /flash')
+    parser.add_argument('--adc', type=int, default=None, help='constant ADC reading')
+    parser.add_argument('--wire', action='append', default=[], metavar='TX:RX',
+                        help='connect UART TX bus to UART RX bus on the board')
+    parser.add_argument('--set', action='append', default=[], type=parse_constant,
+                        metavar='NAME=VALUE', help='override a constant of the script, e.g. DELAY_TIME=50')
+    args = parser.parse_args(argv)
+
+    board = make_board(args)
+    for wire in args.wire:
+        tx_bus, rx_bus = [int(bus) for bus in wire.split(':')]
+        board.wire(tx_bus, rx_bus)
+
+    start = perf_counter()
+    run_script(args.script, board, constants=dict(args.set))
+    elapsed = perf_counter() - start
+    board_s = board.now_us() / 1e6
+    print('{}: {:.1f} s of board time in {:.2f} s ({:.0f}x real time)'.format(
+        args.script, board_s, elapsed, board_s / elapsed if elapsed else float('inf')))
+    for number, led in sorted(board.leds.items()):
+        print('  LED {} {} after {} changes'.format(number, 'on' if led.lit else 'off', led.changes))
+    for bus, uart in sorted(board.uarts.items()):
+        print('  UART {} sent {} bytes, {} receive overflows'.format(bus, uart.sent, uart.overflows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Run car A and car B together on the host, talking over a simulated UART link
+
+# Like loopback.py, car A's UART4 drives car B's UART2, but the two boards are
+# pitlStage2carA.py and pitlStage2carB.py running unmodified in one process,
+# each in its own thread on the host pyb stand-in. A LockstepClock keeps them
+# on one virtual time line: only the board with the earliest wake time runs,
+# so every byte reaches car B exactly when the link says it arrives. The
+# SerialLink between them adds latency, jitter, byte loss and corruption.
+#
+# A run reports what car B saw: the delay from car A's control decision to car
+# B applying it, how often car B logged code 2 (nothing or part of a frame) or
+# code 3 (garbage) instead of a control, the loop rate it achieved and how late
+# its control ticks ran. A single run also prints the timing of car B's tasks
+# (coop.py). Batches of link configurations run across a process pool like
+# sweep.py
+#
+# Example, from the command line:
+#   python host/cosim.py --set LOSS=0.01 --set CONTROL_TIME=50
+#   python host/cosim.py --grid LOSS=0,0.001,0.01 --grid BAUDRATE=9600,19200 --out link.csv
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+
+from board import parse_constant, run_script, compile_script
+import pyb
+
+import numpy as np
+
+from logreader import read_log
+from sweep import save_table
+
+CAR_A_SCRIPT = 'pitlStage2carA.py'
+CAR_B_SCRIPT = 'pitlStage2carB.py'
+CAR_A_UART = 4
+CAR_B_UART = 2
+
+# link and script settings of a run
+DEFAULT_LINK = {
+    'BAUDRATE': 9600,           # bits per second, both UARTs
+    'LATENCY_US': 0,            # fixed delay added to every byte
+    'JITTER_US': 0,             # extra delay, uniform from 0 to this
+    'LOSS': 0.,                 # probability a byte never arrives
+    'CORRUPT': 0.,              # probability a byte arrives with a bit flipped
+    'UART_READ_TIME': 100,      # ms, car A constant
+    'DELAY_TIME': 0,            # ms, car A constant
+    'CONTROL_TIME': 100,        # ms, car B constant
+    'FOLLOW_TIME': 1000,        # ms, car B constant
+    'BATCH_SAMPLES': 4,         # car A constant
+    'DURATION_MS': 20000,       # board time until the switches are pressed
+    'SEED': 0,                  # link random seed
+}
+# settings that are constants of the board scripts
+SCRIPT_CONSTANTS = ['UART_READ_TIME', 'DELAY_TIME', 'CONTROL_TIME', 'FOLLOW_TIME', 'BATCH_SAMPLES']
+
+# metrics reported for every run
+METRICS = ['control_delay_mean', 'control_delay_max', 'latency_mean', 'latency_p95',
+           'missing_rate', 'garbage_rate', 'loop_rate', 'control_late_max', 'frames_sent', 'frames_received',
+           'frames_lost', 'crc_errors', 'thread_switches']
+
+class SerialLink(object):
+    """A noisy serial connection with the following properties:
+
+    Attributes:
+        latency_us: an int representing the delay added to every byte
+        jitter_us: an int representing the largest random extra delay
+        loss: probability a byte is dropped
+        corrupt: probability a byte has one bit flipped
+        dropped, corrupted: ints counting the bytes affected
+    """
+
+    def __init__(self, latency_us=0, jitter_us=0, loss=0., corrupt=0., seed=None):
+        self.latency_us = latency_us
+        self.jitter_us = jitter_us
+        self.loss = loss
+        self.corrupt = corrupt
+        self.dropped = 0
+        self.corrupted = 0
+        self._random = random.Random(seed)
+
+    def transmit(self, data, start_us, byte_us):
+        """Return a list of (arrival_us, byte) for the bytes of *data* that
+        get through, sent from *start_us* taking *byte_us* per byte. The
+        receiving UART keeps them in order whatever the jitter"""
+        rand = self._random.random
+        arrivals = []
+        for k, byte in enumerate(data):
+            if self.loss and rand() < self.loss:
+                self.dropped += 1
+                continue
+            if self.corrupt and rand() < self.corrupt:
+                byte ^= 1 << self._random.randrange(8)
+                self.corrupted += 1
+            arrival = start_us + (k + 1) * byte_us + self.latency_us
+            if self.jitter_us:
+                arrival += int(rand() * self.jitter_us)
+            arrivals.append((arrival, byte))
+        return arrivals
+
+class LockstepClock(pyb.VirtualClock):
+    """A virtual clock shared by boards running in their own threads
+
+    Each board waits for its wake time, and only the board with the earliest
+    one (the first added on a tie) runs, so board time never goes backwards
+    and the boards interleave exactly as they would in real time. A board
+    waiting on its UART is woken early when bytes are queued for it.
+
+    Attributes:
+        switches: an int counting the hand overs between boards
+    """
+
+    def __init__(self, start_us=0):
+        pyb.VirtualClock.__init__(self, start_us)
+        self._cond = threading.Condition()
+        self._wake = {}             # running boards to their wake time
+        self._order = {}            # boards to the order they were added
+        self._rx_wait = {}          # boards blocked in a UART read to that UART
+        self._running = None
+        self.switches = 0
+
+    def add(self, board):
+        """Schedule *board* to start at the current time"""
+        with self._cond:
+            self._order[board] = len(self._order)
+            self._wake[board] = self.now_us
+
+    def _hand_over(self, board):
+        """Run the board due next, then block *board* until it is due"""
+        due = min(self._wake, key=lambda b: (self._wake[b], self._order[b]))
+        self.now_us = self._wake[due]
+        if due is not self._running:
+            self._running = due
+            self.switches += 1
+            self._cond.notify_all()
+        while self._running is not board:
+            self._cond.wait()
+
+    def enter(self, board):
+        """Block the calling thread until *board* is due"""
+        with self._cond:
+            while self._running is not board:
+                self._cond.wait()
+
+    def start(self):
+        """Let the first board run"""
+        with self._cond:
+            due = min(self._wake, key=lambda b: (self._wake[b], self._order[b]))
+            self.now_us = self._wake[due]
+            self._running = due
+            self._cond.notify_all()
+
+    def leave(self, board):
+        """Remove a finished *board* and run the next one"""
+        with self._cond:
+            del self._wake[board]
+            if self._wake:
+                due = min(self._wake, key=lambda b: (self._wake[b], self._order[b]))
+                self.now_us = self._wake[due]
+                self._running = due
+            else:
+                self._running = None
+            self._cond.notify_all()
+
+    def sleep_until(self, board, t_us):
+        with self._cond:
+            self._wake[board] = max(t_us, self.now_us)
+            self._hand_over(board)
+
+    def wait_rx(self, board, uart, deadline_us):
+        with self._cond:
+            arrival = uart.next_arrival()
+            self._rx_wait[board] = uart
+            self._wake[board] = max(self.now_us, deadline_us if arrival is None else min(arrival, deadline_us))
+            self._hand_over(board)
+            del self._rx_wait[board]
+
+    def rx_queued(self, board, uart):
+        with self._cond:
+            if self._rx_wait.get(board) is uart:
+                arrival = max(uart.next_arrival(), self.now_us)
+                if arrival < self._wake[board]:
+                    self._wake[board] = arrival
+
+def run_together(jobs, clock):
+    """Run board scripts side by side on a shared LockstepClock
+
+    Args:
+        jobs: list of (script, board, constants) with every board on *clock*
+        clock: the LockstepClock
+
+    Returns:
+        namespaces: the module globals each script finished with, in the
+            order of *jobs*
+    """
+    namespaces = [None] * len(jobs)
+    errors = []
+
+    def body(k, script, board, constants):
+        clock.enter(board)
+        try:
+            namespaces[k] = run_script(script, board, constants=constants)
+        except BaseException as error:
+            errors.append((board.name, error))
+        finally:
+            clock.leave(board)
+
+    threads = []
+    for k, (script, board, constants) in enumerate(jobs):
+        clock.add(board)
+        threads.append(threading.Thread(target=body, args=(k, script, board, constants)))
+    for thread in threads:
+        thread.start()
+    clock.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        name, error = errors[0]
+        raise RuntimeError('{} failed: {!r}'.format(name, error))
+    return namespaces
+
+def link_config(**overrides):
+    """Return a full run configuration: DEFAULT_LINK with *overrides*"""
+    unknown = set(overrides) - set(DEFAULT_LINK)
+    if unknown:
+        raise KeyError('unknown link settings: {}'.format(', '.join(sorted(unknown))))
+    config = dict(DEFAULT_LINK)
+    config.update(overrides)
+    return config
+
+def grid(spec):
+    """
+    Args:
+        spec: dictionary of setting name to a list of values to try
+
+    Returns:
+        configs: list of run configurations, one per combination of the
+            values in *spec*
+    """
+    names = sorted(spec)
+    return [link_config(**dict(zip(names, values)))
+            for values in itertools.product(*[spec[name] for name in names])]
+
+def cosimulate(config, start_ms=2000, sd_dir=None):
+    """Run car A and car B over a SerialLink as described by *config*
+
+    Args:
+        config: run configuration, see link_config()
+        start_ms: board time in ms when both scripts start
+        sd_dir: host directory for car B's /sd, a temporary one if None,
+            car A's /sd is its carA subdirectory
+
+    Returns:
+        records: car B's control log as a structured array
+        car_a, car_b: the module globals the two scripts finished with
+        clock: the LockstepClock of the run
+    """
+    constants = dict((name, config[name]) for name in SCRIPT_CONSTANTS)
+    for script in (CAR_A_SCRIPT, CAR_B_SCRIPT):
+        compile_script(script)      # fail early on a missing script
+    clock = LockstepClock(start_ms * 1000)
+    switch_ms = start_ms + int(config['DURATION_MS'])
+    link = SerialLink(config['LATENCY_US'], config['JITTER_US'], config['LOSS'],
+                      config['CORRUPT'], config['SEED'])
+    temp_dir = None
+    if sd_dir is None:
+        sd_dir = temp_dir = tempfile.mkdtemp(prefix='cosim_sd_')
+    try:
+        car_a_sd = os.path.join(sd_dir, 'carA')
+        if not os.path.isdir(car_a_sd):
+            os.makedirs(car_a_sd)
+        car_a = pyb.Board('car A', clock, switch_press_ms=switch_ms, baudrate=int(config['BAUDRATE']),
+                          sd_dir=car_a_sd)
+        car_b = pyb.Board('car B', clock, switch_press_ms=switch_ms, baudrate=int(config['BAUDRATE']),
+                          sd_dir=sd_dir)
+        car_a.wire(CAR_A_UART, CAR_B_UART, rx_board=car_b, link=link)
+        car_a_globals, car_b_globals = run_together(
+            [(CAR_A_SCRIPT, car_a, constants), (CAR_B_SCRIPT, car_b, constants)], clock)
+        records = np.array(read_log(os.path.join(sd_dir, 'control_log.bin')))
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return records, car_a_globals, car_b_globals, clock
+
+def summarize(records, car_a, car_b, clock):
+    """Return the metrics of a finished run as a tuple ordered like METRICS,
+    times in ms and rates in Hz"""
+    t = records['t'].astype(float)
+    control_a = records['controlA']
+    t_a = records['tA'].astype(float)
+    valid = np.flatnonzero(np.abs(control_a) == 1)
+    latency = t[valid] - t_a[valid]             # age of car A's sample when received
+
+    # car B applies the history entry delay_steps loops old, so the control
+    # delay is from car A taking that sample to car B using it
+    delay_steps = car_b['delay_steps']
+    used = valid[valid + delay_steps < len(t)]
+    control_delay = t[used + delay_steps] - t_a[used]
+
+    decoder = car_b['decoder']
+    n = max(len(records), 1)
+    return (control_delay.mean() if len(control_delay) else np.nan,
+            control_delay.max() if len(control_delay) else np.nan,
+            latency.mean() if len(latency) else np.nan,
+            np.percentile(latency, 95) if len(latency) else np.nan,
+            np.count_nonzero(control_a == 2) / n,
+            np.count_nonzero(control_a == 3) / n,
+            (len(t) - 1) * 1000. / (t[-1] - t[0]) if len(t) > 1 and t[-1] > t[0] else np.nan,
+            car_b['scheduler'].tasks[0].late_us / 1000.,
+            car_a['encoder'].seq,
+            decoder.frames,
+            decoder.lost,
+            decoder.crc_errors,
+            clock.switches)
+
+def _run_one(config):
+    """Worker body: run one configuration and return its metrics"""
+    return summarize(*cosimulate(config))
+
+def batch(configs, processes=None, chunksize=None):
+    """Run every configuration across a process pool
+
+    Args:
+        configs: list of run configurations, see link_config() and grid()
+        processes: number of worker processes, every core if None
+        chunksize: configurations handed to a worker at a time, picked from
+            the number of configurations and workers if None
+
+    Returns:
+        table: structured array with one row per configuration holding its
+            settings and METRICS
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, len(configs) // (processes * 4))
+    if processes == 1:
+        results = list(map(_run_one, configs))
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_one, configs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    names = sorted(DEFAULT_LINK)
+    counts = METRICS[8:]
+    dtype = ([(name, float) for name in names] + [(name, float) for name in METRICS[:8]]
+             + [(name, int) for name in counts])
+    table = np.zeros(len(configs), dtype=dtype)
+    for name in names:
+        table[name] = [config[name] for config in configs]
+    if results:
+        table[METRICS] = np.array([tuple(metrics) for metrics in results], dtype=table[METRICS].dtype)
+    return table
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run car A and car B together over a simulated UART link')
+    parser.add_argument('--set', action='append', default=[], type=parse_constant,
+                        metavar='NAME=VALUE', help='one setting for every run, see DEFAULT_LINK')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='values to try for a setting')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--out', default=None, help='csv file for the results table')
+    args = parser.parse_args(argv)
+
+    fixed = dict(args.set)
+    spec = dict((name, [value]) for name, value in fixed.items())
+    for text in args.grid:
+        name, _, values = text.partition('=')
+        spec[name] = [parse_constant('{}={}'.format(name, value))[1] for value in values.split(',')]
+    configs = grid(spec)
+    if len(configs) == 1 and not args.out:
+        records, car_a, car_b, clock = cosimulate(configs[0])
+        for name, value in zip(METRICS, summarize(records, car_a, car_b, clock)):
+            print('{}: {:.6g}'.format(name, value))
+        print(car_b['scheduler'].report())
+        return
+    table = batch(configs, args.processes)
+    if args.out:
+        save_table(table, args.out)
+    if len(table) == 1:
+        for name in METRICS:
+            print('{}: {:.6g}'.format(name, table[name][0]))
+    elif not args.out:
+        print(','.join(table.dtype.names))
+        for row in table:
+            print(','.join('{:.6g}'.format(value) for value in row.tolist()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Host side stand-in for the MicroPython micropython module
+
+# On the pyboard @micropython.viper and @micropython.native switch the
+# compiler to machine code emitters, and ptr8/ptr16/ptr32 are builtins of
+# viper functions. Under CPython the decorators return the function unchanged
+# and the pointers are the buffers themselves, so the same source (e.g.
+# deadreckon.py) runs as plain Python on the host
+
+def viper(function):
+    return function
+
+def native(function):
+    return function
+
+def const(value):
+    return value
+
+def ptr8(buf):
+    return buf
+
+def ptr16(buf):
+    return buf
+
+def ptr32(buf):
+    return buf
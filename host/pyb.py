@@ -0,0 +1,437 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Host side stand-in for the MicroPython pyb module
+
+# Lets the board scripts (boot.py, follow.py, pitlStage*.py, loopback.py,
+# slave.py) run unmodified under CPython. Nothing here waits in real time:
+# pyb.delay(), UART timeouts and UART transmit times advance a virtual clock,
+# so an hour of board time runs as fast as the Python in the loop allows.
+# Run the scripts through host/board.py, which puts this module first on the
+# import path and maps /sd and /flash to host directories
+#
+# Every call goes to the Board bound to the calling thread (see
+# Board.activate), so more than one board can share a process
+
+import threading
+from collections import deque
+
+_local = threading.local()
+_default_board = None
+
+def current_board():
+    """Return the Board of the calling thread, creating a default one for
+    scripts run without a runner"""
+    global _default_board
+    board = getattr(_local, 'board', None)
+    if board is None:
+        if _default_board is None:
+            _default_board = Board()
+        board = _default_board
+    return board
+
+class VirtualClock(object):
+    """A virtual microsecond clock with the following properties:
+
+    Attributes:
+        now_us: an int representing the current board time in microseconds
+    """
+
+    def __init__(self, start_us=0):
+        self.now_us = start_us
+
+    def advance(self, board, us):
+        """Spend *us* microseconds of board time"""
+        self.sleep_until(board, self.now_us + us)
+
+    def sleep_until(self, board, t_us):
+        """Block *board* until time *t_us*, a single board just jumps there"""
+        if t_us > self.now_us:
+            self.now_us = t_us
+
+    def wait_rx(self, board, uart, deadline_us):
+        """Block *board* until *uart* has a byte or *deadline_us* passes"""
+        arrival = uart.next_arrival()
+        self.sleep_until(board, deadline_us if arrival is None else min(arrival, deadline_us))
+
+    def rx_queued(self, board, uart):
+        """Called when bytes are queued for *uart* of *board*, nothing to do
+        when only one board is running"""
+        pass
+
+class Wire(object):
+    """An ideal serial connection: every byte arrives as soon as its last bit
+    has been sent"""
+
+    def transmit(self, data, start_us, byte_us):
+        """Return a list of (arrival_us, byte) for *data* sent from *start_us*
+        taking *byte_us* per byte"""
+        return [(start_us + (k + 1) * byte_us, byte) for k, byte in enumerate(data)]
+
+class Board(object):
+    """A virtual pyboard with the following properties:
+
+    Attributes:
+        name: a string representing the board name
+        clock: the VirtualClock driving the board
+        switch_press_ms: board time in ms from which the user switch reads
+            pressed, never pressed when None
+        adc_source: callable(pin_name, millis) returning a 12 bit ADC reading
+        sd_dir, flash_dir: host directories standing in for /sd and /flash
+        call_us: microseconds of board time spent in every pyb call, so a
+            busy loop without delays still moves time forward
+        baudrate: when set, every UART runs at this rate whatever the script
+            asks for, to try other link speeds without editing the scripts
+        leds: dictionary of LED number to LED
+        uarts: dictionary of UART bus to UART
+        main_script: script selected with pyb.main(), if any
+        usb: mode selected with pyb.usb_mode(), if any
+    """
+
+    def __init__(self, name='pyboard', clock=None, switch_press_ms=None,
+                 adc_source=None, sd_dir=None, flash_dir=None, call_us=1, baudrate=None):
+        self.name = name
+        self.clock = clock or VirtualClock()
+        self.switch_press_ms = switch_press_ms
+        self.adc_source = adc_source
+        self.sd_dir = sd_dir
+        self.flash_dir = flash_dir
+        self.call_us = call_us
+        self.baudrate = baudrate
+        self.leds = {}
+        self.uarts = {}
+        self.main_script = None
+        self.usb = None
+
+    def activate(self):
+        """Bind this board to the calling thread"""
+        _local.board = self
+        return self
+
+    def deactivate(self):
+        _local.board = None
+
+    def now_us(self):
+        return self.clock.now_us
+
+    def spend(self, us):
+        """Spend *us* microseconds of board time"""
+        if us > 0:
+            self.clock.advance(self, us)
+
+    def uart(self, bus):
+        """Return the UART on *bus*, creating it if needed"""
+        if bus not in self.uarts:
+            self.uarts[bus] = UART(bus, board=self)
+        return self.uarts[bus]
+
+    def wire(self, tx_bus, rx_bus, rx_board=None, link=None):
+        """Connect the TX pin of UART *tx_bus* to the RX pin of UART *rx_bus* on
+        *rx_board* (this board when None) through *link* (an ideal Wire when
+        None)"""
+        self.uart(tx_bus)._peer = ((rx_board or self).uart(rx_bus), link or Wire())
+
+# board time helpers
+def millis():
+    board = current_board()
+    board.spend(board.call_us)
+    return (board.now_us() // 1000) & 0x3FFFFFFF
+
+def micros():
+    board = current_board()
+    board.spend(board.call_us)
+    return board.now_us() & 0x3FFFFFFF
+
+def elapsed_millis(start):
+    return (millis() - start) & 0x3FFFFFFF
+
+def elapsed_micros(start):
+    return (micros() - start) & 0x3FFFFFFF
+
+def delay(ms):
+    current_board().spend(int(ms * 1000))
+
+def udelay(us):
+    current_board().spend(int(us))
+
+def usb_mode(mode=None, **kwargs):
+    board = current_board()
+    if mode is not None:
+        board.usb = mode
+    return board.usb
+
+def main(filename):
+    current_board().main_script = filename
+
+class LED(object):
+    """Board LED, keeps its state and a count of changes"""
+
+    def __new__(cls, number):
+        # pyb.LED(n) always refers to the same LED of the board
+        board = current_board()
+        if number not in board.leds:
+            led = object.__new__(cls)
+            led.number = number
+            led.lit = False
+            led.changes = 0
+            led._board = board
+            board.leds[number] = led
+        return board.leds[number]
+
+    def _set(self, lit):
+        self._board.spend(self._board.call_us)
+        if lit != self.lit:
+            self.lit = lit
+            self.changes += 1
+
+    def on(self):
+        self._set(True)
+
+    def off(self):
+        self._set(False)
+
+    def toggle(self):
+        self._set(not self.lit)
+
+    def intensity(self, value=None):
+        if value is None:
+            return 255 if self.lit else 0
+        self._set(value > 0)
+
+class Switch(object):
+    """User switch, reads pressed from the board's switch_press_ms onwards"""
+
+    def __init__(self):
+        self._board = current_board()
+        self._callback = None
+
+    def value(self):
+        board = self._board
+        board.spend(board.call_us)
+        return board.switch_press_ms is not None and board.now_us() >= board.switch_press_ms * 1000
+
+    def __call__(self):
+        return self.value()
+
+    def callback(self, fun):
+        self._callback = fun
+
+class _BoardPins(object):
+    """Pin.board.<name> and Pin.cpu.<name> lookups"""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Pin(name)
+
+class Pin(object):
+    """GPIO pin holding a digital value"""
+    IN = 0
+    OUT = 1
+    OUT_PP = 1
+    OUT_OD = 2
+    AF_PP = 3
+    AF_OD = 4
+    ANALOG = 5
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    board = _BoardPins()
+    cpu = _BoardPins()
+
+    def __init__(self, name, mode=IN, pull=PULL_NONE, value=None, **kwargs):
+        self._name = name.name() if isinstance(name, Pin) else str(name)
+        self.mode = mode
+        self.pull = pull
+        self._value = value or 0
+
+    def name(self):
+        return self._name
+
+    def init(self, mode=IN, pull=PULL_NONE, value=None, **kwargs):
+        self.mode = mode
+        self.pull = pull
+        if value is not None:
+            self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    high = on
+    low = off
+
+class ADC(object):
+    """12 bit ADC, readings come from the board's adc_source"""
+
+    def __init__(self, pin):
+        self._pin = pin.name() if isinstance(pin, Pin) else str(pin)
+        self._board = current_board()
+
+    def read(self):
+        board = self._board
+        board.spend(board.call_us)
+        if board.adc_source is None:
+            return 0
+        return int(board.adc_source(self._pin, (board.now_us() // 1000) & 0x3FFFFFFF)) & 0xFFF
+
+class UART(object):
+    """Serial port modelled at byte level with the following properties:
+
+    Attributes:
+        bus: the UART bus number
+        baudrate: an int representing the bits per second
+        timeout: ms read() waits for the first byte
+        timeout_char: ms read() waits between bytes
+        read_buf_len: bytes the receive buffer holds before new bytes are lost
+        overflows: an int counting bytes lost to a full receive buffer
+        sent: an int counting bytes written
+    """
+
+    def __new__(cls, bus, *args, **kwargs):
+        # pyb.UART(n) always refers to the same port of the board
+        board = kwargs.get('board') or current_board()
+        if bus in board.uarts:
+            return board.uarts[bus]
+        self = object.__new__(cls)
+        self._ready = False
+        return self
+
+    def __init__(self, bus, baudrate=None, board=None, **kwargs):
+        if not self._ready:
+            self._ready = True
+            self.bus = bus
+            self._board = board or current_board()
+            self._board.uarts[bus] = self
+            self._pending = deque()     # (arrival_us, byte) not yet in the receive buffer
+            self._rx = deque()          # bytes in the receive buffer
+            self._peer = None           # (rx UART, link) our TX pin drives
+            self._last_arrival = 0
+            self.overflows = 0
+            self.sent = 0
+            self.init(9600)
+        if baudrate is not None:
+            self.init(baudrate, **kwargs)
+
+    def init(self, baudrate, bits=8, parity=None, stop=1, timeout=0, flow=0,
+             timeout_char=0, read_buf_len=64, **kwargs):
+        self.baudrate = self._board.baudrate or baudrate
+        self.bits = bits
+        self.parity = parity
+        self.stop = stop
+        self.timeout = timeout
+        self.read_buf_len = read_buf_len
+        frame_bits = 1 + bits + (0 if parity is None else 1) + stop
+        self.byte_us = frame_bits * 1000000 // self.baudrate
+        # like pyb, wait at least a couple of characters between bytes
+        self.timeout_char = max(timeout_char, 2 * self.byte_us / 1000.)
+
+    def deinit(self):
+        pass
+
+    # receive side
+    def _deliver(self, arrivals):
+        """Queue bytes arriving on our RX pin, keeping their order"""
+        for arrival, byte in arrivals:
+            arrival = max(arrival, self._last_arrival)
+            self._last_arrival = arrival
+            self._pending.append((arrival, byte))
+        self._board.clock.rx_queued(self._board, self)
+
+    def _settle(self):
+        """Move bytes that have arrived into the receive buffer"""
+        now = self._board.now_us()
+        pending = self._pending
+        while pending and pending[0][0] <= now:
+            byte = pending.popleft()[1]
+            if len(self._rx) < self.read_buf_len:
+                self._rx.append(byte)
+            else:
+                self.overflows += 1
+
+    def next_arrival(self):
+        """Return the arrival time of the next byte not yet received, if any"""
+        return self._pending[0][0] if self._pending else None
+
+    def any(self):
+        board = self._board
+        board.spend(board.call_us)
+        self._settle()
+        return len(self._rx)
+
+    def _receive(self, limit):
+        """Read up to *limit* bytes honouring timeout and timeout_char"""
+        board = self._board
+        board.spend(board.call_us)
+        clock = board.clock
+        self._settle()
+        if not self._rx:
+            deadline = board.now_us() + int(self.timeout * 1000)
+            while not self._rx and board.now_us() < deadline:
+                clock.wait_rx(board, self, deadline)
+                self._settle()
+            if not self._rx:
+                return None
+        data = bytearray()
+        while len(data) < limit:
+            if self._rx:
+                data.append(self._rx.popleft())
+                continue
+            # wait for a following byte up to timeout_char
+            deadline = board.now_us() + int(self.timeout_char * 1000)
+            clock.wait_rx(board, self, deadline)
+            self._settle()
+            if not self._rx:
+                break
+        return data
+
+    def read(self, nbytes=None):
+        data = self._receive(nbytes if nbytes is not None else 1 << 30)
+        return None if data is None else bytes(data)
+
+    def readinto(self, buf, nbytes=None):
+        limit = len(buf) if nbytes is None else min(nbytes, len(buf))
+        data = self._receive(limit)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def readchar(self):
+        data = self._receive(1)
+        return data[0] if data else -1
+
+    def readline(self):
+        data = bytearray()
+        while True:
+            byte = self._receive(1)
+            if not byte:
+                break
+            data += byte
+            if byte[0] == 10:
+                break
+        return bytes(data) if data else None
+
+    # transmit side, blocking like pyb until the last byte is out
+    def write(self, buf):
+        data = bytes(buf)
+        board = self._board
+        board.spend(board.call_us)
+        if self._peer is not None:
+            rx_uart, link = self._peer
+            rx_uart._deliver(link.transmit(data, board.now_us(), self.byte_us))
+        self.sent += len(data)
+        board.spend(len(data) * self.byte_us)
+        return len(data)
+
+    def writechar(self, char):
+        self.write(bytes([char & 0xFF]))
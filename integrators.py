@@ -0,0 +1,215 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Closed form vehicle motion between control changes
+
+# Vehicle.new_state and Swarm.new_state rotate the velocity by the per step
+# heading change of the turn control and add velocity * TIME_STEP to the
+# position, one step at a time. While the control stays the same, that is a
+# fixed rotation every step: the velocity is V e^{i(theta + n h)} (positions
+# and velocities as complex numbers) and the positions lie on a circle
+#   p_n = A + B e^{i n h}
+# or a straight line when h is 0. An Arc holds A, B and h for one interval of
+# constant control, so the state any number of steps ahead costs the same as
+# one step. Two integrators build arcs:
+#   DiscreteArcIntegrator    the stepped model of the simulations, exactly
+#   ContinuousArcIntegrator  a true constant rate circular arc, the limit of
+#                            the stepped model as TIME_STEP goes to 0
+#
+# Arcs also give the leader rule in closed form: the "cross product" of the
+# heading and the vector to a fixed target is a sinusoid in n, so the step
+# where a leader's control next flips comes from the roots of a sine, see
+# Arc.first_flip(). eventsim.py uses both to jump between control changes
+
+import cmath
+import math
+
+import numpy as np
+
+class Arc(object):
+    """The motion of one vehicle under constant turn control with the
+    following properties:
+
+    Attributes:
+        position0: complex position of the state the arc starts from
+        velocity0: complex velocity of that state
+        velocity: complex velocity of magnitude CONSTANT_VELOCITY along the
+            starting heading, the velocity n >= 1 steps in is
+            velocity e^{i n h}
+        h: a float representing the heading change per step in radians,
+            positive to the left
+        TIME_STEP: a float representing the step length in seconds
+        center, radius_vector: A and B of p_n = A + B e^{i n h}, when h is
+            not 0
+    """
+
+    def __init__(self, position0, velocity0, velocity, h, TIME_STEP, radius_vector=None):
+        self.position0 = position0
+        self.velocity0 = velocity0
+        self.velocity = velocity
+        self.h = h
+        self.TIME_STEP = TIME_STEP
+        self.radius_vector = radius_vector
+        self.center = None if radius_vector is None else position0 - radius_vector
+
+    def position(self, n):
+        """Complex position *n* steps after the start, *n* can be an array"""
+        if self.radius_vector is None:
+            return self.position0 + n * self.TIME_STEP * self.velocity
+        return self.center + self.radius_vector * np.exp(1j * self.h * np.asarray(n))
+
+    def velocity_at(self, n):
+        """Complex velocity *n* steps after the start, *n* can be an array"""
+        n = np.asarray(n)
+        return np.where(n == 0, self.velocity0, self.velocity * np.exp(1j * self.h * n))
+
+    def state(self, n):
+        """[posX, posY, velX, velY] *n* steps after the start, shape
+        np.shape(n) + (4,)"""
+        position = self.position(n)
+        velocity = self.velocity_at(n)
+        return np.stack([np.real(position), np.imag(position),
+                         np.real(velocity), np.imag(velocity)], axis=-1)
+
+    def cross_to(self, target, n):
+        """"Cross product" of the heading and the vector to complex *target*
+        after *n* steps, positive when the target is to the left"""
+        turn = cmath.exp(1j * self.h * n)
+        velocity = self.velocity0 if n == 0 else self.velocity * turn
+        if self.radius_vector is None:
+            position = self.position0 + n * self.TIME_STEP * self.velocity
+        else:
+            position = self.center + self.radius_vector * turn
+        return (velocity.conjugate() * (target - position)).imag
+
+    def first_flip(self, target, left, limit, first=1):
+        """Find the first step the leader rule would change its mind
+
+        The leader turns left (+1) at a step when cross_to(target) of the state
+        before it is >= 0. Along the arc that cross product is
+            R sin(phi - n h) - C
+        so the steps where it has the wrong sign lie in windows between roots
+        of a sine, one window per turn of the circle.
+
+        Args:
+            target: complex position of the bright light
+            left: True when the control on this arc is a left turn
+            limit: an int representing the last step worth checking
+            first: an int representing the first step worth checking
+
+        Returns:
+            n: the first step first <= n <= limit whose state gives the other
+                control, None if there is none
+        """
+        velocity = self.velocity
+        if self.radius_vector is None:
+            w = velocity.conjugate() * (target - self.position0)
+            offset = 0.
+        else:
+            w = velocity.conjugate() * (target - self.center)
+            offset = (velocity.conjugate() * self.radius_vector).imag
+        R = abs(w)
+        wrong = lambda n: (self.cross_to(target, n) >= 0) != left
+
+        if self.h == 0 or R == 0:
+            # cross product constant along the arc
+            return first if limit >= first and wrong(first) else None
+        s = offset / R
+        if s >= 1 or s <= -1:
+            # the sine never reaches the offset, the sign never changes
+            return first if limit >= first and wrong(first) else None
+
+        # wrong sign window in psi = phi - n h, [low, high] modulo 2 pi
+        a = math.asin(s)
+        if left:
+            low, high = math.pi - a, 2 * math.pi + a        # sin(psi) < s
+        else:
+            low, high = a, math.pi - a                      # sin(psi) >= s
+        phi = cmath.phase(w)
+        rate = -self.h
+        if rate < 0:                        # mirror so psi increases with n
+            low, high, phi, rate = -high, -low, -phi, -rate
+        # from the window ending around step first, one turn of the circle at a time
+        k = math.floor((phi + rate * first - high) / (2 * math.pi))
+        while True:
+            start = (low + 2 * math.pi * k - phi) / rate
+            end = (high + 2 * math.pi * k - phi) / rate
+            if start > limit + 1:
+                return None
+            n = max(first, int(math.ceil(start)) - 1)
+            # settle rounding at the window edges on the actual states
+            while n <= end + 1 and n <= limit:
+                if wrong(n):
+                    return n
+                n += 1
+            k += 1
+
+class DiscreteArcIntegrator(object):
+    """Closed form of the stepped Vehicle.new_state update with the following
+    properties:
+
+    Attributes:
+        CONSTANT_VELOCITY: a float representing the velocity magnitude in m/s
+        L1_HEADING_CHANGE_PER_STEP, L2_HEADING_CHANGE_PER_STEP: floats
+            representing the heading change per step under level 1 and level
+            2 control in radians
+        TIME_STEP: a float representing the step length in seconds
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE, TIME_STEP):
+        """Return an integrator for a vehicle with the constants of Vehicle,
+        heading changes in rad/s"""
+        self.CONSTANT_VELOCITY = CONSTANT_VELOCITY
+        self.L1_HEADING_CHANGE_PER_STEP = L1_HEADING_CHANGE * TIME_STEP
+        self.L2_HEADING_CHANGE_PER_STEP = L2_HEADING_CHANGE * TIME_STEP
+        self.TIME_STEP = TIME_STEP
+
+    def heading_change(self, turn_control):
+        """Heading change per step for *turn_control* (0, +-1 or +-2)"""
+        if turn_control == 0:
+            return 0.
+        per_step = self.L1_HEADING_CHANGE_PER_STEP if abs(turn_control) == 1 else self.L2_HEADING_CHANGE_PER_STEP
+        return per_step if turn_control > 0 else -per_step
+
+    def _start(self, state):
+        position0 = complex(state[0], state[1])
+        velocity0 = complex(state[2], state[3])
+        speed = abs(velocity0)
+        direction = velocity0 / speed if speed else 0j
+        return position0, velocity0, direction
+
+    def arc(self, state, turn_control):
+        """Return the Arc followed from *state* ([posX, posY, velX, velY])
+        while *turn_control* is held"""
+        position0, velocity0, direction = self._start(state)
+        h = self.heading_change(turn_control)
+        velocity = self.CONSTANT_VELOCITY * direction
+        if h == 0:
+            return Arc(position0, velocity0, velocity, 0., self.TIME_STEP)
+        # p_n = p_0 + dt v sum_{k=1..n} e^{ikh} = p_0 + B (e^{inh} - 1)
+        turn = cmath.exp(1j * h)
+        radius_vector = self.TIME_STEP * velocity * turn / (turn - 1)
+        return Arc(position0, velocity0, velocity, h, self.TIME_STEP, radius_vector)
+
+    def advance(self, state, turn_control, n_steps):
+        """Return the state *n_steps* steps after *state* under
+        *turn_control*"""
+        return self.arc(state, turn_control).state(n_steps)
+
+    def trajectory(self, state, turn_control, n_steps):
+        """Return the (n_steps, 4) states of the steps after *state*"""
+        return self.arc(state, turn_control).state(np.arange(1, n_steps + 1))
+
+class ContinuousArcIntegrator(DiscreteArcIntegrator):
+    """True circular arcs at the heading rate of the turn control, instead of
+    a heading change at the start of every step followed by a straight move
+    """
+
+    def arc(self, state, turn_control):
+        position0, velocity0, direction = self._start(state)
+        h = self.heading_change(turn_control)
+        velocity = self.CONSTANT_VELOCITY * direction
+        if h == 0:
+            return Arc(position0, velocity0, velocity, 0., self.TIME_STEP)
+        # p(t) = p_0 + v (e^{i w t} - 1) / (i w), with w = h / TIME_STEP
+        radius_vector = velocity * self.TIME_STEP / (1j * h)
+        return Arc(position0, velocity0, velocity, h, self.TIME_STEP, radius_vector)
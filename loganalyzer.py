@@ -0,0 +1,432 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Host side analyzer for the car A and car B SD logs of field runs
+
+# Reads the logs a chunk of CHUNK_RECORDS records at a time, so a log of any
+# length is analyzed in a fixed amount of memory:
+#   binary logs (sdlog.py)  sliced straight out of the logreader.py memory map
+#   csv logs                memory mapped and cut at line ends, each chunk
+#                           parsed in one go with NumPy; lines cut short by a
+#                           power loss or garbled are skipped
+# Every statistic is a running sum or histogram updated with NumPy over a
+# whole chunk, carrying only a few values over the chunk edges:
+#   loss         car B samples with controlA code 2 (missing) or 3 (garbage)
+#   bursts       histogram of the lengths of runs of lost samples
+#   period       histogram of the loop period (t step) in PERIOD_BIN_MS bins
+#   agreement    how often controlB matches controlA from lag samples
+#                earlier, for every lag up to MAX_LAG, so the follow delay
+#                actually in effect shows up as the best lag
+#   latency      receive time minus car A's sample time (tA), binary logs.
+#                t and tA come from the two boards' own clocks, so the
+#                absolute latency needs car B's clock offset (--offset-ms);
+#                without it only the spread, p99 less the median, is the
+#                link's jitter
+#   link         with a car A log (--car-a, carA_log.bin written by
+#                pitlStage2carA.py), how often car B received the control car
+#                A logged, matching samples by car A's timestamp tA when
+#                logged, otherwise by time with --offset-ms
+#
+# Example, from the command line:
+#   python loganalyzer.py control_log.bin
+#   python loganalyzer.py control_log.bin --car-a carA_log.bin
+#   python loganalyzer.py control_log.csv --car-a carA_log.csv --offset-ms 40
+#   python loganalyzer.py control_log.bin --npz stats.npz --parquet aligned.parquet
+
+import argparse
+import mmap
+import os
+import warnings
+
+import numpy as np
+
+from logreader import read_log
+from sdlog import MAGIC
+
+CHUNK_RECORDS = 1 << 16         # records analyzed at a time
+MISSING = 2                     # car B controlA codes
+GARBAGE = 3
+MILLIS_WRAP = 1 << 30           # pyb.millis() wraps around here
+PERIOD_BIN_MS = 1
+MAX_PERIOD_MS = 1000            # longer periods go to the last bin
+MAX_LATENCY_MS = 5000
+MAX_LAG = 64                    # samples of lag tried for the agreement
+
+def is_binary(path):
+    """True when *path* is a binary log written by sdlog.BinaryLog"""
+    with open(path, 'rb') as log:
+        return log.read(len(MAGIC)) == MAGIC
+
+def _parse_csv(data, n_fields):
+    """Parse whole csv lines *data* into an (N, n_fields) int array,
+    skipping lines that are not n_fields integers"""
+    n_lines = data.count(b'\n') + (not data.endswith(b'\n'))
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            values = np.fromstring(data.replace(b'\r', b'').replace(b'\n', b','), dtype=np.int64, sep=',')
+        if values.size == n_lines * n_fields:
+            return values.reshape(n_lines, n_fields)
+    except ValueError:
+        pass
+    # some line is broken, fall back to one line at a time for this chunk
+    rows = []
+    for line in data.splitlines():
+        fields = line.split(b',')
+        if len(fields) == n_fields:
+            try:
+                rows.append([int(field) for field in fields])
+            except ValueError:
+                pass
+    return np.array(rows, dtype=np.int64).reshape(-1, n_fields)
+
+def _csv_chunks(path, chunk_records):
+    with open(path, 'rb') as log:
+        size = os.fstat(log.fileno()).st_size
+        if size == 0:
+            return
+        data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            names = [name.strip() for name in data.readline().decode().split(',')]
+            chunk_bytes = chunk_records * 8 * len(names)
+            position = data.tell()
+            while position < size:
+                end = position + chunk_bytes
+                if end >= size:
+                    end = size
+                else:
+                    end = data.find(b'\n', end)
+                    end = size if end < 0 else end + 1
+                values = _parse_csv(data[position:end], len(names))
+                position = end
+                if len(values):
+                    yield dict((name, values[:, k]) for k, name in enumerate(names))
+        finally:
+            data.close()
+
+def iter_chunks(path, chunk_records=CHUNK_RECORDS):
+    """Yield a log a chunk at a time
+
+    Args:
+        path: binary (sdlog.py) or csv log file
+        chunk_records: an int representing the records per chunk
+
+    Yields:
+        columns: dictionary of field name to a NumPy column of the chunk
+    """
+    if is_binary(path):
+        records = read_log(path)
+        for start in range(0, len(records), chunk_records):
+            chunk = records[start:start + chunk_records]
+            yield dict((name, np.asarray(chunk[name]).astype(np.int64)) for name in chunk.dtype.names)
+    else:
+        for columns in _csv_chunks(path, chunk_records):
+            yield columns
+
+def load_columns(path, names, chunk_records=CHUNK_RECORDS):
+    """Return the *names* columns of a whole log as compact arrays, for the
+    car A log the car B log is aligned against"""
+    parts = dict((name, []) for name in names)
+    for columns in iter_chunks(path, chunk_records):
+        for name in names:
+            parts[name].append(columns[name])
+    return dict((name, np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype=np.int64))
+                for name in names)
+
+def _add_counts(counts, values):
+    """Add np.bincount(values) to the growing array *counts*"""
+    found = np.bincount(values)
+    if len(found) > len(counts):
+        counts = np.concatenate([counts, np.zeros(len(found) - len(counts), dtype=counts.dtype)])
+    counts[:len(found)] += found
+    return counts
+
+class LogAnalysis(object):
+    """Running statistics of one log with the following properties:
+
+    Attributes:
+        records: an int counting the records seen
+        car_b: a bool, True once a car B log (controlA column) was seen
+        missing, garbage: ints counting car B samples with controlA code 2
+            and 3
+        burst_counts: int array, burst_counts[n] runs of n lost samples
+        period_counts: int array of loop periods, bin k counts periods in
+            [k, k + 1) * PERIOD_BIN_MS ms, the last bin everything longer
+        agree, pairs: int arrays over lags 0..MAX_LAG of samples where
+            controlB matched controlA from lag samples before, out of the
+            samples where both were valid controls
+        latency_counts: int array of receive latencies t - offset_ms - tA in
+            1 ms bins
+        link_agree, link_pairs: ints counting received controls that matched
+            car A's own log, when aligned against one
+        control_counts: dictionary of the control codes seen in the
+            controlA (car B) or control (car A) column
+    """
+
+    def __init__(self, car_a=None, offset_ms=0):
+        """Return empty statistics. *car_a* is a dictionary with the t and
+        control columns of a car A log to check the received controls
+        against, *offset_ms* how far car B's clock runs ahead of car A's"""
+        self.records = 0
+        self.car_b = False
+        self.missing = 0
+        self.garbage = 0
+        self.burst_counts = np.zeros(1, dtype=np.int64)
+        self.period_counts = np.zeros(MAX_PERIOD_MS // PERIOD_BIN_MS + 1, dtype=np.int64)
+        self.period_sum = 0.
+        self.period_sum_sq = 0.
+        self.agree = np.zeros(MAX_LAG + 1, dtype=np.int64)
+        self.pairs = np.zeros(MAX_LAG + 1, dtype=np.int64)
+        self.latency_counts = np.zeros(MAX_LATENCY_MS + 1, dtype=np.int64)
+        self.link_agree = 0
+        self.link_pairs = 0
+        self.control_counts = {}
+        self.first_t = None
+        self.last_t = None
+        self.decoder_lost = None
+        self.car_a = car_a
+        self.offset_ms = offset_ms
+        self._run = 0                                               # lost samples so far in the current burst
+        self._history = np.zeros(MAX_LAG, dtype=np.int64)          # last controlA values, 0 is never valid
+
+    def add(self, columns):
+        """Update the statistics with one chunk of log columns
+
+        Returns:
+            aligned: dictionary of the per record columns t, controlA,
+                controlB, lost_sample and, against a car A log, a_t and
+                a_control, for a car B log
+        """
+        t = columns['t']
+        if not len(t):
+            return None
+        self.records += len(t)
+        self._add_periods(t)
+        if 'controlA' not in columns:
+            self._add_codes(columns['control'])
+            return None
+        self.car_b = True
+        controlA = columns['controlA']
+        controlB = columns['controlB']
+        self._add_codes(controlA)
+        lost = (controlA == MISSING) | (controlA == GARBAGE)
+        self.missing += int(np.count_nonzero(controlA == MISSING))
+        self.garbage += int(np.count_nonzero(controlA == GARBAGE))
+        self._add_bursts(lost)
+        self._add_agreement(controlA, controlB)
+        if 'lost' in columns:
+            self.decoder_lost = int(columns['lost'][-1])
+        tA = columns.get('tA')
+        if tA is not None:
+            received = ~lost & (tA > 0)
+            latency = (t[received] - self.offset_ms - tA[received]) % MILLIS_WRAP
+            self.latency_counts = _add_counts(self.latency_counts, np.minimum(latency, MAX_LATENCY_MS))
+        aligned = {'t': t, 'controlA': controlA, 'controlB': controlB, 'lost_sample': lost}
+        if self.car_a is not None:
+            aligned.update(self._align(t, controlA, lost, tA))
+        return aligned
+
+    def _add_codes(self, codes):
+        values, counts = np.unique(codes, return_counts=True)
+        for value, count in zip(values.tolist(), counts.tolist()):
+            self.control_counts[value] = self.control_counts.get(value, 0) + count
+
+    def _add_periods(self, t):
+        if self.first_t is None:
+            self.first_t = int(t[0])
+            previous = t[:0]
+        else:
+            previous = np.array([self.last_t])
+        period = np.diff(np.concatenate([previous, t])) % MILLIS_WRAP
+        self.last_t = int(t[-1])
+        if len(period):
+            self.period_sum += float(period.sum())
+            self.period_sum_sq += float((period.astype(float) ** 2).sum())
+            bins = np.minimum(period // PERIOD_BIN_MS, len(self.period_counts) - 1)
+            self.period_counts += np.bincount(bins, minlength=len(self.period_counts))
+
+    def _add_bursts(self, lost):
+        edges = np.diff(np.concatenate([[0], lost.astype(np.int8), [0]]))
+        starts = np.flatnonzero(edges == 1)
+        lengths = np.flatnonzero(edges == -1) - starts
+        if self._run:
+            if len(starts) and starts[0] == 0:
+                lengths[0] += self._run         # the burst carries on into this chunk
+            else:
+                lengths = np.concatenate([[self._run], lengths])
+        self._run = 0
+        if lost[-1]:
+            self._run = int(lengths[-1])       # still going at the end of the chunk
+            lengths = lengths[:-1]
+        if len(lengths):
+            self.burst_counts = _add_counts(self.burst_counts, lengths)
+
+    def _add_agreement(self, controlA, controlB):
+        history = np.concatenate([self._history, controlA])
+        valid = (history == 1) | (history == -1)
+        follows = (controlB == 1) | (controlB == -1)
+        n = len(controlA)
+        for lag in range(MAX_LAG + 1):
+            earlier = history[MAX_LAG - lag:MAX_LAG - lag + n]
+            both = follows & valid[MAX_LAG - lag:MAX_LAG - lag + n]
+            self.pairs[lag] += int(np.count_nonzero(both))
+            self.agree[lag] += int(np.count_nonzero(both & (earlier == controlB)))
+        self._history = history[-MAX_LAG:]
+
+    def _align(self, t, controlA, lost, tA):
+        """Car A's logged sample for every car B record, by car A's
+        timestamp tA when logged, else by car B's time less offset_ms"""
+        a_t = self.car_a['t']
+        key = tA if tA is not None else t - self.offset_ms
+        index = np.searchsorted(a_t, key, side='right') - 1
+        found = index >= 0
+        index = np.maximum(index, 0)
+        a_control = np.where(found, self.car_a['control'][index] if len(a_t) else 0, 0)
+        checked = found & ~lost
+        self.link_pairs += int(np.count_nonzero(checked))
+        self.link_agree += int(np.count_nonzero(checked & (a_control == controlA)))
+        return {'a_t': np.where(found, a_t[index] if len(a_t) else 0, -1), 'a_control': a_control}
+
+    def finish(self):
+        """Close the burst still open at the end of the log"""
+        if self._run:
+            self.burst_counts = _add_counts(self.burst_counts, np.array([self._run]))
+            self._run = 0
+
+    def periods(self):
+        """Return (mean, standard deviation) of the loop period in ms"""
+        n = self.period_counts.sum()
+        if not n:
+            return float('nan'), float('nan')
+        mean = self.period_sum / n
+        return mean, np.sqrt(max(self.period_sum_sq / n - mean ** 2, 0.))
+
+    def best_lag(self):
+        """Return the lag in samples with the highest controlB agreement"""
+        rate = self.agree / np.maximum(self.pairs, 1)
+        return int(np.argmax(np.where(self.pairs > 0, rate, -1)))
+
+    def summary(self):
+        """Return a few lines describing the log"""
+        lines = ['{} records, t {} to {} ms'.format(self.records, self.first_t, self.last_t)]
+        mean, std = self.periods()
+        p50, p99 = _percentiles(self.period_counts, (50, 99), PERIOD_BIN_MS)
+        lines.append('loop period {:.1f} ms mean, {:.2f} ms std, median {}, p99 {} ms'.format(mean, std, p50, p99))
+        lines.append('controls {}'.format(', '.join('{}: {}'.format(code, count)
+                                                    for code, count in sorted(self.control_counts.items()))))
+        if self.car_b:
+            lost = self.missing + self.garbage
+            lines.append('lost {} of {} samples ({:.2%}): {} missing, {} garbage{}'.format(
+                lost, self.records, float(lost) / self.records, self.missing, self.garbage,
+                '' if self.decoder_lost is None else ', {} frames lost by the decoder'.format(self.decoder_lost)))
+            lengths = np.flatnonzero(self.burst_counts)
+            if len(lengths):
+                lines.append('{} loss bursts, longest {} samples, mean {:.2f}'.format(
+                    int(self.burst_counts.sum()), int(lengths[-1]),
+                    float((self.burst_counts * np.arange(len(self.burst_counts))).sum()) / self.burst_counts.sum()))
+        if self.pairs.any():
+            lag = self.best_lag()
+            lines.append('controlB agrees with controlA {} samples earlier {:.2%} of {} valid pairs'.format(
+                lag, float(self.agree[lag]) / max(self.pairs[lag], 1), self.pairs[lag]))
+        if self.latency_counts.any():
+            p50, p99 = _percentiles(self.latency_counts, (50, 99), 1)
+            lines.append('receive latency t - tA median {} ms, p99 {} ms, jitter {} ms{}'.format(
+                p50, p99, p99 - p50, '' if self.offset_ms else ' (no --offset-ms, only the jitter is meaningful)'))
+        if self.link_pairs:
+            lines.append('received controls match car A log {:.2%} of {}'.format(
+                float(self.link_agree) / self.link_pairs, self.link_pairs))
+        return '\n'.join(lines)
+
+    def arrays(self):
+        """Return the statistics as a dictionary of NumPy arrays, for
+        np.savez"""
+        mean, std = self.periods()
+        return {'records': np.array(self.records), 'missing': np.array(self.missing),
+                'garbage': np.array(self.garbage), 'burst_counts': self.burst_counts,
+                'period_counts': self.period_counts, 'period_bin_ms': np.array(PERIOD_BIN_MS),
+                'period_mean': np.array(mean), 'period_std': np.array(std),
+                'agree': self.agree, 'pairs': self.pairs, 'best_lag': np.array(self.best_lag()),
+                'latency_counts': self.latency_counts, 'link_agree': np.array(self.link_agree),
+                'link_pairs': np.array(self.link_pairs),
+                'control_codes': np.array(sorted(self.control_counts), dtype=np.int64),
+                'control_counts': np.array([self.control_counts[code] for code in sorted(self.control_counts)],
+                                           dtype=np.int64)}
+
+def _percentiles(counts, percentiles, bin_width):
+    """Percentiles of a histogram with *bin_width* wide bins from 0"""
+    cumulative = np.cumsum(counts)
+    if not cumulative[-1]:
+        return [None] * len(percentiles)
+    return [int(np.searchsorted(cumulative, cumulative[-1] * p / 100.)) * bin_width for p in percentiles]
+
+class _ParquetTable(object):
+    """Streams the aligned chunks into a Parquet file, needs pyarrow"""
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self._pyarrow = pyarrow
+        self._path = path
+        self._parquet = pyarrow.parquet
+        self._writer = None
+
+    def write(self, columns):
+        table = self._pyarrow.table(columns)
+        if self._writer is None:
+            self._writer = self._parquet.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+def analyze(path, car_a_path=None, offset_ms=0, parquet=None, chunk_records=CHUNK_RECORDS):
+    """Analyze a log a chunk at a time
+
+    Args:
+        path: car B (or car A) log, binary or csv
+        car_a_path: car A log to align a car B log against, with t and
+            control columns
+        offset_ms: how far car B's clock runs ahead of car A's, when the car
+            B log has no tA column
+        parquet: file for the per record aligned table of a car B log,
+            written chunk by chunk (needs pyarrow)
+        chunk_records: an int representing the records per chunk
+
+    Returns:
+        analysis: the finished LogAnalysis
+    """
+    car_a = load_columns(car_a_path, ('t', 'control'), chunk_records) if car_a_path else None
+    analysis = LogAnalysis(car_a, offset_ms)
+    table = _ParquetTable(parquet) if parquet else None
+    try:
+        for columns in iter_chunks(path, chunk_records):
+            aligned = analysis.add(columns)
+            if table is not None and aligned is not None:
+                table.write(aligned)
+    finally:
+        if table is not None:
+            table.close()
+    analysis.finish()
+    return analysis
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze car A and car B SD logs')
+    parser.add_argument('log', help='car B (or car A) log, binary or csv')
+    parser.add_argument('--car-a', default=None, help='car A log to align the received controls against')
+    parser.add_argument('--offset-ms', type=int, default=0,
+                        help="car B's clock minus car A's, for logs without tA and the absolute latency")
+    parser.add_argument('--chunk', type=int, default=CHUNK_RECORDS, help='records per chunk')
+    parser.add_argument('--npz', default=None, help='npz file for the statistics and histograms')
+    parser.add_argument('--parquet', default=None, help='parquet file for the aligned records (needs pyarrow)')
+    args = parser.parse_args(argv)
+
+    try:
+        analysis = analyze(args.log, args.car_a, args.offset_ms, args.parquet, args.chunk)
+    except ImportError as error:
+        parser.error('--parquet needs pyarrow ({})'.format(error))
+    print(analysis.summary())
+    if args.npz:
+        np.savez_compressed(args.npz, **analysis.arrays())
+
+if __name__ == '__main__':
+    main()
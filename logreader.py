@@ -0,0 +1,88 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Host side decoder for the binary SD logs written by sdlog.py
+
+# The records of a log are fixed width, so the whole file maps straight onto
+# a NumPy structured array without parsing line by line. A record cut short by
+# pulling the card or power mid write is ignored
+#
+# Example, from the command line:
+#   python logreader.py control_log.bin                 # print a summary
+#   python logreader.py control_log.bin --csv out.csv   # convert to csv
+
+import argparse
+import struct
+
+import numpy as np
+
+from sdlog import MAGIC, VERSION
+
+# struct format codes to little endian NumPy types
+STRUCT_TO_DTYPE = {
+    'b': '<i1', 'B': '<u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+    'l': '<i4', 'L': '<u4', 'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8',
+}
+
+def read_header(path):
+    """
+    Args:
+        path: binary log file written by sdlog.BinaryLog
+
+    Returns:
+        dtype: NumPy structured dtype of one record
+        offset: an int representing the byte offset of the first record
+    """
+    with open(path, 'rb') as log:
+        if log.read(4) != MAGIC:
+            raise ValueError('{} is not a binary log file'.format(path))
+        version, fmt_len, names_len = struct.unpack('<BBH', log.read(4))
+        if version != VERSION:
+            raise ValueError('unsupported log version {}'.format(version))
+        fmt = log.read(fmt_len).decode()
+        names = log.read(names_len).decode().split(',')
+    dtype = np.dtype([(name, STRUCT_TO_DTYPE[code]) for name, code in zip(names, fmt)])
+    return dtype, 8 + fmt_len + names_len
+
+def read_log(path, mode='r'):
+    """Map a binary log into memory as a structured array
+
+    Args:
+        path: binary log file written by sdlog.BinaryLog
+        mode: np.memmap mode, 'c' gives a writable copy-on-write view
+
+    Returns:
+        records: np.memmap structured array with one field per logged value
+    """
+    dtype, offset = read_header(path)
+    with open(path, 'rb') as log:
+        log.seek(0, 2)
+        n_records = (log.tell() - offset) // dtype.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(n_records,))
+
+def to_columns(records):
+    """Return a dictionary of field name to plain NumPy column"""
+    return dict((name, np.asarray(records[name])) for name in records.dtype.names)
+
+def to_csv(records, path):
+    """Write decoded records to a csv file with the field names as header"""
+    fmt = ['%.9g' if records.dtype[name].kind == 'f' else '%d' for name in records.dtype.names]
+    np.savetxt(path, records, delimiter=',', fmt=fmt, header=','.join(records.dtype.names), comments='')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode binary SD logs from the pyboard')
+    parser.add_argument('log', help='binary log file')
+    parser.add_argument('--csv', default=None, help='write the records to this csv file')
+    args = parser.parse_args(argv)
+
+    records = read_log(args.log)
+    if args.csv:
+        to_csv(records, args.csv)
+    print('{} records of {}'.format(len(records), ', '.join(records.dtype.names)))
+    if len(records):
+        first = records.dtype.names[0]
+        print('{} from {} to {}'.format(first, records[first][0], records[first][-1]))
+
+if __name__ == '__main__':
+    main()
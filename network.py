@@ -0,0 +1,405 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Networked Stage 3: followers act only on state packets received over UART
+
+# In simStage3.py and Swarm a follower reads the control and position of the
+# vehicle it follows straight from memory. NetworkSim runs the same rules, but
+# every followed vehicle publishes a packet with its step, turn control and
+# state RATE_HZ times a second to each follower over a point to point UART
+# link like the car A to car B one, and a follower only knows what has
+# arrived:
+#   safety rule     uses the latest received position of the followed vehicle
+#                   (no rule before the first packet)
+#   follower delay  holds the latest received control, taken on at the step
+#                   FOLLOW_STEPS after it was decided, or when it arrives if
+#                   later
+# Network models every link: a packet of PACKET_BYTES (a one sample uartframe.py
+# frame with state) takes PACKET_BYTES * 10 / BAUDRATE seconds on the wire,
+# waits for the packets ahead of it and is dropped when QUEUE_LIMIT are
+# already waiting, is lost with probability LOSS, and arrives LATENCY plus up
+# to JITTER seconds later, never before the packet ahead of it.
+#
+# Everything runs off one heap of events, keyed by step: the publishes of
+# the vehicles sharing a publish phase, and the deliveries of a publish that
+# take effect at the same step, each as one batch of arrays. A step only
+# touches the links with traffic due, never polls every link, so millions of
+# packets cost a few heap operations per publish. With an ideal link (every
+# step, no delay, no loss, BAUDRATE inf) the result is exactly Swarm's, see
+# the check in __main__
+#
+# Example, from the command line:
+#   python network.py --set LATENCY=0.05 --set JITTER=0.1 --set LOSS=0.05
+#   python network.py --set RATE_HZ=2 --vehicles 10000 --steps 1000
+
+import argparse
+import heapq
+
+import numpy as np
+
+import simStage3
+import uartframe
+from swarm import heading_sign, turn_velocity
+
+# one frame with one sample and car A's state, 23 bytes
+PACKET_BYTES = uartframe.HEADER_SIZE + uartframe.SAMPLE_SIZE + uartframe.STATE_SIZE + uartframe.CRC_SIZE
+BITS_PER_BYTE = 10      # 8N1: start bit, 8 data bits, stop bit
+
+DEFAULT_LINK = {
+    'RATE_HZ': 10.,                 # packets per second from every followed vehicle
+    'BAUDRATE': 9600,               # bits per second of every link
+    'LATENCY': 0.,                  # s, fixed delay added to every packet
+    'JITTER': 0.,                   # s, extra delay, uniform from 0 to this
+    'LOSS': 0.,                     # probability a packet never arrives
+    'QUEUE_LIMIT': 4,               # packets waiting to be sent before more are dropped
+    'PACKET_BYTES': PACKET_BYTES,
+    'SEED': 0,                      # link random seed
+}
+
+def link_config(**overrides):
+    """Return a full link configuration: DEFAULT_LINK with *overrides*"""
+    unknown = set(overrides) - set(DEFAULT_LINK)
+    if unknown:
+        raise KeyError('unknown link settings: {}'.format(', '.join(sorted(unknown))))
+    config = dict(DEFAULT_LINK)
+    config.update(overrides)
+    return config
+
+class Network(object):
+    """Point to point serial links with the following properties:
+
+    Attributes:
+        sender, receiver: int arrays, link k carries packets from vehicle
+            sender[k] to vehicle receiver[k]
+        TX_TIME: a float representing the seconds a packet takes on the wire
+        busy_until: array of the time every link has sent its queue by
+        last_arrival: array of the arrival time of every link's last packet
+        sent, delivered, lost, dropped: ints counting the packets published,
+            arrived, lost on the way and dropped by a full queue
+    """
+
+    def __init__(self, sender, receiver, BAUDRATE=9600, LATENCY=0., JITTER=0., LOSS=0.,
+                 QUEUE_LIMIT=4, PACKET_BYTES=PACKET_BYTES, SEED=None):
+        self.sender = np.asarray(sender, dtype=np.intp)
+        self.receiver = np.asarray(receiver, dtype=np.intp)
+        self.TX_TIME = PACKET_BYTES * BITS_PER_BYTE / float(BAUDRATE)
+        self.LATENCY = LATENCY
+        self.JITTER = JITTER
+        self.LOSS = LOSS
+        self.QUEUE_LIMIT = QUEUE_LIMIT
+        self.busy_until = np.full(len(self.sender), -np.inf)
+        self.last_arrival = np.full(len(self.sender), -np.inf)
+        self.sent = self.delivered = self.lost = self.dropped = 0
+        self._random = np.random.default_rng(SEED)
+
+    def transmit(self, links, send_time):
+        """Send one packet on each of the distinct *links* at *send_time*
+
+        Returns:
+            links: the links whose packet arrives
+            delay: array of their delays in seconds from *send_time*
+        """
+        self.sent += len(links)
+        start = np.maximum(self.busy_until[links], send_time)
+        queued = start - send_time > self.QUEUE_LIMIT * self.TX_TIME + 1e-12     # QUEUE_LIMIT already waiting
+        if queued.any():
+            self.dropped += int(queued.sum())
+            links, start = links[~queued], start[~queued]
+        self.busy_until[links] = start + self.TX_TIME
+        if self.LOSS:
+            arrives = self._random.random(len(links)) >= self.LOSS
+            self.lost += len(links) - int(arrives.sum())
+            links, start = links[arrives], start[arrives]
+        arrival = start + self.TX_TIME + self.LATENCY
+        if self.JITTER:
+            arrival += self.JITTER * self._random.random(len(links))
+        arrival = np.maximum(arrival, self.last_arrival[links])     # the UART keeps the order
+        self.last_arrival[links] = arrival
+        self.delivered += len(links)
+        return links, arrival - send_time
+
+class NetworkSim(object):
+    """Leader and follower vehicles with the Swarm rules, followers knowing
+    only the packets received, with the following properties:
+
+    Attributes:
+        N_VEHICLES: an int representing the number of vehicles
+        leader_index: an int array with -1 for leaders and the index of the
+            vehicle being followed for followers
+        FOLLOW_STEPS: an int representing the steps a follower is behind
+        TIME_STEP: a float representing the step length in seconds
+        PERIOD_STEPS: an int representing the steps between two packets of a
+            vehicle
+        network: the Network of the links, link k ends at follower k
+        state: the (N_VEHICLES, 4) array of current states
+        step: an int representing the number of steps run
+        known_state: (N_FOLLOWERS, 4) array of the latest state received by
+            every follower
+        known_step: int array of the step of every follower's known_state,
+            -1 before the first packet
+        held_control: int array of the control every follower runs
+        events: an int counting the heap events handled
+        l2_overrides: an int counting the level 2 turns
+        age_total, age_max: ints summing and maxing the age in steps of the
+            known state at every follower decision
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE,
+                 SAFE_FOLLOW_DISTANCE, INITIAL_STATES, leader_index, FOLLOW_STEPS,
+                 TIME_STEP, link=None):
+        """Return a simulation of the vehicles in *INITIAL_STATES* with the
+        arguments of Swarm, *FOLLOW_STEPS* of at least 1, and a *link*
+        configuration (see link_config()) for every follower's link
+        """
+        INITIAL_STATES = np.asarray(INITIAL_STATES, dtype=float)
+        self.N_VEHICLES = N = len(INITIAL_STATES)
+        self.leader_index = np.asarray(leader_index, dtype=np.intp)
+        if self.leader_index.shape != (N,):
+            raise ValueError('leader_index needs one entry per vehicle')
+        if FOLLOW_STEPS < 1:
+            raise ValueError('followers need a delay of at least 1 step')
+        self.FOLLOW_STEPS = FOLLOW_STEPS
+        self.TIME_STEP = TIME_STEP
+        per_vehicle = lambda value: np.broadcast_to(np.asarray(value, dtype=float), (N,))
+        V = per_vehicle(CONSTANT_VELOCITY)
+        L1_CROSS = V * np.sin(per_vehicle(L1_HEADING_CHANGE) * TIME_STEP)
+        L2_CROSS = V * np.sin(per_vehicle(L2_HEADING_CHANGE) * TIME_STEP)
+        self._constants = (V, np.sqrt(V ** 2 - L1_CROSS ** 2), L1_CROSS, np.sqrt(V ** 2 - L2_CROSS ** 2), L2_CROSS)
+        self._leaders = np.flatnonzero(self.leader_index < 0)
+        self._followers = np.flatnonzero(self.leader_index >= 0)
+        self.SAFE_FOLLOW_DISTANCE = per_vehicle(SAFE_FOLLOW_DISTANCE)[self._followers]
+
+        link = link_config(**(link or {}))
+        self.network = Network(self.leader_index[self._followers], self._followers, link['BAUDRATE'],
+                               link['LATENCY'], link['JITTER'], link['LOSS'], link['QUEUE_LIMIT'],
+                               link['PACKET_BYTES'], link['SEED'])
+        self.PERIOD_STEPS = max(1, int(round(1. / (link['RATE_HZ'] * TIME_STEP))))
+
+        self.state = INITIAL_STATES.copy()
+        self.control = np.zeros(N, dtype=np.int8)
+        self.step = 0
+        n_links = len(self._followers)
+        self.known_state = np.zeros((n_links, 4))
+        self.known_step = np.full(n_links, -1)
+        self.held_control = np.zeros(n_links, dtype=np.int8)
+        self.held_step = np.full(n_links, -1)
+        self.events = 0
+        self.l2_overrides = 0
+        self.age_total = self.age_max = 0
+
+        # links grouped by the publish phase of their sender, spread over the
+        # period so the links don't all send at once
+        phase = self.network.sender % self.PERIOD_STEPS
+        self._heap = []
+        self._seq = 0
+        for group in range(self.PERIOD_STEPS):
+            links = np.flatnonzero(phase == group)
+            if len(links):
+                self._push(group, 1, 'publish', links)
+
+    def _push(self, step, order, kind, payload):
+        """Schedule an event at *step*, deliveries (order 0) before the
+        decision of that step and publishes (order 1) after it"""
+        heapq.heappush(self._heap, (step, order, self._seq, kind, payload))
+        self._seq += 1
+
+    def _handle(self, until):
+        """Handle every event keyed before *until* = (step, order)"""
+        heap = self._heap
+        while heap and heap[0][:2] < until:
+            step, _, _, kind, payload = heapq.heappop(heap)
+            self.events += 1
+            if kind == 'publish':
+                self._publish(step, payload)
+                self._push(step + self.PERIOD_STEPS, 1, 'publish', payload)
+            elif kind == 'state':
+                links, sent_step, states = payload
+                newer = sent_step > self.known_step[links]
+                self.known_state[links[newer]] = states[newer]
+                self.known_step[links[newer]] = sent_step
+            else:
+                links, sent_step, controls = payload
+                newer = sent_step > self.held_step[links]
+                self.held_control[links[newer]] = controls[newer]
+                self.held_step[links[newer]] = sent_step
+
+    def _publish(self, step, links):
+        """Send the state and control of *step* on *links*, scheduling their
+        deliveries by the step they can first be used at"""
+        links, delay = self.network.transmit(links, step * self.TIME_STEP)
+        if not len(links):
+            return
+        # usable by the decision of step s when it arrives by (s - 1) * TIME_STEP
+        usable = step + 1 + np.ceil(delay / self.TIME_STEP - 1e-9).astype(np.intp)
+        active = np.maximum(usable, step + self.FOLLOW_STEPS)
+        senders = self.network.sender[links]
+        states = self.state[senders]
+        controls = self.control[senders]
+        for kind, at, values in (('state', usable, states), ('control', active, controls)):
+            steps, group = np.unique(at, return_inverse=True)
+            for k, due in enumerate(steps):
+                batch = group == k if len(steps) > 1 else slice(None)
+                self._push(int(due), 0, kind, (links[batch], step, values[batch]))
+
+    def run(self, bright_light, N_STEPS, record=False):
+        """Run *N_STEPS* more steps
+
+        Args:
+            bright_light: [posX, posY] of the navigation goal
+            N_STEPS: an int representing the number of steps to run
+            record: when True keep and return every state and control
+
+        Returns:
+            state: (N_VEHICLES, N_STEPS + 1, 4) states, starting with the
+                current one, when *record* is True, otherwise None
+            turn_control: (N_VEHICLES, N_STEPS + 1) controls, same layout
+                as Swarm.turn_control
+        """
+        bright_light = np.asarray(bright_light, dtype=float)
+        leaders, followers = self._leaders, self._followers
+        state = turn_control = None
+        if record:
+            state = np.empty((self.N_VEHICLES, N_STEPS + 1, 4))
+            turn_control = np.empty((self.N_VEHICLES, N_STEPS + 1))
+            state[:, 0] = self.state
+            turn_control[:, 0] = self.control
+        if self.step == 0:
+            self._handle((0, 2))        # the initial state goes out before the first step
+        for n in range(1, N_STEPS + 1):
+            step = self.step + 1
+            self._handle((step, 1))
+            previous = self.state
+            control = self.control
+
+            # leaders - is brighter light on left or right of body along track direction
+            car_to_bright_light = bright_light - previous[leaders, 0:2]
+            control[leaders] = np.where(heading_sign(previous[leaders, 2:4], car_to_bright_light) >= 0, 1, -1)
+
+            # followers - the control received, once it is FOLLOW_STEPS old
+            control[followers] = self.held_control
+
+            # safety rule on the latest position received
+            known = self.known_step >= 0
+            if known.any():
+                age = (step - 1) - self.known_step[known]
+                self.age_total += int(age.sum())
+                self.age_max = max(self.age_max, int(age.max()))
+                follower_to_leader = self.known_state[:, 0:2] - previous[followers, 0:2]
+                radius = np.sqrt(follower_to_leader[:, 0] ** 2 + follower_to_leader[:, 1] ** 2)
+                too_close = known & (radius <= self.SAFE_FOLLOW_DISTANCE)
+                if too_close.any():
+                    sign_of_heading_angle_to_leader = heading_sign(previous[followers, 2:4], follower_to_leader)
+                    control[followers[too_close]] = np.where(sign_of_heading_angle_to_leader[too_close] > 0, -2, 2)
+                    self.l2_overrides += int(too_close.sum())
+
+            velocity = turn_velocity(previous[:, 2:4], control, *self._constants)
+            self.state = np.empty_like(previous)
+            self.state[:, 2:4] = velocity
+            self.state[:, 0:2] = previous[:, 0:2] + velocity * self.TIME_STEP
+            self.step = step
+            self._handle((step, 2))     # this step's packets go out
+            if record:
+                state[:, n] = self.state
+                turn_control[:, n] = control
+        return state, turn_control
+
+    def summary(self):
+        """Return a dictionary of the packet counts and data age"""
+        network = self.network
+        decisions = max(1, self.step * len(self._followers))
+        return {'sent': network.sent, 'delivered': network.delivered, 'lost': network.lost,
+                'dropped': network.dropped, 'events': self.events, 'l2_overrides': self.l2_overrides,
+                'age_mean_steps': self.age_total / float(decisions), 'age_max_steps': self.age_max}
+
+def stage3(N_STEPS=None, link=None):
+    """Run the simStage3.py car A/car B scenario over a link
+
+    Returns:
+        sim: the NetworkSim after the run
+        state, turn_control: the recorded arrays, car A is vehicle 0
+    """
+    TIME_STEP = simStage3.TIME_STEP
+    V = simStage3.CONSTANT_VELOCITY
+    if N_STEPS is None:
+        N_STEPS = int(round(simStage3.TIME_FINAL / TIME_STEP))
+    FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / TIME_STEP))
+    INITIAL_STATES = [[0, 0, 0, V], [simStage3.INITIAL_CROSS_TRACK_SEPARATION, -V * simStage3.FOLLOW_TIME, 0, V]]
+    sim = NetworkSim(V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE, simStage3.SAFE_FOLLOW_DISTANCE,
+                     INITIAL_STATES, [-1, 0], FOLLOW_STEPS, TIME_STEP, link)
+    state, turn_control = sim.run(simStage3.BRIGHT_LIGHT, N_STEPS, record=True)
+    return sim, state, turn_control
+
+def _parse_assignment(text):
+    """Split a NAME=value command line assignment, the value of the type of
+    the DEFAULT_LINK entry so SEED, QUEUE_LIMIT and the like stay ints (inf
+    for no limit)"""
+    name, _, value = text.partition('=')
+    if name not in DEFAULT_LINK:
+        raise argparse.ArgumentTypeError('unknown link setting {}'.format(name))
+    try:
+        if isinstance(DEFAULT_LINK[name], int):
+            try:
+                return name, int(value)
+            except ValueError:
+                if float(value) != float('inf'):
+                    raise
+                return name, float(value)
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('bad value for {}: {}'.format(name, value))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stage 3 with followers acting on packets received over UART links')
+    parser.add_argument('--set', action='append', default=[], type=_parse_assignment, metavar='NAME=VALUE',
+                        help='link setting, see DEFAULT_LINK')
+    parser.add_argument('--vehicles', type=int, default=2, help='cars in a convoy, 2 for the car A/car B run')
+    parser.add_argument('--steps', type=int, default=None, help='steps to run')
+    args = parser.parse_args(argv)
+
+    from time import perf_counter
+
+    link = dict(args.set)
+    start = perf_counter()
+    if args.vehicles == 2:
+        sim, state, _ = stage3(args.steps, link)
+        separation = np.hypot(*(state[0, :, 0:2] - state[1, :, 0:2]).T)
+        result = 'closest approach {:.3f} m'.format(separation.min())
+    else:
+        from convoy import line_up
+        V = simStage3.CONSTANT_VELOCITY
+        TIME_STEP = simStage3.TIME_STEP
+        sim = NetworkSim(V, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE, simStage3.SAFE_FOLLOW_DISTANCE,
+                         line_up(args.vehicles, V, V * simStage3.FOLLOW_TIME, simStage3.INITIAL_CROSS_TRACK_SEPARATION),
+                         np.arange(args.vehicles) - 1, int(round(simStage3.FOLLOW_TIME / TIME_STEP)), TIME_STEP, link)
+        sim.run(simStage3.BRIGHT_LIGHT, args.steps or 1000)
+        result = 'convoy of {}'.format(args.vehicles)
+    elapsed = perf_counter() - start
+    print('{}, {} steps in {:.2f} s'.format(result, sim.step, elapsed))
+    print(', '.join('{} {:.4g}'.format(name, value) for name, value in sorted(sim.summary().items())))
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1:
+        main()
+    else:
+        # an ideal link gives Swarm's result, then 9600 baud links getting worse
+        from swarm import Swarm
+
+        TIME_STEP = simStage3.TIME_STEP
+        ideal = {'RATE_HZ': 1. / TIME_STEP, 'BAUDRATE': np.inf}
+        sim, state, turn_control = stage3(400, ideal)
+        FOLLOW_STEPS = int(round(simStage3.FOLLOW_TIME / TIME_STEP))
+        swarm = Swarm(simStage3.CONSTANT_VELOCITY, simStage3.L1_HEADING_CHANGE, simStage3.L2_HEADING_CHANGE,
+                      [0, simStage3.SAFE_FOLLOW_DISTANCE], state[:, 0], [-1, 0], 401, TIME_STEP)
+        swarm.run(simStage3.BRIGHT_LIGHT, FOLLOW_STEPS, TIME_STEP)
+        print('ideal link: same controls as Swarm: {}, largest state difference {:.2e}'.format(
+            np.array_equal(turn_control, swarm.turn_control), np.abs(state - swarm.state).max()))
+
+        for settings in ({}, {'LATENCY': 0.05, 'JITTER': 0.1}, {'LOSS': 0.2}, {'RATE_HZ': 2.},
+                         {'RATE_HZ': 10., 'BAUDRATE': 1200}):
+            sim, state, _ = stage3(400, settings)
+            separation = np.hypot(*(state[0, :, 0:2] - state[1, :, 0:2]).T)
+            summary = sim.summary()
+            print('{:<36} closest {:.3f} m, {:3d} L2 overrides, {} sent {} lost {} dropped, age {:.2f} steps'.format(
+                str(settings), separation.min(), summary['l2_overrides'], summary['sent'], summary['lost'],
+                summary['dropped'], summary['age_mean_steps']))
+        main(['--vehicles', '10000', '--steps', '1000', '--set', 'JITTER=0.15', '--set', 'LOSS=0.01'])
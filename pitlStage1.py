@@ -7,6 +7,7 @@
     # 1) find brighter side (left or right)
     # 2) control car to turn in this direction
     # 3) save control direction commanded and time stamp
+    # 4) dead reckon the car's position from the controls (deadreckon.py)
     
     # Everything else will take care of itself
     # I will first create random sensor output readings, determine which side
@@ -21,20 +22,29 @@
         
         
 # import modules       
+import math
 import pyb
+from deadreckon import X, Y, DeadReckoner
+from sdlog import BinaryLog
 
 # creating objects
 green = pyb.LED(2)          # create green LED object
 switch = pyb.Switch()       # create switch object
+CONSTANT_VELOCITY = 0.5                 # m/s, car dynamics as in simStage1.py
+HEADING_CHANGE = math.radians(20)       # radians / sec
+reckon = DeadReckoner(CONSTANT_VELOCITY, HEADING_CHANGE, HEADING_CHANGE, 0.001)    # position in 1 ms ticks, see deadreckon.py
 
 # initialize data collection 
 green.on()                          # shows recording data
-log = open('/sd/control_log.csv', 'w+')     # open file on SD 
-log.write('{},{},{},{}\n'.format("t", "left_sensor", "right_sensor", "control"))   # write column descriptions to file 
+log = BinaryLog('/sd/control_log.bin', ("t", "left_sensor", "right_sensor", "control", "x_mm", "y_mm"), 'Ibbbii')   # binary log on SD, decode with logreader.py
 
+control = 0
+t_last = pyb.millis()
 # run until switch is pressed again
 while not switch():
     t = pyb.millis()       
+    reckon.step(control, t - t_last)            # drove with the last control since the last loop
+    t_last = t
     # set random sensor readings based on time   
     t_string = str(t)                   
     t_randomized = str(t * (int(t_string[1]) + 1))
@@ -45,11 +55,11 @@ while not switch():
         control = int(1)
     else:
         control = int(-1)
-    log.write('{},{},{},{}\n'.format(t, val_photo_left, val_photo_right, control))   # write data to file       
+    log.write6(t, val_photo_left, val_photo_right, control, reckon.state[X] // 1000, reckon.state[Y] // 1000)   # buffer record, whole blocks go to the file
     pyb.delay(100)                              # sample about 10 Hz
     
 # end after switch press
-log.close()                         # close file
+log.close()                         # write buffered records and close file
 green.off()                         # green LED off shows file closed
 pyb.delay(200)                      # delay avoids detection of multiple presses
         
@@ -25,6 +25,8 @@
         
 # import modules       
 import pyb
+from sdlog import BinaryLog
+from uartframe import FrameEncoder
 
 # creating objects
 green = pyb.LED(2)          # create green LED object
@@ -33,8 +35,11 @@ DELAY_TIME = 0            # milliseconds
 UART_READ_TIME = 100
 uart4 = pyb.UART(4, 9600)
 uart4.init(9600, bits=8, parity=None, stop=1, timeout=UART_READ_TIME)
+BATCH_SAMPLES = 4           # control samples sent per frame, see uartframe.py
+encoder = FrameEncoder(batch=BATCH_SAMPLES)
 
 green.on()                          # shows recording data
+log = BinaryLog('/sd/carA_log.bin', ("t", "control"), 'Ib')   # car A's own controls, for loganalyzer.py --car-a
 
 # run until switch is pressed again
 while not switch():
@@ -47,15 +52,18 @@ while not switch():
     val_photo_left = int(t_randomized[t_len - 1])
     val_photo_right = int(t_randomized[t_len - 2])
     if val_photo_left >= val_photo_right:
-        control = b'1'
+        control = 1
     else:
-        control = b'0'
+        control = -1
+    log.write2(t, control)              # t is the tA car B logs for this sample
         
-    # write to UART
-    uart4.write(control) 
+    # write a frame to UART once BATCH_SAMPLES samples are in it
+    if encoder.add(t, control):
+        uart4.write(encoder.frame())
     pyb.delay(DELAY_TIME)                              # sample about 10 Hz
     
 # end after switch press
+log.close()                         # write buffered records and close file
 green.off()                         # green LED off shows file closed
 pyb.delay(200)                      # delay avoids detection of multiple presses
         
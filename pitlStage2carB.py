@@ -12,6 +12,7 @@
     # 3) car A transmit control direction to car B
     # 4) car B determines its control based on follow time and car A control
     # 5) car B saves each cars control decision and the time stamp at each step
+    # 6) car B dead reckons its position from its controls (deadreckon.py)
     
     # Everything else will take care of itself
     # I will first create random sensor output readings, determine which side
@@ -21,60 +22,103 @@
     # 1) get actual sensor readings to work and showing it with a 
     # flashlight - I can shine a light while it's recording a turn direction 
     # and then check that it's responding correctly
+
+# Car B runs as cooperative tasks (coop.py): receive reads what the UART holds
+# without waiting, control ticks every CONTROL_TIME ms and flush writes full
+# log blocks to the SD card, so the loop rate and the follow delay no longer
+# depend on the link
         
 
 # import modules       
+import math
 import pyb
+from coop import Scheduler
+from deadreckon import X, Y, DeadReckoner
+from ringbuffer import RingBuffer
+from sdlog import BinaryLog
+from uartframe import FrameDecoder
 
 # creating objects
 green = pyb.LED(2)          # create green LED object
 orange = pyb.LED(3)         # error light
 switch = pyb.Switch()       # create switch object
 FOLLOW_TIME = 1000          # milliseconds
-UART_READ_TIME = 100
-DELAY_TIME = 0              # milliseconds
-delay_steps = int(round(FOLLOW_TIME / (DELAY_TIME + UART_READ_TIME)))
+CONTROL_TIME = 100          # milliseconds between control ticks
+RX_POLL_TIME = 5            # milliseconds between UART checks, 64 bytes take 67 ms at 9600 baud
+FLUSH_TIME = 50             # milliseconds between checks for a full log block
+delay_steps = int(round(FOLLOW_TIME / CONTROL_TIME))
 uart2 = pyb.UART(2, 9600)
-uart2.init(9600, bits=8, parity=None, stop=1, timeout=UART_READ_TIME)
-controlA = []
+uart2.init(9600, bits=8, parity=None, stop=1, timeout=0)   # never wait, receive() only reads what is there
+controlA = RingBuffer(delay_steps + 1)     # car A control history, only as long as the follow delay
+rx_buf = bytearray(64)                      # preallocated UART receive buffer
+decoder = FrameDecoder()                    # car A frames, see uartframe.py
+CONSTANT_VELOCITY = 0.5                     # m/s, car dynamics as in simStage2.py
+HEADING_CHANGE = math.radians(20)           # radians / sec
+reckon = DeadReckoner(CONSTANT_VELOCITY, HEADING_CHANGE, HEADING_CHANGE, 0.001)    # car B position in 1 ms ticks, see deadreckon.py
 
 # initialize data collection 
 green.on()                          # shows recording data
-log = open('/sd/control_log.csv', 'w+')     # open file on SD 
-log.write('{},{},{}\n'.format("t", "controlA", "controlB"))   # write column descriptions to file 
+log = BinaryLog('/sd/control_log.bin', ("t", "controlA", "controlB", "lost", "tA", "x_mm", "y_mm"),
+                'IbbIIii', auto_flush=False)    # binary log on SD, decode with logreader.py, flush() in its own task
 
 t_init = pyb.millis()
+t_last = t_init
+controlB = 0
 count = 0
-# run until switch is pressed again
-while not switch():
+received = False            # valid frame since the last control tick
+garbled = False             # bytes but no valid frame since the last control tick
+
+def receive():
+    """Task: feed the bytes car A has sent so far to the decoder"""
+    global received, garbled
+    while True:
+        n_rx = uart2.any()
+        if n_rx:
+            errors = decoder.crc_errors + decoder.skipped
+            n_rx = uart2.readinto(rx_buf, n_rx if n_rx < len(rx_buf) else len(rx_buf))
+            if n_rx and decoder.feed(rx_buf, n_rx):
+                received = True
+            elif decoder.crc_errors + decoder.skipped > errors:
+                garbled = True
+        yield RX_POLL_TIME
+
+def control():
+    """Task: one control step every CONTROL_TIME, whatever the link does"""
+    global received, garbled, controlB, count, t_last
     green.toggle()
-    control_temp = uart2.read()
-    if len(control_temp) == 0:
+    t = pyb.millis()
+    if controlB == 1 or controlB == -1:         # 2 and 3 are link errors, not turns
+        reckon.step(controlB, t - t_last)
+    else:
+        reckon.step(0, t - t_last)
+    t_last = t
+    if received:
+        controlA.push(decoder.last_control)     # latest car A sample
+        orange.off()
+    elif garbled:
         orange.on()
-        controlA.append(int(2))
+        controlA.push(3)                        # garbage, no valid frame
     else:
-        if control_temp[0] == 48:
-            controlA.append(int(-1))
-            orange.off()
-        elif control_temp[0] == 49:
-            controlA.append(int(1))
-            orange.off()
-        else:
-            orange.on()
-            controlA.append(int(3))
-             
+        orange.on()
+        controlA.push(2)                        # missing, nothing or only part of a frame
+    received = garbled = False
+
     if count < delay_steps:
         controlB = 0
     else:
-        controlB = controlA[len(controlA) - delay_steps - 1] 
-    t = pyb.millis()  
-    log.write('{},{},{}\n'.format(t, controlA[len(controlA) - 1], controlB))
-    pyb.delay(DELAY_TIME)                              # sample about 10 Hz with UART_READ_TIME
+        controlB = controlA.delayed(delay_steps)
+    log.write7(t, controlA.latest(), controlB, decoder.lost, decoder.last_t,
+               reckon.state[X] // 1000, reckon.state[Y] // 1000)   # latency is t - tA less the clock offset
     count += 1
+
+# run until switch is pressed again
+scheduler = Scheduler()
+scheduler.every('control', CONTROL_TIME, control)
+scheduler.spawn('receive', receive())
+scheduler.every('flush', FLUSH_TIME, log.flush)       # SD writes off the control tick
+scheduler.run(switch)
+
 # end after switch press
-log.close()                         # close file
+log.close()                         # write buffered records and close file
 green.off()                         # green LED off shows file closed
 pyb.delay(200)                      # delay avoids detection of multiple presses
-        
-
-
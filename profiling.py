@@ -0,0 +1,227 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Opt in timing of the simulation phases
+
+# A Profiler records the wall time, call count and, optionally, the memory
+# allocated (tracemalloc) of named phases, either entered with
+#   with profiler.phase('safety'):
+# or by wrapping existing functions and methods for the duration of a run
+#   profiler.instrument(simStage3, 'unit', 'Vehicle.new_state')
+# so the stage scripts need no changes in their loops. NULL_PROFILER is the
+# default everywhere a profiler can be passed: its phase() hands back one
+# shared do-nothing context manager and instrument() patches nothing, so
+# leaving profiling off costs next to nothing.
+#
+# summary() prints a table per phase: total, per call and per step time,
+# calls per step and allocations per step. chrome_trace() writes every phase
+# as a Chrome trace event timeline, open it at chrome://tracing or
+# https://ui.perfetto.dev
+#
+# Example, from the command line:
+#   python simStage3.py --no-plot --profile
+#   python simStage3.py --profile --trace stage3_trace.json
+
+import json
+import os
+import threading
+import tracemalloc
+from time import perf_counter
+
+class _NullPhase(object):
+    """A context manager that does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+class NullProfiler(object):
+    """The profiler used when profiling is off, every method does nothing"""
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def instrument(self, owner, *names):
+        pass
+
+    def add_steps(self, n):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_PROFILER = NullProfiler()
+
+class _Phase(object):
+    """One timed entry of a named phase"""
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        profiler = self._profiler
+        if profiler.allocations:
+            # tracemalloc keeps one peak, so restart it here and hand ours on
+            # to the enclosing phase when done
+            self._memory, peak = tracemalloc.get_traced_memory()
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent._peak = max(parent._peak, peak)
+            self._peak = self._memory
+            tracemalloc.reset_peak()
+        profiler._stack.append(self)
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = perf_counter()
+        profiler = self._profiler
+        profiler._stack.pop()
+        allocated = 0
+        if profiler.allocations:
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            allocated = peak - self._memory
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent._peak = max(parent._peak, peak)
+        profiler._record(self._name, self._start, end, allocated, len(profiler._stack))
+        return False
+
+class Profiler(object):
+    """A phase timer with the following properties:
+
+    Attributes:
+        allocations: a bool, True when tracemalloc measures the peak memory
+            each phase allocates above what was in use when it started
+            (slows the run down several times)
+        timeline: a bool, True when every phase entry is kept for
+            chrome_trace()
+        steps: an int counting simulation steps, for the per step columns
+        stats: dictionary of phase name to [calls, total s, max s, bytes],
+            bytes summing the allocation peak of every call
+        events: list of (name, start s, duration s, depth, thread id) entries
+            kept for the timeline, at most max_events
+    """
+    enabled = True
+
+    def __init__(self, allocations=False, timeline=True, max_events=1000000):
+        """Return a profiler, measuring allocations with tracemalloc when
+        *allocations* is True and keeping up to *max_events* phase entries for
+        the timeline when *timeline* is True"""
+        self.allocations = allocations
+        self.timeline = timeline
+        self.max_events = max_events
+        self.steps = 0
+        self.stats = {}
+        self.events = []
+        self.dropped_events = 0
+        self._stack = []
+        self._patched = []
+        self._started_tracemalloc = False
+        self._start = perf_counter()
+        self._end = None
+
+    def phase(self, name):
+        """Return a context manager timing one entry of phase *name*"""
+        return _Phase(self, name)
+
+    def _record(self, name, start, end, allocated, depth):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, 0., 0., 0]
+        duration = end - start
+        stat[0] += 1
+        stat[1] += duration
+        if duration > stat[2]:
+            stat[2] = duration
+        stat[3] += allocated
+        if self.timeline:
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, duration, depth, threading.get_ident()))
+            else:
+                self.dropped_events += 1
+
+    def add_steps(self, n):
+        """Count *n* more simulation steps"""
+        self.steps += n
+
+    def instrument(self, owner, *names):
+        """Time every call of the functions *names* of module or class
+        *owner* as a phase of the same name, until the profiler is closed.
+        'Class.method' names reach methods through a module"""
+        for name in names:
+            target = owner
+            parts = name.split('.')
+            for part in parts[:-1]:
+                target = getattr(target, part)
+            attribute = parts[-1]
+            original = target.__dict__[attribute] if isinstance(target, type) else getattr(target, attribute)
+            self._patched.append((target, attribute, original))
+            if isinstance(original, (staticmethod, classmethod)):
+                setattr(target, attribute, type(original)(self._wrap(name, original.__func__)))
+            else:
+                setattr(target, attribute, self._wrap(name, original))
+
+    def _wrap(self, name, function):
+        profiler = self
+
+        def timed(*args, **kwargs):
+            with _Phase(profiler, name):
+                return function(*args, **kwargs)
+        timed.__name__ = getattr(function, '__name__', name)
+        timed.__doc__ = getattr(function, '__doc__', None)
+        return timed
+
+    def close(self):
+        """Undo instrument() and stop measuring allocations"""
+        while self._patched:
+            target, attribute, original = self._patched.pop()
+            setattr(target, attribute, original)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._end = perf_counter()
+
+    def __enter__(self):
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def summary(self):
+        """Return a table of every phase, the longest total time first"""
+        wall = (self._end or perf_counter()) - self._start
+        steps = self.steps or 1
+        lines = ['{:<28}{:>10}{:>12}{:>8}{:>12}{:>12}{:>12}{:>14}'.format(
+            'phase', 'calls', 'total ms', '%', 'us/call', 'us/step', 'calls/step', 'alloc B/step')]
+        for name, (calls, total, longest, allocated) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<28}{:>10d}{:>12.3f}{:>8.1f}{:>12.2f}{:>12.2f}{:>12.2f}{:>14}'.format(
+                name[:27], calls, total * 1e3, 100 * total / wall if wall else 0., total / calls * 1e6,
+                total / steps * 1e6, float(calls) / steps,
+                '{:.0f}'.format(float(allocated) / steps) if self.allocations else '-'))
+        lines.append('{} steps, {:.3f} s wall time{}'.format(
+            self.steps, wall, ', {} timeline events dropped'.format(self.dropped_events) if self.dropped_events else ''))
+        return '\n'.join(lines)
+
+    def chrome_trace(self, path):
+        """Write the phase entries to *path* in Chrome trace event JSON"""
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'ts': (start - self._start) * 1e6, 'dur': duration * 1e6,
+                   'pid': pid, 'tid': tid, 'args': {'depth': depth}}
+                  for name, start, duration, depth, tid in self.events]
+        with open(path, 'w') as trace:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'steps': self.steps}}, trace)
@@ -0,0 +1,67 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Fixed size circular buffer for delayed control history on the pyboard
+
+# Car B only ever looks back delay_steps samples, so instead of a list that
+# grows for the whole run it keeps the last delay_steps + 1 control codes in a
+# preallocated array. push() and delayed() only do small int arithmetic, so
+# nothing is allocated on the MicroPython heap once the buffer exists
+
+from array import array
+
+class RingBuffer(object):
+    """A fixed size circular buffer of small signed ints with the following
+    properties:
+
+    Attributes:
+        size: an int representing the number of values kept
+        count: an int representing the number of values pushed, up to size
+    """
+
+    def __init__(self, size, typecode='b'):
+        """Return a buffer keeping the last *size* values pushed, stored in an
+        array of *typecode* ('b' holds -128 to 127)"""
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.size = size
+        self.count = 0
+        self._buf = array(typecode, bytes(size))
+        self._head = size - 1       # index of the latest value
+
+    def push(self, value):
+        """Store *value* as the latest value, dropping the oldest when full"""
+        head = self._head + 1
+        if head == self.size:
+            head = 0
+        self._buf[head] = value
+        self._head = head
+        if self.count < self.size:
+            self.count += 1
+
+    def delayed(self, steps):
+        """Return the value pushed *steps* pushes ago, 0 is the latest value.
+        *steps* must be less than size"""
+        index = self._head - steps
+        if index < 0:
+            index += self.size
+        return self._buf[index]
+
+    def latest(self):
+        """Return the latest value pushed"""
+        return self._buf[self._head]
+
+if __name__ == '__main__':
+    # host side check against the list semantics pitlStage2carB.py used to
+    # have: controlA.append(code) then controlA[len(controlA) - delay_steps - 1]
+    import random
+    for delay_steps in (0, 1, 3, 10, 57):
+        controlA = []
+        ring = RingBuffer(delay_steps + 1)
+        for count in range(2000):
+            code = random.choice((-1, 1, 2, 3))
+            controlA.append(code)
+            ring.push(code)
+            assert ring.latest() == controlA[len(controlA) - 1]
+            if count >= delay_steps:
+                assert ring.delayed(delay_steps) == controlA[len(controlA) - delay_steps - 1]
+    print('RingBuffer matches list semantics')
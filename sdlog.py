@@ -0,0 +1,120 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Buffered binary SD card logger for the pyboard scripts
+
+# Formatting a csv line and writing it to the SD card on every loop allocates
+# strings and issues a tiny SD write each time. BinaryLog instead packs fixed
+# width records (struct.pack_into, little endian, no padding) into two
+# preallocated RAM blocks and only writes whole blocks to the card. While one
+# block is waiting to be written the other keeps filling, so a caller can
+# defer flush() to a quiet moment without dropping samples
+#
+# File layout, decoded on the host by logreader.py:
+#   b'FLOG', version (B), len(fmt) (B), len(names) (H), fmt, names
+#   records packed with '<' + fmt, one after another
+# names is the comma separated list of field names, one per fmt code
+
+import struct
+
+MAGIC = b'FLOG'
+VERSION = 1
+BLOCK_SIZE = 4096       # bytes, a multiple of the 512 byte SD sector
+
+class BinaryLog(object):
+    """A block buffered binary log file with the following properties:
+
+    Attributes:
+        record_size: an int representing the bytes in one record
+        records: an int counting the records written
+        overruns: an int counting the times both blocks were full and a block
+            had to be written to the card inside write()
+    """
+
+    def __init__(self, path, names, fmt, block_size=BLOCK_SIZE, auto_flush=True):
+        """Open log file *path* for records with the field *names* packed with
+        struct format *fmt* (one code per name, e.g. 'Ibb' for a millisecond
+        timestamp and two control codes). Blocks of *block_size* bytes are
+        written to the card as soon as they fill when *auto_flush* is True,
+        otherwise only when flush() is called"""
+        if len(names) != len(fmt):
+            raise ValueError('one struct code is needed per field name')
+        self._fmt = '<' + fmt
+        self.record_size = struct.calcsize(self._fmt)
+        self._capacity = (block_size // self.record_size) * self.record_size
+        self._blocks = (bytearray(self._capacity), bytearray(self._capacity))
+        self._active = 0            # block being filled
+        self._pos = 0               # bytes used in the active block
+        self._pending = False       # other block is full and not written yet
+        self._auto_flush = auto_flush
+        self.records = 0
+        self.overruns = 0
+
+        names = ','.join(names).encode()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(struct.pack('<BBH', VERSION, len(fmt), len(names)))
+        self._file.write(fmt.encode())
+        self._file.write(names)
+
+    def _advance(self):
+        """Move past the record just packed, swapping blocks when full"""
+        self._pos += self.record_size
+        self.records += 1
+        if self._pos == self._capacity:
+            if self._pending:
+                # both blocks full, write the waiting one now rather than drop data
+                self.overruns += 1
+                self._file.write(self._blocks[1 - self._active])
+            self._active = 1 - self._active
+            self._pos = 0
+            self._pending = True
+            if self._auto_flush:
+                self.flush()
+
+    def write(self, *values):
+        """Append one record, allocates a tuple for the arguments"""
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, *values)
+        self._advance()
+
+    # fixed arity versions of write() that allocate nothing
+    def write2(self, a, b):
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, a, b)
+        self._advance()
+
+    def write3(self, a, b, c):
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, a, b, c)
+        self._advance()
+
+    def write4(self, a, b, c, d):
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, a, b, c, d)
+        self._advance()
+
+    def write5(self, a, b, c, d, e):
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, a, b, c, d, e)
+        self._advance()
+
+    def write6(self, a, b, c, d, e, f):
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, a, b, c, d, e, f)
+        self._advance()
+
+    def write7(self, a, b, c, d, e, f, g):
+        struct.pack_into(self._fmt, self._blocks[self._active], self._pos, a, b, c, d, e, f, g)
+        self._advance()
+
+    def pending(self):
+        """Return True when a full block is waiting to be written"""
+        return self._pending
+
+    def flush(self):
+        """Write the full block waiting to go to the card, if there is one"""
+        if self._pending:
+            self._file.write(self._blocks[1 - self._active])
+            self._pending = False
+
+    def close(self):
+        """Write everything still buffered and close the file"""
+        self.flush()
+        if self._pos:
+            self._file.write(memoryview(self._blocks[self._active])[:self._pos])
+        self._pos = 0
+        self._file.close()
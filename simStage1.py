@@ -2,17 +2,32 @@
 # Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
 # Stage 1 Simulation: Get car A to the navigation goal - find brightest light
 
-import numpy as np
+# Run it with "python simStage1.py" to simulate and plot, or with --no-plot to
+# only simulate. --live draws the paths while the simulation runs and
+# --time-final makes the run longer, the plots are downsampled (visualize.py)
+# so long runs stay quick to draw. --goal-radius and --max-orbits end the
+# run early once car A reaches the light or loops around it (stopping.py).
+# Importing the module runs nothing, call simulate() for the trajectories and
+# plot() to draw them (matplotlib is only imported there)
+
+import argparse
 import math
-import matplotlib.pyplot as plt
+import sys
+from time import perf_counter
+
+import numpy as np
+
+import stopping
+from profiling import NULL_PROFILER, Profiler
+from visualize import LivePlot, downsample, velocity_magnitude
 
 # define functions needed
 def unit (vector):
     """
     Args:
         vector: array you want the unit vector of
-    
-    Returns: 
+
+    Returns:
         unit: vector in direction of input vector but with magnitude of 1
     """
     mag = math.sqrt(np.dot(vector, vector))
@@ -21,91 +36,171 @@ def unit (vector):
     return vector / mag
 
 # initialize simulation
-TIME_STEP = 0.1				
+TIME_STEP = 0.1
 TIME_FINAL = 10
-time = np.arange(0., TIME_FINAL + TIME_STEP, TIME_STEP)
-N_STEPS = len(time)
-a_state_inertial = np.zeros((N_STEPS, 4))    # initialized state vector [posX; posY; velX; velY]
 CONSTANT_VELOCITY = 0.5                         # m/s
-a_state_inertial[0] = [0, 0, 0, CONSTANT_VELOCITY]		# car A starts at the origin moving at constant speed +Y
-bright_light = np.array([4., -1.])			# bright light fixed position in inertial - navigation goal is to get there!	
-
-# sensor reading setup - only knows if left or right is brighter
-sensor_reading = np.zeros(N_STEPS)	# +1 for left turn, -1 for right turn
+BRIGHT_LIGHT = np.array([4., -1.])			# bright light fixed position in inertial - navigation goal is to get there!
 
 # vehicle dynamics
 # assume car is at a constant velocity, and max turning control is an angular rate of change of 20 degrees per second
 MAX_HEADING_CHANGE_PER_SECOND = math.radians(20) 	# radians / sec max change in body coordinates
-MAX_HEADING_CHANGE_PER_TIME_STEP = MAX_HEADING_CHANGE_PER_SECOND * TIME_STEP
-MAX_CROSS_TRACK_VELOCITY = CONSTANT_VELOCITY * math.sin(MAX_HEADING_CHANGE_PER_TIME_STEP)	
-MAX_ALONG_TRACK_VELOCITY = math.sqrt(CONSTANT_VELOCITY ** 2 - MAX_CROSS_TRACK_VELOCITY ** 2)
-
-# run simulation determining sensor reading, applying control law, changing
-# velocity based on control, and integrating velocity to determine new position
-for i, t in enumerate(time): 	
-    if i > 0:     # starting at second time step...
-        # Determine if brighter light on left or right of body along track direction
-        a_to_bright_light = bright_light - a_state_inertial[i-1, 0:2]	# vector from car A to bright light in inertial
-        sign_of_heading_angle_to_bright_light = a_state_inertial[i-1, 2] * a_to_bright_light[1] - a_state_inertial[i-1, 3] * a_to_bright_light[0]   # "cross product" to determine sign of angle between heading and brihgt light in body
-        if sign_of_heading_angle_to_bright_light >= 0:
-            sensor_reading[i] = 1   # bright light is left
-        else:
-            sensor_reading[i] = -1  # bright light is right
-        
-        # implement bang bang control via cross track velocity (proportional to wheel turning motor voltage)
-        a_velocity_old_unit = unit(a_state_inertial[i-1, 2:4])	# inertial velocity unit vector from previous time step
-        if i == 1:  # still going max speed, haven't turned yet
-            a_velocity_old = CONSTANT_VELOCITY * a_velocity_old_unit
-        else:
-            a_velocity_old = MAX_ALONG_TRACK_VELOCITY * a_velocity_old_unit			# “slow down to turn”
-        a_state_inertial[i, 2:4] = a_velocity_old + (sensor_reading[i] * np.array([-a_velocity_old_unit[1], a_velocity_old_unit[0]]) * MAX_CROSS_TRACK_VELOCITY)
-        
-        # integrate to determine inertial position
-        a_state_inertial[i, 0:2] = a_state_inertial[i - 1, 0:2] + a_state_inertial[i, 2:4] * TIME_STEP
-
-# plot simulation outputs
-
-plt.figure(figsize=(8, 6), dpi=100) # plot state in time vs. X, Y, vX, vY
-
-plt.subplot(2, 1, 1)
-plt.plot(time, a_state_inertial[:, 0], label="$X$")
-plt.plot(time, a_state_inertial[:, 1], label="$Y$")
-plt.ylabel('position [m]')
-plt.legend(frameon=False, loc='top right')
-
-plt.subplot(2, 1, 2)
-# get velocity magnitude
-a_velocity_mag = [math.sqrt(state[2] ** 2 + state[3] ** 2) for state in a_state_inertial]
-plt.plot(time, a_state_inertial[:, 2], label="$v_X$")
-plt.plot(time, a_state_inertial[:, 3], label="$v_Y$")
-plt.plot(time, a_velocity_mag, 'k', label="$v_{mag}$")
-plt.xlabel('time [s]')
-plt.ylabel('velocity [m/s]')
-plt.legend(frameon=False, loc='bottom left')
-
-plt.show()
-
-plt.figure(figsize=(9, 6), dpi=100)   # plot position in X vs Y
-
-plt.plot(a_state_inertial[:, 0], a_state_inertial[:, 1], 'k')
-plt.plot(a_state_inertial[0, 0], a_state_inertial[0, 1], 'ko')
-plt.plot(a_state_inertial[N_STEPS - 1, 0], a_state_inertial[N_STEPS - 1, 1], 'kx')
-plt.plot(bright_light[0], bright_light[1], 'ro')
-plt.xlabel('X [m]')
-plt.ylabel('Y [m]')
-
-plt.axis('equal')
-
-plt.show()
-
-plt.figure(figsize=(8, 6), dpi=100)   # plot control 
-
-plt.plot(time, sensor_reading, 'ko')
-plt.ylim((-1.1, 1.1))
-plt.xlim((-0.1, 10))
-plt.axhline(1, label="left", color='c')
-plt.axhline(-1, label="right", color='r')
-plt.xlabel('time [s]')
-plt.ylabel('Turn Control')
-plt.legend(frameon=False, loc='center right')
-plt.show()
+
+def simulate(TIME_STEP=TIME_STEP, TIME_FINAL=TIME_FINAL,
+             CONSTANT_VELOCITY=CONSTANT_VELOCITY,
+             MAX_HEADING_CHANGE_PER_SECOND=MAX_HEADING_CHANGE_PER_SECOND,
+             bright_light=BRIGHT_LIGHT, live=None, stop=None):
+    """Run the Stage 1 simulation, every argument defaults to the module
+    constant of the same name, *live* is an optional visualize.LivePlot
+    updated every step and *stop* an optional stopping.StopCondition, ending
+    the run and trimming the arrays at the first step meeting it
+
+    Returns:
+        time: array of simulation times in seconds
+        a_state_inertial: array of car A states [posX, posY, velX, velY] with
+            one row per time
+        sensor_reading: array of the turn control at each time, +1 for left
+            turn and -1 for right turn
+    """
+    time = np.arange(0., TIME_FINAL + TIME_STEP, TIME_STEP)
+    N_STEPS = len(time)
+    a_state_inertial = np.zeros((N_STEPS, 4))    # initialized state vector [posX; posY; velX; velY]
+    a_state_inertial[0] = [0, 0, 0, CONSTANT_VELOCITY]		# car A starts at the origin moving at constant speed +Y
+    bright_light = np.asarray(bright_light, dtype=float)
+
+    # sensor reading setup - only knows if left or right is brighter
+    sensor_reading = np.zeros(N_STEPS)	# +1 for left turn, -1 for right turn
+
+    MAX_HEADING_CHANGE_PER_TIME_STEP = MAX_HEADING_CHANGE_PER_SECOND * TIME_STEP
+    MAX_CROSS_TRACK_VELOCITY = CONSTANT_VELOCITY * math.sin(MAX_HEADING_CHANGE_PER_TIME_STEP)
+    MAX_ALONG_TRACK_VELOCITY = math.sqrt(CONSTANT_VELOCITY ** 2 - MAX_CROSS_TRACK_VELOCITY ** 2)
+
+    # run simulation determining sensor reading, applying control law, changing
+    # velocity based on control, and integrating velocity to determine new position
+    if stop is not None:
+        stop.start(a_state_inertial[0:1])
+    for i, t in enumerate(time):
+        if i > 0:     # starting at second time step...
+            # Determine if brighter light on left or right of body along track direction
+            a_to_bright_light = bright_light - a_state_inertial[i-1, 0:2]	# vector from car A to bright light in inertial
+            sign_of_heading_angle_to_bright_light = a_state_inertial[i-1, 2] * a_to_bright_light[1] - a_state_inertial[i-1, 3] * a_to_bright_light[0]   # "cross product" to determine sign of angle between heading and brihgt light in body
+            if sign_of_heading_angle_to_bright_light >= 0:
+                sensor_reading[i] = 1   # bright light is left
+            else:
+                sensor_reading[i] = -1  # bright light is right
+
+            # implement bang bang control via cross track velocity (proportional to wheel turning motor voltage)
+            a_velocity_old_unit = unit(a_state_inertial[i-1, 2:4])	# inertial velocity unit vector from previous time step
+            if i == 1:  # still going max speed, haven't turned yet
+                a_velocity_old = CONSTANT_VELOCITY * a_velocity_old_unit
+            else:
+                a_velocity_old = MAX_ALONG_TRACK_VELOCITY * a_velocity_old_unit			# “slow down to turn”
+            a_state_inertial[i, 2:4] = a_velocity_old + (sensor_reading[i] * np.array([-a_velocity_old_unit[1], a_velocity_old_unit[0]]) * MAX_CROSS_TRACK_VELOCITY)
+
+            # integrate to determine inertial position
+            a_state_inertial[i, 0:2] = a_state_inertial[i - 1, 0:2] + a_state_inertial[i, 2:4] * TIME_STEP
+            if live is not None:
+                live.update(t, a_state_inertial[i, 0:2])
+            if stop is not None and stop.check(i, t, a_state_inertial[i:i + 1], bright_light):
+                time = time[:i + 1]
+                a_state_inertial = a_state_inertial[:i + 1].copy()
+                sensor_reading = sensor_reading[:i + 1].copy()
+                break
+
+    return time, a_state_inertial, sensor_reading
+
+def plot(time, a_state_inertial, sensor_reading, bright_light=BRIGHT_LIGHT):
+    """Plot simulation outputs from simulate(), importing matplotlib only now"""
+    import matplotlib.pyplot as plt
+
+    N_STEPS = len(time)
+
+    plt.figure(figsize=(8, 6), dpi=100) # plot state in time vs. X, Y, vX, vY
+
+    plt.subplot(2, 1, 1)
+    plt.plot(*downsample(time, a_state_inertial[:, 0]), label="$X$")
+    plt.plot(*downsample(time, a_state_inertial[:, 1]), label="$Y$")
+    plt.ylabel('position [m]')
+    plt.legend(frameon=False, loc='upper right')
+
+    plt.subplot(2, 1, 2)
+    # get velocity magnitude
+    a_velocity_mag = velocity_magnitude(a_state_inertial)
+    plt.plot(*downsample(time, a_state_inertial[:, 2]), label="$v_X$")
+    plt.plot(*downsample(time, a_state_inertial[:, 3]), label="$v_Y$")
+    plt.plot(*downsample(time, a_velocity_mag), 'k', label="$v_{mag}$")
+    plt.xlabel('time [s]')
+    plt.ylabel('velocity [m/s]')
+    plt.legend(frameon=False, loc='lower left')
+
+    plt.show()
+
+    plt.figure(figsize=(9, 6), dpi=100)   # plot position in X vs Y
+
+    plt.plot(*downsample(a_state_inertial[:, 0], a_state_inertial[:, 1]), 'k')
+    plt.plot(a_state_inertial[0, 0], a_state_inertial[0, 1], 'ko')
+    plt.plot(a_state_inertial[N_STEPS - 1, 0], a_state_inertial[N_STEPS - 1, 1], 'kx')
+    plt.plot(bright_light[0], bright_light[1], 'ro')
+    plt.xlabel('X [m]')
+    plt.ylabel('Y [m]')
+
+    plt.axis('equal')
+
+    plt.show()
+
+    plt.figure(figsize=(8, 6), dpi=100)   # plot control
+
+    plt.plot(*downsample(time, sensor_reading, method='minmax'), 'ko')
+    plt.ylim((-1.1, 1.1))
+    plt.xlim((-0.1, time[-1]))
+    plt.axhline(1, label="left", color='c')
+    plt.axhline(-1, label="right", color='r')
+    plt.xlabel('time [s]')
+    plt.ylabel('Turn Control')
+    plt.legend(frameon=False, loc='center right')
+    plt.show()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stage 1 simulation: car A finds the brightest light')
+    parser.add_argument('--no-plot', action='store_true', help='simulate only, without importing matplotlib')
+    parser.add_argument('--live', action='store_true', help='draw the paths while the simulation runs')
+    parser.add_argument('--time-final', type=float, default=TIME_FINAL, help='simulated seconds')
+    stopping.add_arguments(parser, followers=False)
+    parser.add_argument('--profile', action='store_true', help='print the time spent in each phase of the run')
+    parser.add_argument('--allocations', action='store_true', help='with --profile, also measure memory allocated')
+    parser.add_argument('--trace', default=None, metavar='PATH', help='profile and write a Chrome trace timeline to PATH')
+    args = parser.parse_args(argv)
+
+    profiling = args.profile or args.allocations or args.trace
+    profiler = Profiler(allocations=args.allocations) if profiling else NULL_PROFILER
+    with profiler:
+        profiler.instrument(sys.modules[__name__], 'unit')
+        if profiling and (args.live or not args.no_plot):
+            import matplotlib.pyplot as plt
+            profiler.instrument(plt, 'show')     # time spent with the plot windows open
+        run(args, profiler)
+    if profiling:
+        print(profiler.summary())
+        if args.trace:
+            profiler.chrome_trace(args.trace)
+
+def run(args, profiler):
+    """Simulate, then plot or print the result"""
+    start = perf_counter()
+    with profiler.phase('simulate'):
+        live = LivePlot(['car A'], BRIGHT_LIGHT, title='Stage 1') if args.live else None
+        stop = stopping.from_arguments(args)
+        time, a_state_inertial, sensor_reading = simulate(TIME_FINAL=args.time_final, live=live, stop=stop)
+        if live is not None:
+            live.finish()
+    elapsed = perf_counter() - start
+    profiler.add_steps(len(time) - 1)
+    if args.no_plot:
+        print('{} steps in {:.4f} s, final car A state {}'.format(len(time), elapsed, a_state_inertial[-1]))
+        if stop is not None:
+            print(stop.summary())
+    else:
+        with profiler.phase('plot'):
+            plot(time, a_state_inertial, sensor_reading)
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,26 @@
 # Stage 1 Simulation: Get car A to the navigation goal - find brightest light
 # Stage 2 Simulation: Get car B to follow car A to navigation objective
 
-import numpy as np
+# Run it with "python simStage2.py" to simulate and plot, or with --no-plot to
+# only simulate. --live draws the paths while the simulation runs and
+# --time-final makes the run longer, the plots are downsampled (visualize.py)
+# so long runs stay quick to draw. --goal-radius, --violation-distance and
+# --max-orbits end the run early once car A reaches the light, car B gets
+# too close or car A loops around the light (stopping.py). Importing the
+# module runs nothing, call simulate() for the trajectories and plot() to
+# draw them (matplotlib is only imported there)
+
+import argparse
 import math
-import matplotlib.pyplot as plt
+import sys
 from abc import ABCMeta, abstractmethod
+from time import perf_counter
+
+import numpy as np
+
+import stopping
+from profiling import NULL_PROFILER, Profiler
+from visualize import LivePlot, downsample, velocity_magnitude
 
 # define functions needed
 def unit(vector):
@@ -82,11 +98,17 @@ class Vehicle(object):
         self.state[step, 2:4] = velocity_old + (self.turn_control[step] * np.array([-velocity_old_unit[1], velocity_old_unit[0]]) * self.CONTROL_CROSS_TRACK_VELOCITY)
         
         # integrate to determine inertial position
-        self.state[step, 0:2] = self.state[step - 1, 0:2] + self.state[i, 2:4] * TIME_STEP
+        self.state[step, 0:2] = self.state[step - 1, 0:2] + self.state[step, 2:4] * TIME_STEP
         
     def velocity_mag(self):
         """Calculates the velocity magnitude of the state and returns it"""
-        return [math.sqrt(state[2] ** 2 + state[3] ** 2) for state in self.state]
+        return velocity_magnitude(self.state)
+
+    def trim(self, N_STEPS):
+        """Keep only the first *N_STEPS* states and turn controls, for a run
+        that stopped early"""
+        self.state = self.state[:N_STEPS].copy()
+        self.turn_control = self.turn_control[:N_STEPS].copy()
         
     @abstractmethod
     def vehicle_type():
@@ -129,104 +151,186 @@ class Follower(Vehicle):
             self.turn_control[step] = 0
 
 # initialize simulation
-TIME_STEP = 0.1				
+TIME_STEP = 0.1
 TIME_FINAL = 10
-time = np.arange(0., TIME_FINAL + TIME_STEP, TIME_STEP)
-N_STEPS = len(time)   
 
 # vehicle dynamics
 # assume car is at a constant velocity, and max turning control is an angular rate of change of 20 degrees per second
 CONSTANT_VELOCITY = 0.5                         # m/s
 MAX_HEADING_CHANGE = math.radians(20) 	# radians / sec max change in body coordinates
 
-# initialize car A object
-A_INITIAL_STATE = [0, 0, 0, CONSTANT_VELOCITY]		# car A starts at the origin moving at constant speed +Y
-a = Leader("Alfred", CONSTANT_VELOCITY, MAX_HEADING_CHANGE, A_INITIAL_STATE, N_STEPS, TIME_STEP) 
-
-# initialize car B object
+# car B follow setup
 FOLLOW_TIME = 1  # time car B follows behind car A - seconds
-FOLLOW_DISTANCE = CONSTANT_VELOCITY * FOLLOW_TIME
-FOLLOW_STEPS = int(round(FOLLOW_TIME / TIME_STEP)) # simulation steps follower is behind
 INITIAL_CROSS_TRACK_SEPARATION = 0.1    # offset follower and leader in initial X distance
-B_INITIAL_STATE = [INITIAL_CROSS_TRACK_SEPARATION, -FOLLOW_DISTANCE, 0, CONSTANT_VELOCITY]		# car A starts at the origin moving at constant speed +Y
-b = Follower("Bert", CONSTANT_VELOCITY, MAX_HEADING_CHANGE, B_INITIAL_STATE, N_STEPS, TIME_STEP) 
 
+BRIGHT_LIGHT = np.array([4., -1.])			# bright light fixed position in inertial - navigation goal is to get there!
 
-BRIGHT_LIGHT = np.array([4., -1.])			# bright light fixed position in inertial - navigation goal is to get there!	
+def simulate(TIME_STEP=TIME_STEP, TIME_FINAL=TIME_FINAL,
+             CONSTANT_VELOCITY=CONSTANT_VELOCITY,
+             MAX_HEADING_CHANGE=MAX_HEADING_CHANGE, FOLLOW_TIME=FOLLOW_TIME,
+             INITIAL_CROSS_TRACK_SEPARATION=INITIAL_CROSS_TRACK_SEPARATION,
+             BRIGHT_LIGHT=BRIGHT_LIGHT, live=None, stop=None):
+    """Run the Stage 2 simulation, every argument defaults to the module
+    constant of the same name, *live* is an optional visualize.LivePlot
+    updated every step and *stop* an optional stopping.StopCondition, ending
+    the run and trimming the arrays at the first step meeting it
 
-# run simulation determining sensor reading, applying control law, changing
-# velocity based on control, and integrating velocity to determine new position
-for i, t in enumerate(time): 	
-    if i > 0:     # starting at second time step...
-        # Determine if brighter light on left or right of body along track direction
-        a.control_direction(BRIGHT_LIGHT, i)
-        b.control_direction(BRIGHT_LIGHT, i, FOLLOW_STEPS, a)
-        
-        # implement bang bang control via cross track velocity (proportional to wheel turning motor voltage)
-        a.new_state(i, TIME_STEP)
-        b.new_state(i, TIME_STEP)
-        
-# plot simulation outputs
+    Returns:
+        time: array of simulation times in seconds
+        a: the Leader car A with its state and turn_control arrays
+        b: the Follower car B with its state and turn_control arrays
+    """
+    time = np.arange(0., TIME_FINAL + TIME_STEP, TIME_STEP)
+    N_STEPS = len(time)
+    BRIGHT_LIGHT = np.asarray(BRIGHT_LIGHT, dtype=float)
+
+    # initialize car A object
+    A_INITIAL_STATE = [0, 0, 0, CONSTANT_VELOCITY]		# car A starts at the origin moving at constant speed +Y
+    a = Leader("Alfred", CONSTANT_VELOCITY, MAX_HEADING_CHANGE, A_INITIAL_STATE, N_STEPS, TIME_STEP)
+
+    # initialize car B object
+    FOLLOW_DISTANCE = CONSTANT_VELOCITY * FOLLOW_TIME
+    FOLLOW_STEPS = int(round(FOLLOW_TIME / TIME_STEP)) # simulation steps follower is behind
+    B_INITIAL_STATE = [INITIAL_CROSS_TRACK_SEPARATION, -FOLLOW_DISTANCE, 0, CONSTANT_VELOCITY]		# car A starts at the origin moving at constant speed +Y
+    b = Follower("Bert", CONSTANT_VELOCITY, MAX_HEADING_CHANGE, B_INITIAL_STATE, N_STEPS, TIME_STEP)
+
+    # run simulation determining sensor reading, applying control law, changing
+    # velocity based on control, and integrating velocity to determine new position
+    if stop is not None:
+        stop.start(a.state[0:1])
+    for i, t in enumerate(time):
+        if i > 0:     # starting at second time step...
+            # Determine if brighter light on left or right of body along track direction
+            a.control_direction(BRIGHT_LIGHT, i)
+            b.control_direction(BRIGHT_LIGHT, i, FOLLOW_STEPS, a)
+
+            # implement bang bang control via cross track velocity (proportional to wheel turning motor voltage)
+            a.new_state(i, TIME_STEP)
+            b.new_state(i, TIME_STEP)
+            if live is not None:
+                live.update(t, (a.state[i, 0:2], b.state[i, 0:2]))
+            if stop is not None:
+                separation = math.hypot(*(a.state[i, 0:2] - b.state[i, 0:2]))
+                if stop.check(i, t, a.state[i:i + 1], BRIGHT_LIGHT, [separation]):
+                    time = time[:i + 1]
+                    a.trim(i + 1)
+                    b.trim(i + 1)
+                    break
+
+    return time, a, b
+
+def plot(time, a, b, BRIGHT_LIGHT=BRIGHT_LIGHT):
+    """Plot simulation outputs from simulate(), importing matplotlib only now"""
+    import matplotlib.pyplot as plt
+
+    N_STEPS = len(time)
+
+    # 1 plot state in time vs. X, Y, vX, vY
+    plt.figure(figsize=(8, 6), dpi=100)
+
+    plt.subplot(2, 1, 1)
+    plt.plot(*downsample(time, a.state[:, 0]), label="$X_{lead}$")
+    plt.plot(*downsample(time, a.state[:, 1]), label="$Y_{lead}$")
+
+    plt.plot(*downsample(time, b.state[:, 0]), 'b--', label="$X_{follow}$")
+    plt.plot(*downsample(time, b.state[:, 1]), 'g--', label="$Y_{follow}$")
 
-# 1 plot state in time vs. X, Y, vX, vY
-plt.figure(figsize=(8, 6), dpi=100) 
+    plt.ylabel('position [m]')
+    plt.legend(frameon=False, loc='upper left')
 
-plt.subplot(2, 1, 1)
-plt.plot(time, a.state[:, 0], label="$X_{lead}$")
-plt.plot(time, a.state[:, 1], label="$Y_{lead}$")
+    plt.subplot(2, 1, 2)
 
-plt.plot(time, b.state[:, 0], 'b--', label="$X_{follow}$")
-plt.plot(time, b.state[:, 1], 'g--', label="$Y_{follow}$")
+    # get velocity magnitude
+    a_velocity_mag = a.velocity_mag()
+    b_velocity_mag = b.velocity_mag()
+    plt.plot(*downsample(time, a.state[:, 2]), label="$v_{X lead}$")
+    plt.plot(*downsample(time, a.state[:, 3]), label="$v_{Y lead}$")
+    plt.plot(*downsample(time, a_velocity_mag), 'k', label="$v_{lead mag}$")
 
-plt.ylabel('position [m]')
-plt.legend(frameon=False, loc='upper left')
+    plt.plot(*downsample(time, b.state[:, 2]), 'b--', label="$v_{X follow}$")
+    plt.plot(*downsample(time, b.state[:, 3]), 'g--', label="$v_{Y follow}$")
+    plt.plot(*downsample(time, b_velocity_mag), 'k--', label="$v_{follow mag}$")
 
-plt.subplot(2, 1, 2)
+    plt.xlabel('time [s]')
+    plt.ylabel('velocity [m/s]')
+    plt.legend(frameon=False, loc='lower left')
 
-# get velocity magnitude
-a_velocity_mag = a.velocity_mag()
-b_velocity_mag = b.velocity_mag()
-plt.plot(time, a.state[:, 2], label="$v_{X lead}$")
-plt.plot(time, a.state[:, 3], label="$v_{Y lead}$")
-plt.plot(time, a_velocity_mag, 'k', label="$v_{lead mag}$")
+    # 2 plot position in X vs Y
+    plt.figure(figsize=(9, 6), dpi=100)
 
-plt.plot(time, b.state[:, 2], 'b--', label="$v_{X follow}$")
-plt.plot(time, b.state[:, 3], 'g--', label="$v_{Y follow}$")
-plt.plot(time, b_velocity_mag, 'k--', label="$v_{follow mag}$")
+    plt.plot(*downsample(a.state[:, 0], a.state[:, 1]), 'k')
+    plt.plot(a.state[0, 0], a.state[0, 1], 'ko')
+    plt.plot(a.state[N_STEPS - 1, 0], a.state[N_STEPS - 1, 1], 'kx')
 
-plt.xlabel('time [s]')
-plt.ylabel('velocity [m/s]')
-plt.legend(frameon=False, loc='lower left')
+    plt.plot(*downsample(b.state[:, 0], b.state[:, 1]), 'k--')
+    plt.plot(b.state[0, 0], b.state[0, 1], 'ko')
+    plt.plot(b.state[N_STEPS - 1, 0], b.state[N_STEPS - 1, 1], 'kx')
 
-# 2 plot position in X vs Y
-plt.figure(figsize=(9, 6), dpi=100)   
+    plt.plot(BRIGHT_LIGHT[0], BRIGHT_LIGHT[1], 'ro')
+    plt.xlabel('X [m]')
+    plt.ylabel('Y [m]')
 
-plt.plot(a.state[:, 0], a.state[:, 1], 'k')
-plt.plot(a.state[0, 0], a.state[0, 1], 'ko')
-plt.plot(a.state[N_STEPS - 1, 0], a.state[N_STEPS - 1, 1], 'kx')
+    plt.axis('equal')
 
-plt.plot(b.state[:, 0], b.state[:, 1], 'k--')
-plt.plot(b.state[0, 0], b.state[0, 1], 'ko')
-plt.plot(b.state[N_STEPS - 1, 0], b.state[N_STEPS - 1, 1], 'kx')
+    # 3 plot control
+    plt.figure(figsize=(8, 6), dpi=100)
 
-plt.plot(BRIGHT_LIGHT[0], BRIGHT_LIGHT[1], 'ro')
-plt.xlabel('X [m]')
-plt.ylabel('Y [m]')
+    plt.plot(*downsample(time, a.turn_control, method='minmax'), 'kx', label="lead")
+    plt.plot(*downsample(time, b.turn_control, method='minmax'), 'k+', label="follow")
+    plt.ylim((-1.1, 1.1))
+    plt.xlim((-0.1, time[-1]))
+    plt.axhline(1, label="left", color='c')
+    plt.axhline(-1, label="right", color='r')
+    plt.xlabel('time [s]')
+    plt.ylabel('Turn Control')
+    plt.legend(frameon=False, loc='center right')
 
-plt.axis('equal')
+    plt.show()
 
-# 3 plot control 
-plt.figure(figsize=(8, 6), dpi=100)   
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stage 2 simulation: car B follows car A to the brightest light')
+    parser.add_argument('--no-plot', action='store_true', help='simulate only, without importing matplotlib')
+    parser.add_argument('--live', action='store_true', help='draw the paths while the simulation runs')
+    parser.add_argument('--time-final', type=float, default=TIME_FINAL, help='simulated seconds')
+    stopping.add_arguments(parser)
+    parser.add_argument('--profile', action='store_true', help='print the time spent in each phase of the run')
+    parser.add_argument('--allocations', action='store_true', help='with --profile, also measure memory allocated')
+    parser.add_argument('--trace', default=None, metavar='PATH', help='profile and write a Chrome trace timeline to PATH')
+    args = parser.parse_args(argv)
 
-plt.plot(time, a.turn_control, 'kx', label="lead")
-plt.plot(time, b.turn_control, 'k+', label="follow")
-plt.ylim((-1.1, 1.1))
-plt.xlim((-0.1, 10))
-plt.axhline(1, label="left", color='c')
-plt.axhline(-1, label="right", color='r')
-plt.xlabel('time [s]')
-plt.ylabel('Turn Control')
-plt.legend(frameon=False, loc='center right')
+    profiling = args.profile or args.allocations or args.trace
+    profiler = Profiler(allocations=args.allocations) if profiling else NULL_PROFILER
+    with profiler:
+        profiler.instrument(sys.modules[__name__], 'unit', 'Leader.control_direction', 'Follower.control_direction', 'Vehicle.new_state')
+        if profiling and (args.live or not args.no_plot):
+            import matplotlib.pyplot as plt
+            profiler.instrument(plt, 'show')     # time spent with the plot windows open
+        run(args, profiler)
+    if profiling:
+        print(profiler.summary())
+        if args.trace:
+            profiler.chrome_trace(args.trace)
 
-plt.show()
+def run(args, profiler):
+    """Simulate, then plot or print the result"""
+    start = perf_counter()
+    with profiler.phase('simulate'):
+        live = LivePlot(['Alfred', 'Bert'], BRIGHT_LIGHT, title='Stage 2') if args.live else None
+        stop = stopping.from_arguments(args)
+        time, a, b = simulate(TIME_FINAL=args.time_final, live=live, stop=stop)
+        if live is not None:
+            live.finish()
+    elapsed = perf_counter() - start
+    profiler.add_steps(len(time) - 1)
+    if args.no_plot:
+        print('{} steps in {:.4f} s'.format(len(time), elapsed))
+        print('final {} state {}'.format(a.name, a.state[-1]))
+        print('final {} state {}'.format(b.name, b.state[-1]))
+        if stop is not None:
+            print(stop.summary())
+    else:
+        with profiler.phase('plot'):
+            plot(time, a, b)
 
+if __name__ == '__main__':
+    main()
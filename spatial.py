@@ -0,0 +1,140 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Spatial index for the Stage 3 minimum distance safety rule at swarm scale
+
+# Vehicles are bucketed into a uniform grid of square cells at least as big as
+# the safe follow distance, so every vehicle within that radius of a car is in
+# its own cell or one of the 8 cells around it. Building the grid is a sort of
+# the cell keys and every query is vectorized over all vehicles at once, so
+# the per step cost grows with the number of vehicles and neighbours rather
+# than with every pair of vehicles
+
+import numpy as np
+
+# offsets of a cell and its 8 neighbours
+NEIGHBOUR_CELLS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+class UniformGrid(object):
+    """A uniform grid spatial index over vehicle positions with the following
+    properties:
+
+    Attributes:
+        CELL_SIZE: a float representing the side length of a grid cell in
+            meters, queries are exact for radii up to CELL_SIZE
+        positions: the (N, 2) array of [posX, posY] the grid was last built
+            from
+    """
+
+    def __init__(self, CELL_SIZE):
+        """Return an empty grid with square cells of side *CELL_SIZE* meters"""
+        if CELL_SIZE <= 0:
+            raise ValueError('CELL_SIZE must be positive')
+        self.CELL_SIZE = CELL_SIZE
+        self.positions = np.zeros([0, 2])
+
+    def build(self, positions):
+        """Rebuild the grid from an (N, 2) array of [posX, posY]"""
+        self.positions = positions = np.asarray(positions, dtype=float)
+        if len(positions) == 0:
+            self._cells = np.zeros([0, 2], dtype=np.int64)
+            self._order = self._sorted_keys = np.zeros(0, dtype=np.int64)
+            self._n_rows = 1
+            return
+        cells = np.floor(positions / self.CELL_SIZE).astype(np.int64)
+        cells -= cells.min(axis=0) - 1     # keep a free row and column around the occupied cells
+        self._n_rows = int(cells[:, 1].max()) + 2
+        keys = cells[:, 0] * self._n_rows + cells[:, 1]
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+        self._cells = cells
+
+    def neighbours(self, radius, query=None):
+        """Find every vehicle within *radius* of the vehicles in *query*
+
+        Args:
+            radius: a float representing the search radius in meters, no
+                larger than CELL_SIZE
+            query: array of vehicle indices to search around, all vehicles if
+                None
+
+        Returns:
+            i: array of query vehicle indices, one per neighbour pair
+            j: array of neighbour vehicle indices within radius of i
+            offset: (len(i), 2) array of vectors from vehicle i to vehicle j
+            distance: array of distances from vehicle i to vehicle j
+        """
+        if radius > self.CELL_SIZE:
+            raise ValueError('radius is larger than the grid CELL_SIZE')
+        if query is None:
+            query = np.arange(len(self.positions))
+        query = np.asarray(query, dtype=np.intp)
+        # sorted query keys keep every shifted neighbour key sorted too, which
+        # makes the binary searches below walk the grid in memory order
+        query_keys = self._cells[query, 0] * self._n_rows + self._cells[query, 1]
+        query_order = np.argsort(query_keys, kind='stable')
+        query = query[query_order]
+        query_keys = query_keys[query_order]
+
+        i_parts = []
+        j_parts = []
+        for dx, dy in NEIGHBOUR_CELLS:
+            keys = query_keys + (dx * self._n_rows + dy)
+            start = np.searchsorted(self._sorted_keys, keys, 'left')
+            counts = np.searchsorted(self._sorted_keys, keys, 'right') - start
+            total = counts.sum()
+            if total == 0:
+                continue
+            # expand every [start, start + count) range into sorted positions
+            group_start = np.cumsum(counts) - counts
+            sorted_index = np.repeat(start - group_start, counts) + np.arange(total)
+            i_parts.append(np.repeat(query, counts))
+            j_parts.append(self._order[sorted_index])
+
+        if not i_parts:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, np.zeros([0, 2]), np.zeros(0)
+        i = np.concatenate(i_parts)
+        j = np.concatenate(j_parts)
+        offset = self.positions[j] - self.positions[i]
+        distance = np.sqrt(offset[:, 0] ** 2 + offset[:, 1] ** 2)
+        keep = (i != j) & (distance <= radius)
+        return i[keep], j[keep], offset[keep], distance[keep]
+
+def safety_neighbours(grid, velocities, SAFE_FOLLOW_DISTANCE, query):
+    """Apply the Stage 3 safety rule test to every vehicle in *query*
+
+    Args:
+        grid: a UniformGrid built from the vehicle positions
+        velocities: (N, 2) array of [velX, velY] of every vehicle
+        SAFE_FOLLOW_DISTANCE: array of each vehicle's safe follow distance in
+            meters
+        query: array of vehicle indices the rule applies to
+
+    Returns:
+        i: array of query vehicle indices, one per neighbour within its safe
+            follow distance
+        j: array of neighbour vehicle indices
+        distance: array of distances from vehicle i to vehicle j
+        sign: array of "cross product" signs of the angle between the heading
+            of vehicle i and neighbour j, positive when j is to the left
+    """
+    query = np.asarray(query, dtype=np.intp)
+    radius = SAFE_FOLLOW_DISTANCE[query].max() if len(query) else 0.
+    if radius <= 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0), np.zeros(0)
+    i, j, offset, distance = grid.neighbours(radius, query)
+    keep = distance <= SAFE_FOLLOW_DISTANCE[i]
+    i, j, offset, distance = i[keep], j[keep], offset[keep], distance[keep]
+    sign_of_heading_angle = velocities[i, 0] * offset[:, 1] - velocities[i, 1] * offset[:, 0]
+    return i, j, distance, np.sign(sign_of_heading_angle)
+
+def nearest(i, distance):
+    """Pick the closest neighbour pair for every distinct vehicle in *i*
+
+    Returns:
+        pair: array of indices into *i* and *distance*, one per distinct vehicle
+    """
+    order = np.lexsort((distance, i))
+    _, first = np.unique(i[order], return_index=True)
+    return order[first]
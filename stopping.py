@@ -0,0 +1,144 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Stop conditions for the simulations: goal reached, safety violated, orbiting
+
+# A run goes on for TIME_FINAL seconds even though nothing new happens once
+# the leader reaches BRIGHT_LIGHT (the bang-bang control just circles it) or
+# a follower gets closer than it can recover from. A StopCondition is handed
+# to simulate() in simStage1.py/simStage2.py/simStage3.py or to Swarm.run()
+# and checked after every step. The run stops at the first step where
+#   goal       every leader is within GOAL_RADIUS of the light
+#   violation  a follower is closer than VIOLATION_DISTANCE to the vehicle it
+#              follows
+#   orbits     every leader has turned MAX_ORBITS full circles, the loops it
+#              drives through the light once there (counted by heading, as
+#              the loops pass too close to the light to count by bearing)
+# the output arrays end at that step, and the condition keeps the time to goal
+# and the time of violation. Every condition is off (None) by default
+#
+# Example:
+#   stop = StopCondition(GOAL_RADIUS=0.3, VIOLATION_DISTANCE=0.1, MAX_ORBITS=2)
+#   time, a, b = simStage3.simulate(TIME_FINAL=600, stop=stop)
+#   print(stop.summary())
+# and from the command line:
+#   python simStage3.py --no-plot --time-final 600 --goal-radius 0.3 --max-orbits 2
+
+import numpy as np
+
+def turn_angle(before, after):
+    """
+    Args:
+        before, after: arrays of [velX, velY] vectors along the last axis, one
+            step apart
+
+    Returns:
+        angle: signed angle in radians the heading turned, positive to the
+            left (counterclockwise)
+    """
+    cross = before[..., 0] * after[..., 1] - before[..., 1] * after[..., 0]
+    dot = before[..., 0] * after[..., 0] + before[..., 1] * after[..., 1]
+    return np.arctan2(cross, dot)
+
+class StopCondition(object):
+    """The stop conditions of one run and what happened in it with the
+    following properties:
+
+    Attributes:
+        GOAL_RADIUS: distance in meters from the light at which the leaders
+            have reached it, None to never stop for the goal
+        VIOLATION_DISTANCE: distance in meters a follower must keep from the
+            vehicle it follows, None to never stop for a violation
+        MAX_ORBITS: a float representing the full circles turned by every
+            leader after which the run stops, None to never stop for orbiting
+        reason: None while the run goes on or when it ran to the end, else
+            'goal', 'violation' or 'orbits'
+        stop_step, stop_time: the step and time in seconds the run stopped
+            at, None when it ran to the end
+        goal_step, goal_time: the step and time in seconds the leaders
+            reached the goal, None if they did not
+        violation_step, violation_time: the step and time in seconds of the
+            safety violation, None if there was none
+        orbits: a float representing the full circles turned by the leader
+            that turned the least
+    """
+
+    def __init__(self, GOAL_RADIUS=None, VIOLATION_DISTANCE=None, MAX_ORBITS=None):
+        self.GOAL_RADIUS = GOAL_RADIUS
+        self.VIOLATION_DISTANCE = VIOLATION_DISTANCE
+        self.MAX_ORBITS = MAX_ORBITS
+        self.start(np.zeros((0, 4)))
+
+    def start(self, leader_states):
+        """Begin a run from the (N_LEADERS, 4) [posX, posY, velX, velY]
+        *leader_states*, clearing any earlier result"""
+        self.reason = None
+        self.stop_step = self.stop_time = None
+        self.goal_step = self.goal_time = None
+        self.violation_step = self.violation_time = None
+        self.orbits = 0.
+        self._velocity = np.array(leader_states, dtype=float)[:, 2:4]
+        self._angle = np.zeros(len(self._velocity))
+
+    def check(self, step, t, leader_states, bright_light, separation=None):
+        """Check the state after *step*, at time *t* seconds
+
+        Args:
+            step: an int representing the step just taken
+            t: a float representing the simulation time of the step
+            leader_states: (N_LEADERS, 4) array of leader states
+            bright_light: [X, Y] of the light
+            separation: array of distances from every follower to the vehicle
+                it follows, None without followers
+
+        Returns:
+            stop: True when the run has to stop at this step
+        """
+        if self.VIOLATION_DISTANCE is not None and separation is not None and len(separation):
+            if np.min(separation) < self.VIOLATION_DISTANCE:
+                self.violation_step, self.violation_time = step, t
+                return self._stop('violation', step, t)
+        leader_states = np.asarray(leader_states, dtype=float)
+        if self.GOAL_RADIUS is not None and len(leader_states):
+            to_light = leader_states[:, 0:2] - bright_light
+            if ((to_light[:, 0] ** 2 + to_light[:, 1] ** 2) <= self.GOAL_RADIUS ** 2).all():
+                self.goal_step, self.goal_time = step, t
+                return self._stop('goal', step, t)
+        if self.MAX_ORBITS is not None and len(leader_states):
+            self._angle += turn_angle(self._velocity, leader_states[:, 2:4])
+            self._velocity = leader_states[:, 2:4]
+            self.orbits = np.abs(self._angle).min() / (2 * np.pi)
+            if self.orbits >= self.MAX_ORBITS:
+                return self._stop('orbits', step, t)
+        return False
+
+    def _stop(self, reason, step, t):
+        self.reason = reason
+        self.stop_step, self.stop_time = step, t
+        return True
+
+    def summary(self):
+        """Return a one line description of how the run ended"""
+        if self.reason is None:
+            return 'ran to the end, no stop condition met'
+        description = {'goal': 'goal reached', 'violation': 'safety violation',
+                       'orbits': '{:.1f} orbits'.format(self.orbits)}[self.reason]
+        return 'stopped at t = {:.2f} s (step {}): {}'.format(self.stop_time, self.stop_step, description)
+
+def add_arguments(parser, followers=True):
+    """Add the --goal-radius, --violation-distance (with *followers*) and
+    --max-orbits options to the argparse *parser*"""
+    parser.add_argument('--goal-radius', type=float, default=None, metavar='M',
+                        help='stop once car A is this close to the light')
+    if followers:
+        parser.add_argument('--violation-distance', type=float, default=None, metavar='M',
+                            help='stop once car B is closer than this to car A')
+    parser.add_argument('--max-orbits', type=float, default=None, metavar='N',
+                        help='stop once car A has driven N loops')
+
+def from_arguments(args):
+    """Return the StopCondition of parsed add_arguments() options, None when
+    none was given"""
+    VIOLATION_DISTANCE = getattr(args, 'violation_distance', None)
+    if args.goal_radius is None and VIOLATION_DISTANCE is None and args.max_orbits is None:
+        return None
+    return StopCondition(args.goal_radius, VIOLATION_DISTANCE, args.max_orbits)
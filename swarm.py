@@ -0,0 +1,252 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Swarm engine: the Stage 3 leader/follower rules from simStage3.py, but with
+# every vehicle held in shared struct-of-arrays storage so a time step updates
+# the whole swarm with a handful of batched NumPy operations instead of a
+# Python loop over Vehicle objects
+
+# Topology: each vehicle has a leader index. A leader index of -1 marks a
+# leader (bang-bang control toward the bright light), anything else is the
+# index of the vehicle it follows with a delay of FOLLOW_STEPS, applying the
+# same minimum distance safety rule as simStage3.py. With check_neighbours the
+# safety rule is applied against every vehicle within the safe follow
+# distance, found through a uniform grid, instead of only the followed vehicle
+
+import numpy as np
+
+from profiling import NULL_PROFILER
+from spatial import UniformGrid, safety_neighbours, nearest
+
+# define functions needed
+def unit_rows(vectors):
+    """
+    Args:
+        vectors: array with the vectors you want the unit vectors of along
+            the last axis, e.g. (N, 2) velocities
+
+    Returns:
+        unit: array of vectors in the direction of the input vectors but with
+            magnitude of 1, zero length vectors stay zero
+    """
+    mag = np.sqrt(vectors[..., 0] ** 2 + vectors[..., 1] ** 2)
+    mag = np.where(mag == 0, np.inf, mag)
+    return vectors / mag[..., None]
+
+def heading_sign(velocity, to_target):
+    """
+    Args:
+        velocity: array of [velX, velY] vectors along the last axis
+        to_target: array of [dX, dY] vectors from vehicle to target
+
+    Returns:
+        sign: "cross product" of heading and vector to target, positive when
+            the target is to the left of the heading
+    """
+    return velocity[..., 0] * to_target[..., 1] - velocity[..., 1] * to_target[..., 0]
+
+def turn_velocity(velocity, turn_control, CONSTANT_VELOCITY,
+                  L1_CONTROL_ALONG_TRACK_VELOCITY, L1_CONTROL_CROSS_TRACK_VELOCITY,
+                  L2_CONTROL_ALONG_TRACK_VELOCITY, L2_CONTROL_CROSS_TRACK_VELOCITY):
+    """Batched version of the velocity update in Vehicle.new_state
+
+    Args:
+        velocity: array of previous [velX, velY] vectors along the last axis
+        turn_control: array of turn controls (0, +-1 or +-2) matching
+            velocity without its last axis
+        remaining: vehicle constants, scalars or arrays broadcasting against
+            turn_control
+
+    Returns:
+        velocity: array of new [velX, velY] vectors
+    """
+    velocity_old_unit = unit_rows(velocity)
+    level_1 = np.abs(turn_control) == 1    # "slow down to turn"
+    level_2 = np.abs(turn_control) == 2    # turn control is sharp - level 2
+    along = np.where(level_1, L1_CONTROL_ALONG_TRACK_VELOCITY,
+                     np.where(level_2, L2_CONTROL_ALONG_TRACK_VELOCITY, CONSTANT_VELOCITY))
+    cross = np.where(level_1, turn_control * L1_CONTROL_CROSS_TRACK_VELOCITY,
+                     np.where(level_2, (turn_control / 2) * L2_CONTROL_CROSS_TRACK_VELOCITY, 0.))
+    new_velocity = np.empty_like(velocity_old_unit)
+    new_velocity[..., 0] = along * velocity_old_unit[..., 0] - cross * velocity_old_unit[..., 1]
+    new_velocity[..., 1] = along * velocity_old_unit[..., 1] + cross * velocity_old_unit[..., 0]
+    return new_velocity
+
+class Swarm(object):
+    """A swarm of leader and follower vehicles stored as struct-of-arrays with
+    the following properties:
+
+    Attributes:
+        N_VEHICLES: an int representing the number of vehicles in the swarm
+        CONSTANT_VELOCITY: an array of each vehicle's constant velocity
+            magnitude in m/s
+        L1_CONTROL_CROSS_TRACK_VELOCITY, L1_CONTROL_ALONG_TRACK_VELOCITY,
+        L2_CONTROL_CROSS_TRACK_VELOCITY, L2_CONTROL_ALONG_TRACK_VELOCITY:
+            arrays of each vehicle's velocities under level 1 and level 2
+            control in m/s, as in Vehicle
+        SAFE_FOLLOW_DISTANCE: an array of each vehicle's safe follow distance
+            in meters
+        leader_index: an int array with -1 for leaders and the index of the
+            vehicle being followed for followers
+        is_leader: a bool mask of the leader vehicles
+        is_follower: a bool mask of the follower vehicles
+        check_neighbours: a bool, True when followers keep their safe follow
+            distance from every vehicle rather than only the one they follow
+        state: an array of every vehicle's state with shape
+            (N_VEHICLES, N_STEPS, 4) and vector [posX, posY, velX, velY]
+        turn_control: an array of every vehicle's turning control decisions
+            with shape (N_VEHICLES, N_STEPS), +1/-1 for level 1 left/right and
+            +2/-2 for level 2 left/right
+        profiler: the profiling.Profiler timing the leader rule, follower
+            delay, safety rule and integration phases of every step,
+            NULL_PROFILER (off) by default
+    """
+
+    def __init__(self, CONSTANT_VELOCITY, L1_HEADING_CHANGE, L2_HEADING_CHANGE,
+                 SAFE_FOLLOW_DISTANCE, INITIAL_STATES, leader_index, N_STEPS,
+                 TIME_STEP, check_neighbours=False):
+        """Return a swarm object with one vehicle per row of *INITIAL_STATES*
+        ([posX, posY, velX, velY] each), following the vehicles given by
+        *leader_index* (-1 for leaders). *CONSTANT_VELOCITY*,
+        *L1_HEADING_CHANGE*, *L2_HEADING_CHANGE* and *SAFE_FOLLOW_DISTANCE*
+        have the same units as in Vehicle and can be a scalar shared by all
+        vehicles or an array with one value per vehicle. State and turn control
+        arrays are allocated for *N_STEPS* steps of *TIME_STEP* seconds. With
+        *check_neighbours* followers turn away from the closest of all
+        vehicles inside their safe follow distance
+        """
+
+        INITIAL_STATES = np.asarray(INITIAL_STATES, dtype=float)
+        self.N_VEHICLES = N = len(INITIAL_STATES)
+        self.CONSTANT_VELOCITY = np.broadcast_to(np.asarray(CONSTANT_VELOCITY, dtype=float), (N,))
+        L1_HEADING_CHANGE_PER_STEP = np.broadcast_to(np.asarray(L1_HEADING_CHANGE, dtype=float), (N,)) * TIME_STEP
+        L2_HEADING_CHANGE_PER_STEP = np.broadcast_to(np.asarray(L2_HEADING_CHANGE, dtype=float), (N,)) * TIME_STEP
+        self.L1_CONTROL_CROSS_TRACK_VELOCITY = self.CONSTANT_VELOCITY * np.sin(L1_HEADING_CHANGE_PER_STEP)
+        self.L1_CONTROL_ALONG_TRACK_VELOCITY = np.sqrt(self.CONSTANT_VELOCITY ** 2 - self.L1_CONTROL_CROSS_TRACK_VELOCITY ** 2)
+        self.L2_CONTROL_CROSS_TRACK_VELOCITY = self.CONSTANT_VELOCITY * np.sin(L2_HEADING_CHANGE_PER_STEP)
+        self.L2_CONTROL_ALONG_TRACK_VELOCITY = np.sqrt(self.CONSTANT_VELOCITY ** 2 - self.L2_CONTROL_CROSS_TRACK_VELOCITY ** 2)
+        self.SAFE_FOLLOW_DISTANCE = np.broadcast_to(np.asarray(SAFE_FOLLOW_DISTANCE, dtype=float), (N,))
+
+        self.leader_index = np.asarray(leader_index, dtype=np.intp)
+        if self.leader_index.shape != (N,):
+            raise ValueError('leader_index needs one entry per vehicle')
+        self.is_leader = self.leader_index < 0
+        self.is_follower = ~self.is_leader
+        self._leaders = np.flatnonzero(self.is_leader)
+        self._followers = np.flatnonzero(self.is_follower)
+        self._followed = self.leader_index[self._followers]
+
+        self.check_neighbours = check_neighbours
+        if check_neighbours:
+            cell_size = self.SAFE_FOLLOW_DISTANCE.max()
+            self._grid = UniformGrid(cell_size if cell_size > 0 else 1.)
+
+        self.state = np.zeros([N, N_STEPS, 4])      # initialized state vectors [posX; posY; velX; velY]
+        self.state[:, 0] = INITIAL_STATES
+        self.turn_control = np.zeros([N, N_STEPS])  # +1 for left turn, -1 for right turn
+        self.profiler = NULL_PROFILER
+
+    def control_direction(self, bright_light, step, FOLLOW_STEPS):
+        """Determines the turn control of every vehicle at *step*: leaders turn
+        toward *bright_light*, followers copy the control of the vehicle they
+        follow from *FOLLOW_STEPS* ago and turn away at level 2 if closer to
+        it than their safe follow distance
+        """
+        previous = self.state[:, step - 1]
+        profiler = self.profiler
+
+        # leaders - is brighter light on left or right of body along track direction
+        with profiler.phase('leader rule'):
+            leaders = self._leaders
+            car_to_bright_light = bright_light - previous[leaders, 0:2]
+            self.turn_control[leaders, step] = np.where(heading_sign(previous[leaders, 2:4], car_to_bright_light) >= 0, 1, -1)
+
+        # followers - control based on leader control and delay
+        with profiler.phase('follower delay'):
+            followers = self._followers
+            if step >= FOLLOW_STEPS:
+                self.turn_control[followers, step] = self.turn_control[self._followed, step - FOLLOW_STEPS]
+            else:
+                self.turn_control[followers, step] = 0
+
+        # check safety rule and control away from leader if too close,
+        # overriding previous control decision
+        with profiler.phase('safety rule'):
+            if self.check_neighbours:
+                self._neighbour_safety(previous, step)
+                return
+            follower_to_leader = previous[self._followed, 0:2] - previous[followers, 0:2]
+            radius = np.sqrt(follower_to_leader[:, 0] ** 2 + follower_to_leader[:, 1] ** 2)
+            too_close = radius <= self.SAFE_FOLLOW_DISTANCE[followers]
+            if too_close.any():
+                sign_of_heading_angle_to_leader = heading_sign(previous[followers, 2:4], follower_to_leader)
+                turn_away = np.where(sign_of_heading_angle_to_leader > 0, -2, 2)
+                self.turn_control[followers[too_close], step] = turn_away[too_close]
+
+    def _neighbour_safety(self, previous, step):
+        """Safety rule against every vehicle within the safe follow distance,
+        turning level 2 away from the closest one"""
+        self._grid.build(previous[:, 0:2])
+        i, j, distance, sign = safety_neighbours(self._grid, previous[:, 2:4],
+                                                 self.SAFE_FOLLOW_DISTANCE, self._followers)
+        if len(i):
+            closest = nearest(i, distance)
+            self.turn_control[i[closest], step] = np.where(sign[closest] > 0, -2, 2)
+
+    def new_state(self, step, TIME_STEP):
+        """Determine next state of every vehicle in time step via next control
+        velocity and integrating for position"""
+        with self.profiler.phase('integration'):
+            self.state[:, step, 2:4] = turn_velocity(
+                self.state[:, step - 1, 2:4], self.turn_control[:, step],
+                self.CONSTANT_VELOCITY,
+                self.L1_CONTROL_ALONG_TRACK_VELOCITY, self.L1_CONTROL_CROSS_TRACK_VELOCITY,
+                self.L2_CONTROL_ALONG_TRACK_VELOCITY, self.L2_CONTROL_CROSS_TRACK_VELOCITY)
+
+            # integrate to determine inertial position
+            self.state[:, step, 0:2] = self.state[:, step - 1, 0:2] + self.state[:, step, 2:4] * TIME_STEP
+
+    def run(self, bright_light, FOLLOW_STEPS, TIME_STEP, start=1, stop=None, condition=None):
+        """Run the simulation from step *start* up to, not including, step
+        *stop* (every step after the initial state by default). With a
+        stopping.StopCondition *condition*, checked after every step at time
+        step * TIME_STEP, the run ends at the first step meeting it
+
+        Returns:
+            end: one past the last step run, *stop* unless *condition* ended
+                the run early
+        """
+        bright_light = np.asarray(bright_light, dtype=float)
+        if stop is None:
+            stop = self.state.shape[1]
+        if condition is not None and start == 1:
+            condition.start(self.state[self._leaders, 0])
+        end = stop
+        for step in range(start, stop):
+            self.control_direction(bright_light, step, FOLLOW_STEPS)
+            self.new_state(step, TIME_STEP)
+            if condition is not None:
+                state = self.state[:, step]
+                follower_to_leader = state[self._followed, 0:2] - state[self._followers, 0:2]
+                separation = np.sqrt(follower_to_leader[:, 0] ** 2 + follower_to_leader[:, 1] ** 2)
+                if condition.check(step, step * TIME_STEP, state[self._leaders], bright_light, separation):
+                    end = step + 1
+                    break
+        self.profiler.add_steps(max(0, end - start))
+        return end
+
+    def trim(self, N_STEPS):
+        """Keep only the first *N_STEPS* states and turn controls, for a run
+        that stopped early"""
+        self.state = self.state[:, :N_STEPS].copy()
+        self.turn_control = self.turn_control[:, :N_STEPS].copy()
+
+    def shift(self, keep):
+        """Move the last *keep* steps of state and turn control to the start of
+        the arrays, so a short window of steps can be reused for a long run"""
+        self.state[:, :keep] = self.state[:, -keep:]
+        self.turn_control[:, :keep] = self.turn_control[:, -keep:]
+
+    def velocity_mag(self):
+        """Calculates the velocity magnitude of every state and returns it as
+        an (N_VEHICLES, N_STEPS) array"""
+        return np.sqrt(self.state[..., 2] ** 2 + self.state[..., 3] ** 2)
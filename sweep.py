@@ -0,0 +1,323 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Parameter sweep runner for the Stage 2/3 follow and safety parameters
+
+# Instead of editing the constants at the top of simStage2.py/simStage3.py and
+# rerunning by hand, describe a parameter grid or random sampling ranges and
+# let every core run the Stage 3 scenario for each point. Workers only send
+# back a row of summary metrics per run, so the parent process never holds the
+# full trajectories unless they are asked for
+#
+# Example, from the command line:
+#   python sweep.py --grid FOLLOW_TIME=0.3,0.5,1 --grid SAFE_FOLLOW_DISTANCE=0.1,0.2
+#   python sweep.py --sample 1000 --range FOLLOW_TIME=0.2:1.5 --out sweep.csv
+#   python sweep.py --grid FOLLOW_TIME=0.3,0.5,1 --cache ~/.cache/followcar
+# With a cache (cache.py) every scenario already run with the same code is
+# loaded from disk instead of simulated again. Setting GOAL_RADIUS,
+# VIOLATION_DISTANCE or MAX_ORBITS stops each run as soon as it reaches the
+# light, breaks the distance or has looped enough (stopping.py), instead of
+# simulating every step to TIME_FINAL. With --sample, a --grid setting takes
+# a single value and holds for every sampled scenario
+#   python sweep.py --sample 1000 --range FOLLOW_TIME=0.2:1.5 --grid GOAL_RADIUS=0.3
+# The light is an X:Y pair in a --grid and one range per axis in a --range
+#   python sweep.py --grid BRIGHT_LIGHT=4:-1,3:3
+#   python sweep.py --sample 100 --range BRIGHT_LIGHT_X=1:5 --range BRIGHT_LIGHT_Y=-2:2
+
+import argparse
+import itertools
+import math
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+import simStage3
+import spatial
+import stopping
+import swarm as swarm_engine
+from cache import ResultCache, code_version
+from swarm import Swarm
+
+# scenario parameters, defaulting to the constants of simStage3.py
+DEFAULT_SCENARIO = {
+    'TIME_STEP': simStage3.TIME_STEP,
+    'TIME_FINAL': simStage3.TIME_FINAL,
+    'CONSTANT_VELOCITY': simStage3.CONSTANT_VELOCITY,
+    'L1_HEADING_CHANGE': simStage3.L1_HEADING_CHANGE,
+    'L2_HEADING_CHANGE': simStage3.L2_HEADING_CHANGE,
+    'FOLLOW_TIME': simStage3.FOLLOW_TIME,
+    'SAFE_FOLLOW_DISTANCE': simStage3.SAFE_FOLLOW_DISTANCE,
+    'INITIAL_CROSS_TRACK_SEPARATION': simStage3.INITIAL_CROSS_TRACK_SEPARATION,
+    'BRIGHT_LIGHT': tuple(simStage3.BRIGHT_LIGHT.tolist()),
+    # stop conditions (stopping.py), None for off
+    'GOAL_RADIUS': None,
+    'VIOLATION_DISTANCE': None,
+    'MAX_ORBITS': None,
+}
+
+# summary metrics reported for every run, final_time is when the run ended and
+# the other times are NaN when the goal was not reached or there was no
+# violation
+METRICS = ['closest_approach', 'leader_final_light_distance',
+           'follower_final_light_distance', 'final_time', 'time_to_goal',
+           'time_of_violation', 'l2_overrides']
+
+def scenario(**overrides):
+    """Return a full scenario dictionary: DEFAULT_SCENARIO with *overrides*"""
+    unknown = set(overrides) - set(DEFAULT_SCENARIO)
+    if unknown:
+        raise KeyError('unknown scenario parameters: {}'.format(', '.join(sorted(unknown))))
+    params = dict(DEFAULT_SCENARIO)
+    params.update(overrides)
+    if len(params['BRIGHT_LIGHT']) != 2:
+        raise ValueError('BRIGHT_LIGHT needs an X, Y pair, not {!r}'.format(params['BRIGHT_LIGHT']))
+    return params
+
+def grid(spec):
+    """
+    Args:
+        spec: dictionary of parameter name to a list of values to try
+
+    Returns:
+        scenarios: list of scenario dictionaries, one per combination of the
+            values in *spec*
+    """
+    names = sorted(spec)
+    return [scenario(**dict(zip(names, values)))
+            for values in itertools.product(*[spec[name] for name in names])]
+
+def sample(spec, N_RUNS, seed=None):
+    """
+    Args:
+        spec: dictionary of parameter name to a (low, high) range sampled
+            uniformly, BRIGHT_LIGHT takes a pair of ranges ((xlow, xhigh),
+            (ylow, yhigh))
+        N_RUNS: an int representing the number of scenarios to draw
+        seed: seed for the random generator so a sweep can be repeated
+
+    Returns:
+        scenarios: list of *N_RUNS* random scenario dictionaries
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, limits in spec.items():
+        limits = np.asarray(limits, dtype=float)
+        columns[name] = rng.uniform(limits[..., 0], limits[..., 1], (N_RUNS,) + limits.shape[:-1])
+    return [scenario(**dict((name, column[n].tolist()) for name, column in columns.items()))
+            for n in range(N_RUNS)]
+
+def run_scenario(params):
+    """Run the Stage 3 leader/follower scenario described by *params*,
+    stopping early when its stop conditions are met
+
+    Returns:
+        swarm: the Swarm after the run, car A is vehicle 0 and car B vehicle
+            1, its arrays ending at the last step run
+        condition: the stopping.StopCondition of the run
+    """
+    TIME_STEP = params['TIME_STEP']
+    N_STEPS = int(round(params['TIME_FINAL'] / TIME_STEP)) + 1
+    CONSTANT_VELOCITY = params['CONSTANT_VELOCITY']
+    FOLLOW_STEPS = int(round(params['FOLLOW_TIME'] / TIME_STEP))    # simulation steps follower is behind
+    FOLLOW_DISTANCE = CONSTANT_VELOCITY * params['FOLLOW_TIME']
+    A_INITIAL_STATE = [0, 0, 0, CONSTANT_VELOCITY]      # car A starts at the origin moving at constant speed +Y
+    B_INITIAL_STATE = [params['INITIAL_CROSS_TRACK_SEPARATION'], -FOLLOW_DISTANCE, 0, CONSTANT_VELOCITY]
+    swarm = Swarm(CONSTANT_VELOCITY, params['L1_HEADING_CHANGE'], params['L2_HEADING_CHANGE'],
+                  [0, params['SAFE_FOLLOW_DISTANCE']], [A_INITIAL_STATE, B_INITIAL_STATE],
+                  [-1, 0], N_STEPS, TIME_STEP)
+    condition = stopping.StopCondition(params.get('GOAL_RADIUS'), params.get('VIOLATION_DISTANCE'),
+                                       params.get('MAX_ORBITS'))
+    end = swarm.run(params['BRIGHT_LIGHT'], FOLLOW_STEPS, TIME_STEP, condition=condition)
+    if end < N_STEPS:
+        swarm.trim(end)
+    return swarm, condition
+
+def summarize(swarm, params, condition=None):
+    """Return the summary metrics of a finished run as a tuple ordered like
+    METRICS"""
+    a, b = swarm.state[0], swarm.state[1]
+    bright_light = np.asarray(params['BRIGHT_LIGHT'], dtype=float)
+    separation = np.hypot(a[:, 0] - b[:, 0], a[:, 1] - b[:, 1])
+    time_of = lambda value: float('nan') if value is None else value
+    return (separation.min(),
+            math.hypot(*(a[-1, 0:2] - bright_light)),
+            math.hypot(*(b[-1, 0:2] - bright_light)),
+            (len(a) - 1) * params['TIME_STEP'],
+            time_of(condition and condition.goal_time),
+            time_of(condition and condition.violation_time),
+            int(np.count_nonzero(np.abs(swarm.turn_control[1]) == 2)))
+
+def sweep_version():
+    """Code version of the files a sweep result depends on, for the cache"""
+    return code_version(os.path.abspath(__file__), swarm_engine.__file__, spatial.__file__,
+                        stopping.__file__)
+
+def _run_one(job):
+    """Worker body: run one scenario, or load it from the cache, and return
+    its metrics, when asked its trajectories, and whether it was a cache hit"""
+    params, keep_trajectories, cache = job
+    if cache is not None:
+        trajectory = cache.get(params)
+        if trajectory is not None:
+            trajectories = None
+            if keep_trajectories:
+                # the cache stores the controls as int8, Swarm keeps floats
+                trajectories = (np.array(trajectory.state.transpose(1, 0, 2)), trajectory.turn_control.T.astype(float))
+            return tuple(trajectory.meta['metrics']), trajectories, True
+    swarm, condition = run_scenario(params)
+    metrics = summarize(swarm, params, condition)
+    if cache is not None:
+        time = np.arange(swarm.state.shape[1]) * params['TIME_STEP']
+        cache.put(params, time, swarm.state.transpose(1, 0, 2), swarm.turn_control.T, metrics)
+    trajectories = (swarm.state, swarm.turn_control) if keep_trajectories else None
+    return metrics, trajectories, False
+
+def _columns(scenarios):
+    """Flatten the parameters of *scenarios* into named table columns"""
+    names = sorted(scenarios[0]) if scenarios else sorted(DEFAULT_SCENARIO)
+    columns = []
+    for name in names:
+        values = np.asarray([params[name] for params in scenarios], dtype=float)
+        if values.ndim == 1:
+            columns.append((name, values))
+        else:
+            for axis, component in zip('XY', values.T):
+                columns.append(('{}_{}'.format(name, axis), component))
+    return columns
+
+def sweep(scenarios, processes=None, keep_trajectories=False, chunksize=None, cache=None):
+    """Run every scenario across a process pool
+
+    Args:
+        scenarios: list of scenario dictionaries, see grid() and sample()
+        processes: number of worker processes, every core if None
+        keep_trajectories: when True, also return the (state, turn_control)
+            arrays of every run
+        chunksize: scenarios handed to a worker at a time, picked from the
+            number of scenarios and workers if None
+        cache: a cache.ResultCache to load finished scenarios from and store
+            new ones in, its hits and misses are counted here
+
+    Returns:
+        table: structured array with one row per scenario holding its
+            parameters and METRICS
+        trajectories: list of (state, turn_control) per scenario, only
+            returned when *keep_trajectories* is True
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, len(scenarios) // (processes * 4))
+    jobs = [(params, keep_trajectories, cache) for params in scenarios]
+    if cache is not None:
+        counts = cache.hits, cache.misses, cache.stores
+    if processes == 1:
+        results = list(map(_run_one, jobs))
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_one, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    columns = _columns(scenarios)
+    dtype = [(name, float) for name, _ in columns] + [(name, float) for name in METRICS[:-1]] + [(METRICS[-1], int)]
+    table = np.zeros(len(scenarios), dtype=dtype)
+    for name, values in columns:
+        table[name] = values
+    if results:
+        table[METRICS] = np.array([tuple(metrics) for metrics, _, _ in results], dtype=table[METRICS].dtype)
+    if cache is not None:
+        # workers count in their own copies of the cache
+        hits = sum(1 for _, _, hit in results if hit)
+        cache.hits = counts[0] + hits
+        cache.misses = counts[1] + len(results) - hits
+        cache.stores = counts[2] + len(results) - hits
+    if keep_trajectories:
+        return table, [trajectories for _, trajectories, _ in results]
+    return table
+
+def save_table(table, path):
+    """Write a sweep table to a csv file with a header row"""
+    np.savetxt(path, table, delimiter=',', header=','.join(table.dtype.names), comments='',
+               fmt=['%d' if table.dtype[name].kind == 'i' else '%.6g' for name in table.dtype.names])
+
+def _parse_assignment(text):
+    """Split a NAME=value command line assignment, BRIGHT_LIGHT_X and
+    BRIGHT_LIGHT_Y name one axis of the light for --range"""
+    name, _, value = text.partition('=')
+    if name not in DEFAULT_SCENARIO and name not in ('BRIGHT_LIGHT_X', 'BRIGHT_LIGHT_Y'):
+        raise argparse.ArgumentTypeError('unknown scenario parameter {}'.format(name))
+    return name, value
+
+def _grid_value(name, text):
+    """One --grid value, X:Y for BRIGHT_LIGHT"""
+    if name == 'BRIGHT_LIGHT':
+        light = tuple(float(v) for v in text.split(':'))
+        if len(light) != 2:
+            raise ValueError('BRIGHT_LIGHT values are X:Y pairs, not {}'.format(text))
+        return light
+    return float(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep the Stage 3 follow and safety parameters')
+    parser.add_argument('--grid', action='append', default=[], type=_parse_assignment,
+                        metavar='NAME=V1,V2,...', help='values to try for a parameter, BRIGHT_LIGHT=X:Y,...')
+    parser.add_argument('--range', action='append', default=[], type=_parse_assignment,
+                        metavar='NAME=LOW:HIGH',
+                        help='uniform sampling range for a parameter, BRIGHT_LIGHT_X and BRIGHT_LIGHT_Y for the light')
+    parser.add_argument('--sample', type=int, default=0, metavar='N', help='number of random scenarios')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--out', default=None, help='csv file for the results table')
+    parser.add_argument('--cache', default=None, metavar='DIR', help='result cache directory')
+    parser.add_argument('--cache-mb', type=float, default=1024., help='size the result cache is kept to')
+    args = parser.parse_args(argv)
+
+    try:
+        values = dict((name, [_grid_value(name, v) for v in value.split(',')]) for name, value in args.grid)
+    except ValueError as error:
+        parser.error(str(error))
+    axes = sorted(name for name in values if name.startswith('BRIGHT_LIGHT_'))
+    if axes:
+        parser.error('{} only takes a --range, use --grid BRIGHT_LIGHT=X:Y'.format(', '.join(axes)))
+    if args.sample:
+        # --grid settings with one value hold for every sampled scenario
+        several = sorted(name for name in values if len(values[name]) > 1)
+        if several:
+            parser.error('--sample takes one --grid value per parameter, not for {}'.format(', '.join(several)))
+        spec = dict((name, [float(limit) for limit in value.split(':')]) for name, value in args.range)
+        if 'BRIGHT_LIGHT' in spec:
+            parser.error('sample the light with --range BRIGHT_LIGHT_X=LOW:HIGH and BRIGHT_LIGHT_Y=LOW:HIGH')
+        if 'BRIGHT_LIGHT_X' in spec or 'BRIGHT_LIGHT_Y' in spec:
+            # an axis without a range stays at the default light
+            x, y = DEFAULT_SCENARIO['BRIGHT_LIGHT']
+            spec['BRIGHT_LIGHT'] = [spec.pop('BRIGHT_LIGHT_X', [x, x]), spec.pop('BRIGHT_LIGHT_Y', [y, y])]
+        both = sorted(set(spec) & set(values))
+        if both:
+            parser.error('{} given with both --range and --grid'.format(', '.join(both)))
+        scenarios = sample(spec, args.sample, args.seed)
+        for params in scenarios:
+            params.update((name, value[0]) for name, value in values.items())
+    else:
+        if args.range:
+            parser.error('--range needs --sample')
+        scenarios = grid(values)
+    cache = None
+    if args.cache:
+        cache = ResultCache(os.path.expanduser(args.cache), args.cache_mb * 1e6, sweep_version())
+    table = sweep(scenarios, args.processes, cache=cache)
+    if args.out:
+        save_table(table, args.out)
+    else:
+        print(','.join(table.dtype.names))
+        for row in table:
+            print(','.join('{:.6g}'.format(value) for value in row.tolist()))
+    if cache is not None:
+        stats = cache.stats()
+        sys.stderr.write('cache: {} hits, {} misses, {} entries, {:.1f} MB\n'.format(
+            stats['hits'], stats['misses'], stats['entries'], stats['bytes'] / 1e6))
+
+if __name__ == '__main__':
+    main()
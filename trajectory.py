@@ -0,0 +1,293 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Trajectory storage for long missions
+
+# Vehicle and Swarm preallocate every step of the run in memory, which grows
+# with TIME_FINAL / TIME_STEP and with the number of vehicles. stream_swarm()
+# instead runs a Swarm over a short window of steps and appends every finished
+# chunk to a trajectory directory on disk, optionally keeping only every
+# DECIMATION-th step. The directory holds one appendable .npy file per column:
+#   time.npy          (T,) float64 seconds
+#   state.npy         (T, N_VEHICLES, 4) float64 [posX, posY, velX, velY]
+#   turn_control.npy  (T, N_VEHICLES) int8
+#   meta.json         TIME_STEP, DECIMATION and N_VEHICLES
+# Arrays are stored time-major so a chunk is appended at the end of each file.
+# The .npy headers are rewritten after every chunk, so the files stay readable
+# while a run is still going. open_trajectory() maps them back with np.memmap
+# without copying anything into memory
+#
+# Trajectory.at() answers state-at-time queries, e.g. at the pyb.millis()
+# timestamps of a board log, for any number of times at once: a binary search
+# on the time column finds the stored steps around each time (O(log T), only
+# the pages holding those steps are read from a memory map) and the state is
+# interpolated between them. Queries run QUERY_BLOCK times at a time, so
+# millions of them need no more working memory than the result
+
+import json
+import os
+
+import numpy as np
+
+# bytes reserved for every .npy header, enough for any shape we write
+NPY_HEADER_SIZE = 128
+QUERY_BLOCK = 1 << 18       # query times interpolated at a time
+
+def _npy_header(dtype, shape):
+    """Build a version 1.0 .npy header padded to exactly NPY_HEADER_SIZE bytes"""
+    text = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    text = text.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    if len(text) + 10 != NPY_HEADER_SIZE:
+        raise ValueError('shape {} does not fit the .npy header'.format(shape))
+    return b'\x93NUMPY\x01\x00' + np.uint16(len(text)).tobytes() + text.encode('latin1')
+
+class _AppendableArray(object):
+    """One .npy file growing along its first axis"""
+
+    def __init__(self, path, dtype, row_shape):
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.length = 0
+        self._file = open(path, 'w+b')
+        self._file.write(_npy_header(self.dtype, (0,) + self.row_shape))
+
+    def append(self, rows):
+        self._file.seek(0, os.SEEK_END)
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        rows.tofile(self._file)
+        self.length += len(rows)
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, (self.length,) + self.row_shape))
+
+    def close(self):
+        self._file.close()
+
+class TrajectoryWriter(object):
+    """A streaming writer of vehicle trajectories with the following
+    properties:
+
+    Attributes:
+        path: a string representing the trajectory directory
+        N_VEHICLES: an int representing the number of vehicles per step
+        TIME_STEP: a float representing the simulation time step in seconds
+        DECIMATION: an int, only every DECIMATION-th simulation step is kept
+        steps_seen: an int counting the simulation steps passed to append()
+    """
+
+    def __init__(self, path, N_VEHICLES, TIME_STEP, DECIMATION=1):
+        """Create trajectory directory *path* for *N_VEHICLES* vehicles
+        simulated with *TIME_STEP* and keep every *DECIMATION*-th step"""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.N_VEHICLES = N_VEHICLES
+        self.TIME_STEP = TIME_STEP
+        self.DECIMATION = int(DECIMATION)
+        self.steps_seen = 0
+        self._time = _AppendableArray(os.path.join(path, 'time.npy'), np.float64, ())
+        self._state = _AppendableArray(os.path.join(path, 'state.npy'), np.float64, (N_VEHICLES, 4))
+        self._turn_control = _AppendableArray(os.path.join(path, 'turn_control.npy'), np.int8, (N_VEHICLES,))
+        with open(os.path.join(path, 'meta.json'), 'w') as meta:
+            json.dump({'TIME_STEP': TIME_STEP, 'DECIMATION': self.DECIMATION,
+                       'N_VEHICLES': N_VEHICLES}, meta)
+
+    def append(self, state, turn_control):
+        """Append the next consecutive steps of a run
+
+        Args:
+            state: array of shape (N_VEHICLES, steps, 4), as held by Swarm
+            turn_control: array of shape (N_VEHICLES, steps)
+        """
+        steps = state.shape[1]
+        first = (-self.steps_seen) % self.DECIMATION      # first kept step in this chunk
+        kept = np.arange(first, steps, self.DECIMATION)
+        self.steps_seen += steps
+        if len(kept) == 0:
+            return
+        self._time.append((self.steps_seen - steps + kept) * self.TIME_STEP)
+        self._state.append(state[:, kept].transpose(1, 0, 2))
+        self._turn_control.append(turn_control[:, kept].T)
+
+    def close(self):
+        self._time.close()
+        self._state.close()
+        self._turn_control.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class TimeIndex(object):
+    """Binary search index over an increasing time column with the
+    following properties:
+
+    Attributes:
+        time: array of shape (T,) of increasing times in seconds, may be a
+            np.memmap
+    """
+
+    def __init__(self, time):
+        if len(time) == 0:
+            raise ValueError('cannot index an empty trajectory')
+        self.time = time
+        self.start = float(time[0])
+        self.end = float(time[-1])
+
+    def locate(self, t):
+        """Find the stored steps around times *t*
+
+        Args:
+            t: array of query times in seconds, any order
+
+        Returns:
+            left: int array of the step at or before each time, so the time
+                lies in [time[left], time[left + 1]] (clamped to the ends)
+            fraction: float array of how far each time is from time[left]
+                to time[left + 1], outside [0, 1] for times out of range
+            inside: bool array, True for times within [time[0], time[-1]]
+        """
+        t = np.asarray(t, dtype=float)
+        n = len(self.time)
+        if n == 1:
+            return np.zeros(t.shape, dtype=np.intp), np.zeros(t.shape), t == self.start
+        flat = t.reshape(-1)
+        if np.all(flat[1:] >= flat[:-1]):
+            right = np.searchsorted(self.time, flat, side='right')
+        else:
+            # sorted queries walk the time column in order, much faster
+            order = np.argsort(flat)
+            right = np.empty(len(flat), dtype=np.intp)
+            right[order] = np.searchsorted(self.time, flat[order], side='right')
+        left = np.clip(right.reshape(t.shape) - 1, 0, n - 2)
+        t0 = self.time[left]
+        span = self.time[left + 1] - t0
+        fraction = (t - t0) / np.where(span > 0, span, 1.)
+        inside = (t >= self.start) & (t <= self.end)
+        return left, fraction, inside
+
+class Trajectory(object):
+    """Vehicle trajectories stored time-major with the following properties:
+
+    Attributes:
+        time: array of shape (T,) with the time of every stored step in seconds
+        state: array of shape (T, N_VEHICLES, 4) with [posX, posY, velX, velY]
+        turn_control: array of shape (T, N_VEHICLES) of turn control decisions
+        meta: dictionary of run settings, empty for in-memory trajectories
+    """
+
+    def __init__(self, time, state, turn_control, meta=None):
+        self.time = time
+        self.state = state
+        self.turn_control = turn_control
+        self.meta = meta or {}
+        self._index = None
+
+    @property
+    def index(self):
+        """The TimeIndex of the time column, built on first use"""
+        if self._index is None:
+            self._index = TimeIndex(self.time)
+        return self._index
+
+    def at(self, t, vehicles=None, method='linear', outside='nan'):
+        """Interpolate the state at any times
+
+        Args:
+            t: scalar or array of times in seconds, e.g. board log
+                pyb.millis() stamps / 1000 less the run start
+            vehicles: index or slice of the vehicles wanted, every vehicle
+                when None
+            method: 'linear' interpolates all of [posX, posY, velX, velY];
+                'step' follows the simulation model, position linear and the
+                velocity of the step being taken, exact between undecimated
+                steps
+            outside: 'nan' for NaN states at times out of range, 'clamp' for
+                the first or last stored state
+
+        Returns:
+            state: array of shape np.shape(t) + (vehicles, 4), without the
+                vehicle axis when *vehicles* is an int
+        """
+        if method not in ('linear', 'step'):
+            raise ValueError('unknown interpolation method {}'.format(method))
+        if outside not in ('nan', 'clamp'):
+            raise ValueError('unknown out of range mode {}'.format(outside))
+        t = np.asarray(t, dtype=float)
+        select = slice(None) if vehicles is None else vehicles
+        row_shape = np.empty(self.state.shape[1:-1])[select].shape + (4,)
+        flat = t.reshape(-1)
+        result = np.empty((len(flat),) + row_shape)
+        last = len(self.time) - 1
+        for start in range(0, len(flat), QUERY_BLOCK):
+            left, fraction, inside = self.index.locate(flat[start:start + QUERY_BLOCK])
+            if outside == 'clamp':
+                fraction = np.clip(fraction, 0., 1.)
+            right = np.minimum(left + 1, last)
+            before = self.state[left][:, select]
+            after = self.state[right][:, select]
+            weight = fraction.reshape((-1,) + (1,) * len(row_shape))
+            block = before + weight * (after - before)
+            if method == 'step':
+                block[..., 2:4] = np.where(weight > 0, after[..., 2:4], before[..., 2:4])
+            if outside == 'nan':
+                block[~inside] = np.nan
+            result[start:start + len(left)] = block
+        return result.reshape(t.shape + row_shape)
+
+    def control_at(self, t, vehicles=None):
+        """Return the turn control in effect at times *t*: the control of
+        the first stored step at or after each time, as the control of step i
+        moves a vehicle from time[i - 1] to time[i] (clamped to the ends)"""
+        t = np.asarray(t, dtype=float)
+        step = np.minimum(np.searchsorted(self.time, t.reshape(-1), side='left'), len(self.time) - 1)
+        select = slice(None) if vehicles is None else vehicles
+        control = self.turn_control[step][:, select]
+        return control.reshape(t.shape + control.shape[1:])
+
+    @classmethod
+    def from_swarm(cls, swarm, time):
+        """Wrap the arrays of a finished Swarm run without copying them"""
+        return cls(np.asarray(time), swarm.state.transpose(1, 0, 2), swarm.turn_control.T)
+
+def open_trajectory(path, mode='r'):
+    """Map a trajectory directory written by TrajectoryWriter into memory
+
+    Args:
+        path: a string representing the trajectory directory
+        mode: np.memmap mode, 'r' for read only or 'r+' to edit in place
+
+    Returns:
+        trajectory: a Trajectory whose arrays are np.memmap views of the files
+    """
+    with open(os.path.join(path, 'meta.json')) as meta:
+        meta = json.load(meta)
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+              for name in ('time', 'state', 'turn_control')]
+    return Trajectory(*arrays, meta=meta)
+
+def stream_swarm(swarm, bright_light, FOLLOW_STEPS, TIME_STEP, N_STEPS, writer):
+    """Run *swarm* for *N_STEPS* steps in total, reusing its state arrays as a
+    window and streaming every finished chunk to *writer*
+
+    The swarm only needs to be allocated with a window of steps that is longer
+    than FOLLOW_STEPS, e.g. Swarm(..., N_STEPS=FOLLOW_STEPS + 1000, ...), so
+    memory no longer grows with the length of the run
+    """
+    window = swarm.state.shape[1]
+    keep = max(FOLLOW_STEPS, 1)   # steps of history the follower rule looks back
+    if window <= keep:
+        raise ValueError('swarm window of {} steps must be longer than FOLLOW_STEPS'.format(window))
+
+    # first window runs from the initial state like Swarm.run
+    stop = min(window, N_STEPS)
+    swarm.run(bright_light, FOLLOW_STEPS, TIME_STEP, 1, stop)
+    writer.append(swarm.state[:, :stop], swarm.turn_control[:, :stop])
+    done = stop
+    while done < N_STEPS:
+        swarm.shift(keep)
+        stop = min(window, keep + N_STEPS - done)
+        swarm.run(bright_light, FOLLOW_STEPS, TIME_STEP, keep, stop)
+        writer.append(swarm.state[:, keep:stop], swarm.turn_control[:, keep:stop])
+        done += stop - keep
@@ -0,0 +1,189 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Control law tuning: successive halving search over the Stage 3 parameters
+
+# Instead of trying FOLLOW_TIME, SAFE_FOLLOW_DISTANCE and the heading rates by
+# hand in simStage3.py, draw N_CANDIDATES random parameter sets from SPACE
+# and score each by running the mission (sweep.py, every core) for a short
+# budget of simulated time. Only the best 1 / ETA of them go on to the next
+# rung, with ETA times the budget, until one is left, MAX_TIME is reached or
+# every run finished within its budget, so most of the compute goes to the
+# promising candidates. Runs stop at the goal or at a collision (stopping.py),
+# and a run that already stopped is not rerun with a bigger budget, its
+# result would be the same.
+#
+# mission_score() is in seconds, lower is better:
+#   time to reach GOAL_RADIUS of the light, or the budget plus the time the
+#       leader still needs at full speed when it did not get there
+#   + SEPARATION_WEIGHT per meter the cars got closer than MIN_SEPARATION
+#   + L2_WEIGHT per level 2 override
+#   + COLLISION_PENALTY when car B came within COLLISION_DISTANCE of car A
+# averaged over the light positions, so the tuning is not for one light only
+#
+# Example, from the command line:
+#   python tuning.py --candidates 81 --min-time 5 --max-time 60
+#   python tuning.py --light=4,-1 --light=-3,5 --range FOLLOW_TIME=0.3:1 --seed 1
+
+import argparse
+import math
+import os
+import sys
+
+import numpy as np
+
+import sweep
+from cache import ResultCache
+
+# parameters searched, uniform ranges as for sweep.sample()
+SPACE = {
+    'FOLLOW_TIME': (0.2, 1.5),
+    'SAFE_FOLLOW_DISTANCE': (0.05, 0.4),
+    'L1_HEADING_CHANGE': (math.radians(10), math.radians(45)),
+    'L2_HEADING_CHANGE': (math.radians(20), math.radians(90)),
+}
+
+# mission
+GOAL_RADIUS = 0.3               # m, the leader has reached the light
+COLLISION_DISTANCE = 0.05       # m, the run stops as a collision
+MIN_SEPARATION = 0.15           # m, closer than this is penalized
+
+# score weights
+SEPARATION_WEIGHT = 100.        # s per m closer than MIN_SEPARATION
+L2_WEIGHT = 0.05                # s per level 2 override
+COLLISION_PENALTY = 100.        # s
+
+def mission_score(row, TIME_FINAL):
+    """Return the score in seconds of one sweep table *row* run for
+    *TIME_FINAL* seconds, lower is better"""
+    if not np.isnan(row['time_to_goal']):
+        score = row['time_to_goal']
+    else:
+        score = TIME_FINAL + row['leader_final_light_distance'] / row['CONSTANT_VELOCITY']
+    score += SEPARATION_WEIGHT * max(0., MIN_SEPARATION - row['closest_approach'])
+    score += L2_WEIGHT * row['l2_overrides']
+    if not np.isnan(row['time_of_violation']):
+        score += COLLISION_PENALTY
+    return score
+
+def successive_halving(space=SPACE, N_CANDIDATES=81, MIN_TIME=5., MAX_TIME=60., ETA=3, lights=None,
+                       processes=None, seed=None, score=mission_score, cache=None, report=None):
+    """Search *space* for the parameters with the lowest mean *score*
+
+    Args:
+        space: dictionary of parameter name to a (low, high) range
+        N_CANDIDATES: an int representing the random candidates to start with
+        MIN_TIME, MAX_TIME: floats representing the budget in simulated
+            seconds of the first and the last rung
+        ETA: an int representing the factor the candidates are cut by and the
+            budget grows by from one rung to the next
+        lights: list of [X, Y] light positions every candidate is run with,
+            the simStage3.py light when None
+        processes: worker processes for sweep.sweep(), every core if None
+        seed: seed for the random candidates
+        score: function of a sweep table row and the budget returning the
+            score of the run, see mission_score()
+        cache: a cache.ResultCache for sweep.sweep()
+        report: function called with the summary dictionary of every rung
+
+    Returns:
+        best: the scenario dictionary of the best candidate, without a
+            BRIGHT_LIGHT
+        rungs: list of one dictionary per rung with the budget, the candidate
+            indices, their scores and the runs simulated
+    """
+    if lights is None:
+        lights = [sweep.DEFAULT_SCENARIO['BRIGHT_LIGHT']]
+    lights = [tuple(float(v) for v in light) for light in lights]
+    candidates = sweep.sample(space, N_CANDIDATES, seed)
+    for params in candidates:
+        params.update(GOAL_RADIUS=GOAL_RADIUS, VIOLATION_DISTANCE=COLLISION_DISTANCE)
+
+    alive = np.arange(N_CANDIDATES)
+    finished = {}       # (candidate, light) -> table row of a run that stopped before its budget
+    budget = min(MIN_TIME, MAX_TIME)
+    rungs = []
+    while True:
+        jobs, rows = [], {}
+        for k in alive:
+            for light in lights:
+                if (k, light) in finished:
+                    rows[k, light] = finished[k, light]
+                else:
+                    jobs.append((k, light))
+        scenarios = [sweep.scenario(**dict(candidates[k], TIME_FINAL=budget, BRIGHT_LIGHT=light))
+                     for k, light in jobs]
+        table = sweep.sweep(scenarios, processes, cache=cache) if scenarios else []
+        for job, row in zip(jobs, table):
+            rows[job] = row
+            if row['final_time'] < budget - 0.5 * candidates[job[0]]['TIME_STEP']:
+                finished[job] = row     # stopped early, a longer budget gives the same run
+
+        scores = np.array([np.mean([score(rows[k, light], budget) for light in lights]) for k in alive])
+        rung = {'budget': budget, 'candidates': alive, 'scores': scores, 'runs': len(scenarios),
+                'best': int(alive[np.argmin(scores)]), 'best_score': float(scores.min())}
+        rungs.append(rung)
+        if report is not None:
+            report(rung)
+        if len(alive) <= 1 or budget >= MAX_TIME:
+            break
+        if all((k, light) in finished for k in alive for light in lights):
+            break       # every run is complete, a bigger budget changes nothing
+        order = np.argsort(scores, kind='stable')
+        alive = alive[order[:max(1, len(alive) // ETA)]]
+        budget = min(budget * ETA, MAX_TIME)
+
+    best = dict(candidates[rungs[-1]['best']])
+    del best['BRIGHT_LIGHT']
+    return best, rungs
+
+def _parse_range(text):
+    """Split a NAME=LOW:HIGH command line range of a scalar parameter the
+    tuner doesn't set itself, the lights come with --light"""
+    name, _, value = text.partition('=')
+    if name not in sweep.DEFAULT_SCENARIO:
+        raise argparse.ArgumentTypeError('unknown scenario parameter {}'.format(name))
+    if name == 'BRIGHT_LIGHT':
+        raise argparse.ArgumentTypeError('BRIGHT_LIGHT is not searched, give the lights with --light')
+    if name in ('TIME_FINAL', 'GOAL_RADIUS', 'VIOLATION_DISTANCE'):
+        raise argparse.ArgumentTypeError('{} is set by the tuner'.format(name))
+    limits = tuple(float(limit) for limit in value.split(':'))
+    if len(limits) != 2:
+        raise argparse.ArgumentTypeError('range of {} needs LOW:HIGH, not {}'.format(name, value))
+    return name, limits
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tune the Stage 3 follow and safety parameters by successive halving')
+    parser.add_argument('--candidates', type=int, default=81, help='random candidates in the first rung')
+    parser.add_argument('--min-time', type=float, default=5., help='simulated seconds of the first rung')
+    parser.add_argument('--max-time', type=float, default=60., help='simulated seconds of the last rung')
+    parser.add_argument('--eta', type=int, default=3, help='candidates cut and budget grown by this factor per rung')
+    parser.add_argument('--light', action='append', default=[], metavar='X,Y',
+                        help='light position to tune for, --light=X,Y when X is negative')
+    parser.add_argument('--range', action='append', default=[], type=_parse_range, metavar='NAME=LOW:HIGH',
+                        help='search range of a parameter, replacing its default range')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--cache', default=None, metavar='DIR', help='result cache directory')
+    args = parser.parse_args(argv)
+
+    space = dict(SPACE)
+    space.update(args.range)
+    lights = [[float(v) for v in light.split(',')] for light in args.light] or None
+    cache = ResultCache(os.path.expanduser(args.cache), version=sweep.sweep_version()) if args.cache else None
+
+    def report(rung):
+        sys.stderr.write('{:6.1f} s budget: {:4d} candidates, {:4d} runs, best score {:.2f}\n'.format(
+            rung['budget'], len(rung['candidates']), rung['runs'], rung['best_score']))
+
+    best, rungs = successive_halving(space, args.candidates, args.min_time, args.max_time, args.eta, lights,
+                                     args.processes, args.seed, cache=cache, report=report)
+    print('best score {:.2f} s after {} runs'.format(rungs[-1]['best_score'], sum(rung['runs'] for rung in rungs)))
+    for name in sorted(space):
+        value = best[name]
+        if name.endswith('HEADING_CHANGE'):
+            print('{} = math.radians({:.2f})'.format(name, math.degrees(value)))
+        else:
+            print('{} = {:.4g}'.format(name, value))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Framed, batched binary protocol for the car A to car B UART link
+
+# A bare b'1'/b'0' byte per loop can't tell car B how many samples were lost,
+# how old they are, or whether a stray byte is noise. Every frame carries a
+# sequence counter, car A's millisecond timestamp and a CRC, and can batch
+# several control samples (optionally with car A's state) to spend fewer link
+# bytes on framing. The decoder resynchronises on the sync bytes after
+# corrupted or partial frames
+#
+# Frame layout, all little endian:
+#   0xA5 0x5A           sync
+#   flags (B)           bit 0 set when samples carry state
+#   count (B)           samples in this frame, 1 to MAX_SAMPLES
+#   seq (H)             frame counter, wraps at 65536
+#   t0 (I)              car A pyb.millis() of the first sample
+#   count samples of:
+#     dt (H)            milliseconds after t0
+#     control (b)       turn control, +1 left, -1 right
+#     [posX, posY (h)   mm, velX, velY (h) mm/s]  only with the state flag
+#   crc (H)             CRC-16/CCITT-FALSE of flags through the last sample
+#
+# Pure Python with struct and array only, so the same module runs on the
+# pyboard and on the host. Run "python uartframe.py" on the host for a round
+# trip check and a throughput benchmark
+
+import struct
+from array import array
+
+SYNC_1 = 0xA5
+SYNC_2 = 0x5A
+FLAG_STATE = 0x01
+MAX_SAMPLES = 16
+HEADER_SIZE = 10            # sync through t0
+CRC_SIZE = 2
+SAMPLE_SIZE = 3
+STATE_SIZE = 8
+
+def _crc_table():
+    table = array('H', bytes(512))
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+CRC_TABLE = _crc_table()
+
+def crc16(data, start, end):
+    """
+    Args:
+        data: bytes-like object
+        start, end: byte range of *data* to check
+
+    Returns:
+        crc: CRC-16/CCITT-FALSE of data[start:end]
+    """
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for i in range(start, end):
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ data[i]) & 0xFF]
+    return crc
+
+def frame_size(count, with_state=False):
+    """Return the bytes in a frame of *count* samples"""
+    return HEADER_SIZE + count * (SAMPLE_SIZE + (STATE_SIZE if with_state else 0)) + CRC_SIZE
+
+class FrameEncoder(object):
+    """A car A side frame builder with the following properties:
+
+    Attributes:
+        batch: an int representing the samples per frame
+        with_state: a bool, True when samples carry car A's state
+        seq: an int representing the sequence number of the next frame
+    """
+
+    def __init__(self, batch=1, with_state=False):
+        """Return an encoder putting *batch* samples in every frame, each with
+        car A's state when *with_state* is True"""
+        if not 1 <= batch <= MAX_SAMPLES:
+            raise ValueError('batch must be 1 to {}'.format(MAX_SAMPLES))
+        self.batch = batch
+        self.with_state = with_state
+        self.seq = 0
+        self._sample_size = SAMPLE_SIZE + (STATE_SIZE if with_state else 0)
+        self._buf = bytearray(frame_size(MAX_SAMPLES, with_state))
+        self._buf[0] = SYNC_1
+        self._buf[1] = SYNC_2
+        self._mv = memoryview(self._buf)
+        self._count = 0
+        self._t0 = 0
+
+    def add(self, t, control, posX=0, posY=0, velX=0, velY=0):
+        """Add a sample taken at car A time *t* in milliseconds, state in mm
+        and mm/s. Returns True when the frame is full and ready to send"""
+        if self._count == 0:
+            self._t0 = t
+        offset = HEADER_SIZE + self._count * self._sample_size
+        struct.pack_into('<Hb', self._buf, offset, (t - self._t0) & 0xFFFF, control)
+        if self.with_state:
+            struct.pack_into('<hhhh', self._buf, offset + SAMPLE_SIZE, posX, posY, velX, velY)
+        self._count += 1
+        return self._count >= self.batch
+
+    def pending(self):
+        """Return the number of samples waiting in the frame"""
+        return self._count
+
+    def frame(self):
+        """Finish the frame of the samples added so far and return a
+        memoryview of its bytes, valid until the next add()"""
+        count = self._count
+        struct.pack_into('<BBHI', self._buf, 2, FLAG_STATE if self.with_state else 0,
+                         count, self.seq, self._t0)
+        end = HEADER_SIZE + count * self._sample_size
+        struct.pack_into('<H', self._buf, end, crc16(self._buf, 2, end))
+        self.seq = (self.seq + 1) & 0xFFFF
+        self._count = 0
+        return self._mv[:end + CRC_SIZE]
+
+class FrameDecoder(object):
+    """A car B side streaming frame parser with the following properties:
+
+    Attributes:
+        frames: an int counting the valid frames received in order
+        samples: an int counting the samples in those frames
+        lost: an int counting frames missing from the sequence numbers
+        stale: an int counting valid frames ignored as duplicates or older
+            than the latest, a sequence number up to half the sequence space
+            behind
+        crc_errors: an int counting frames failing their CRC
+        skipped: an int counting bytes dropped while searching for sync
+        last_seq: the sequence number of the latest valid frame, -1 before
+        last_t: car A time in milliseconds of the latest sample
+        last_control: turn control of the latest sample
+        last_state: [posX, posY, velX, velY] of the latest sample when frames
+            carry state
+        received: list of (seq, [(t, control, state), ...]) frames, only kept
+            when the decoder was made with keep=True (host use)
+    """
+
+    def __init__(self, keep=False):
+        """Return a decoder, keeping every decoded frame in *received* when
+        *keep* is True"""
+        self._buf = bytearray(2 * frame_size(MAX_SAMPLES, True))
+        self._len = 0
+        self.frames = 0
+        self.samples = 0
+        self.lost = 0
+        self.stale = 0
+        self.crc_errors = 0
+        self.skipped = 0
+        self.last_seq = -1
+        self.last_t = 0
+        self.last_control = 0
+        self.last_state = array('h', bytes(8))
+        self.received = [] if keep else None
+
+    def feed(self, data, n=None):
+        """Parse the first *n* bytes of *data* (all of it when None) and
+        return the number of valid frames completed"""
+        if n is None:
+            n = len(data)
+        completed = 0
+        i = 0
+        while i < n:
+            room = len(self._buf) - self._len
+            take = n - i if n - i < room else room
+            self._buf[self._len:self._len + take] = data[i:i + take]
+            self._len += take
+            i += take
+            completed += self._parse()
+        return completed
+
+    def _drop(self, k):
+        """Remove the first *k* bytes of the parse buffer"""
+        buf = self._buf
+        remaining = self._len - k
+        for j in range(remaining):
+            buf[j] = buf[j + k]
+        self._len = remaining
+
+    def _parse(self):
+        buf = self._buf
+        completed = 0
+        while True:
+            # find sync
+            start = 0
+            while start < self._len and not (buf[start] == SYNC_1 and (start + 1 == self._len or buf[start + 1] == SYNC_2)):
+                start += 1
+            if start:
+                self.skipped += start
+                self._drop(start)
+            if self._len < HEADER_SIZE:
+                return completed
+            flags = buf[2]
+            count = buf[3]
+            if count == 0 or count > MAX_SAMPLES or flags & ~FLAG_STATE:
+                self.skipped += 1           # not a real header, look for the next sync
+                self._drop(1)
+                continue
+            with_state = flags & FLAG_STATE
+            size = frame_size(count, with_state)
+            if self._len < size:
+                return completed
+            end = size - CRC_SIZE
+            if crc16(buf, 2, end) != buf[end] | (buf[end + 1] << 8):
+                self.crc_errors += 1
+                self.skipped += 1
+                self._drop(1)
+                continue
+            if self._accept(count, with_state):
+                completed += 1
+            self._drop(size)
+
+    def _accept(self, count, with_state):
+        # take the frame at the start of the buffer, False for a stale one
+        buf = self._buf
+        seq = buf[4] | (buf[5] << 8)
+        t0 = buf[6] | (buf[7] << 8) | (buf[8] << 16) | (buf[9] << 24)
+        if self.last_seq >= 0:
+            gap = (seq - self.last_seq) & 0xFFFF
+            if gap == 0 or gap >= 0x8000:
+                self.stale += 1             # repeated or behind, keep the latest
+                return False
+            self.lost += gap - 1
+        self.last_seq = seq
+        self.frames += 1
+        self.samples += count
+        sample_size = SAMPLE_SIZE + (STATE_SIZE if with_state else 0)
+        keep = self.received is not None
+        if keep:
+            samples = []
+        for k in range(count):
+            offset = HEADER_SIZE + k * sample_size
+            self.last_t = t0 + (buf[offset] | (buf[offset + 1] << 8))
+            control = buf[offset + 2]
+            self.last_control = control - 256 if control > 127 else control
+            if with_state:
+                for s in range(4):
+                    value = buf[offset + 3 + 2 * s] | (buf[offset + 4 + 2 * s] << 8)
+                    self.last_state[s] = value - 65536 if value > 32767 else value
+            if keep:
+                samples.append((self.last_t, self.last_control,
+                                tuple(self.last_state) if with_state else None))
+        if keep:
+            self.received.append((seq, samples))
+        return True
+
+    def loss_rate(self):
+        """Return the fraction of frames lost on the link"""
+        total = self.frames + self.lost
+        return self.lost / total if total else 0.
+
+    def latency(self, now):
+        """Return milliseconds from car A's latest sample to car B time *now*,
+        exact when both boards count pyb.millis() from the same start"""
+        return now - self.last_t
+
+if __name__ == '__main__':
+    # host side round trip check and benchmark
+    import random
+    import time
+
+    random.seed(1)
+    encoder = FrameEncoder(batch=4, with_state=True)
+    stream = bytearray()
+    sent = []
+    for k in range(4000):
+        t = 100 * k
+        state = (k % 1000, -k % 1000, 500, -500)
+        sent.append((t, 1 if k % 3 else -1, state))
+        if encoder.add(t, sent[-1][1], *state):
+            stream += encoder.frame()
+    n_frames = len(sent) // encoder.batch
+
+    decoder = FrameDecoder(keep=True)
+    for start in range(0, len(stream), 7):        # arrive in small pieces
+        decoder.feed(stream[start:start + 7])
+    received = [sample for _, samples in decoder.received for sample in samples]
+    assert received == sent and decoder.lost == 0 and decoder.crc_errors == 0
+
+    # corrupt a byte in every 10th frame and drop every 25th frame
+    size = frame_size(encoder.batch, True)
+    noisy = bytearray()
+    for f in range(n_frames):
+        frame = bytearray(stream[f * size:(f + 1) * size])
+        if f % 25 == 24:
+            continue
+        if f % 10 == 9:
+            frame[random.randrange(2, size)] ^= 0xFF
+        noisy += frame + bytes([random.randrange(256)])     # plus a noise byte
+    decoder = FrameDecoder(keep=True)
+    decoder.feed(noisy)
+    expected = [f for f in range(n_frames) if f % 25 != 24 and f % 10 != 9]
+    assert [seq for seq, _ in decoder.received] == expected
+    assert decoder.lost == n_frames - len(expected) - (n_frames - 1 - expected[-1])
+    print('round trip ok, {} frames lost of {}, {} crc errors'.format(decoder.lost, n_frames, decoder.crc_errors))
+
+    # repeated and reordered frames are stale, not 65535 lost
+    decoder = FrameDecoder(keep=True)
+    decoder.feed(stream[:3 * size] + stream[size:2 * size] + stream[2 * size:3 * size] + stream[3 * size:4 * size])
+    assert [seq for seq, _ in decoder.received] == [0, 1, 2, 3]
+    assert decoder.lost == 0 and decoder.stale == 2 and decoder.last_seq == 3
+
+    start = time.perf_counter()
+    for k in range(20000):
+        if encoder.add(k, 1, 1, 2, 3, 4):
+            encoder.frame()
+    encode_time = time.perf_counter() - start
+    decoder = FrameDecoder()
+    start = time.perf_counter()
+    decoder.feed(stream)
+    decode_time = time.perf_counter() - start
+    print('encode {:.0f} samples/s, decode {:.0f} samples/s ({:.0f} kB/s)'.format(
+        20000 / encode_time, decoder.samples / decode_time, len(stream) / decode_time / 1000))
@@ -0,0 +1,266 @@
+# Eric Watson - Follow Car Fun Project
+# Project Description is here: https://docs.google.com/document/d/1NkPps1JuIdaNQKTh2MQQV7bjhTHmIg6AfeSybolur6A/edit?usp=sharing
+# Plotting helpers for long runs: downsampling and a live trajectory view
+
+# A screen is a couple of thousand pixels wide, so plotting millions of
+# points only costs time. Before plotting, downsample() cuts a curve down to
+# MAX_POINTS points keeping its shape:
+#   lttb     Largest Triangle Three Buckets: one point per bucket, the one
+#            making the largest triangle with the previous pick and the next
+#            bucket's average, good for paths and smooth signals
+#   minmax   the lowest and highest point of every bucket, keeps every spike,
+#            good for the turn controls
+# Both return indices, so the other columns of the same rows can be picked.
+#
+# LivePlot draws the vehicle paths while a simulation runs: it keeps at most
+# MAX_POINTS points per vehicle (dropping every other point and doubling the
+# stride when full) and redraws at most FRAME_RATE times a second, blitting
+# only the lines onto a cached background unless the axes have to grow, so a
+# step costs the same however long the run gets.
+#
+# Example:
+#   plt.plot(*downsample(time, state[:, 0]))
+#   live = LivePlot(['Alfred', 'Bert'], BRIGHT_LIGHT)
+#   for step ...: live.update(time[step], positions)
+#   live.finish()
+
+from time import perf_counter
+
+import numpy as np
+
+MAX_POINTS = 2000       # points per plotted curve
+FRAME_RATE = 30.        # live redraws per second of wall time
+
+def velocity_magnitude(state):
+    """Return the velocity magnitudes of [posX, posY, velX, velY] states
+    along the last axis, for any number of rows and vehicles"""
+    state = np.asarray(state, dtype=float)
+    return np.sqrt(state[..., 2] ** 2 + state[..., 3] ** 2)
+
+def lttb(x, y, n_out=MAX_POINTS):
+    """Largest Triangle Three Buckets downsampling
+
+    Args:
+        x, y: arrays of the point coordinates, in plotting order
+        n_out: an int representing the number of points to keep
+
+    Returns:
+        indices: sorted int array of the kept points, always the first and
+            the last, every point when there are no more than *n_out*
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    # n_out - 2 buckets between the first and last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    counts = np.diff(edges)
+    average_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[-1])
+    average_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[-1])
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for k in range(n_out - 2):
+        low, high = edges[k], edges[k + 1]
+        ax, ay = x[a], y[a]
+        # twice the area of the triangle (a, candidate, next bucket average)
+        area = np.abs((ax - average_x[k + 1]) * (y[low:high] - ay)
+                      - (ax - x[low:high]) * (average_y[k + 1] - ay))
+        a = low + int(np.argmax(area))
+        indices[k + 1] = a
+    return indices
+
+def minmax(y, n_out=MAX_POINTS):
+    """Min/max decimation
+
+    Args:
+        y: array of values
+        n_out: an int representing the most points to keep
+
+    Returns:
+        indices: sorted int array of the lowest and highest point of each of
+            n_out / 2 buckets plus the first and last point, every point when
+            there are no more than *n_out*
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+    n_buckets = (n_out - 2) // 2
+    size = -(-n // n_buckets)
+    padded = np.empty(n_buckets * size)
+    padded[:n] = y
+    padded[n:] = y[-1]          # pad with the last value, clipped below
+    buckets = padded.reshape(n_buckets, size)
+    start = np.arange(n_buckets) * size
+    picks = np.concatenate([[0, n - 1], start + buckets.argmin(axis=1), start + buckets.argmax(axis=1)])
+    return np.unique(np.minimum(picks, n - 1))
+
+def downsample(x, y, n_out=MAX_POINTS, method='lttb'):
+    """Return (x, y) cut down to about *n_out* points with *method* 'lttb' or
+    'minmax', unchanged when short enough"""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if method == 'lttb':
+        indices = lttb(x, y, n_out)
+    elif method == 'minmax':
+        indices = minmax(y, n_out)
+    else:
+        raise ValueError('unknown downsampling method {}'.format(method))
+    return x[indices], y[indices]
+
+class LivePlot(object):
+    """A live view of vehicle paths drawn while a simulation runs with the
+    following properties:
+
+    Attributes:
+        figure, axes: the matplotlib figure and axes of the view
+        lines: list of one path Line2D per vehicle
+        stride: an int representing how many updates each kept point stands
+            for, doubling every time the buffer fills up
+        frames: an int counting the redraws, full or blitted
+        full_draws: an int counting the redraws of the whole figure
+    """
+
+    def __init__(self, names, bright_light=None, max_points=MAX_POINTS, frame_rate=FRAME_RATE,
+                 title=None, styles=None):
+        """Return an open live view for vehicles named *names*, marking
+        *bright_light* when given, keeping *max_points* points per path and
+        redrawing at most *frame_rate* times per second"""
+        import matplotlib.pyplot as plt
+        self._plt = plt
+        self.N_VEHICLES = len(names)
+        self.max_points = max_points - max_points % 2
+        self.interval = 1. / frame_rate if frame_rate else 0.
+        self._buffer = np.empty((self.max_points, self.N_VEHICLES, 2))
+        self._count = 0
+        self._updates = 0
+        self.stride = 1
+        self._head = np.zeros((self.N_VEHICLES, 2))
+        self._low = np.full(2, np.inf)
+        self._high = np.full(2, -np.inf)
+        self._last_draw = -np.inf
+        self._background = None
+        self.frames = 0
+        self.full_draws = 0
+
+        plt.ion()
+        self.figure, self.axes = plt.subplots(figsize=(9, 6), dpi=100)
+        styles = styles or ['k', 'k--', 'k:', 'k-.']
+        self.lines = [self.axes.plot([], [], styles[k % len(styles)], label=name, animated=True)[0]
+                      for k, name in enumerate(names)]
+        self._heads, = self.axes.plot([], [], 'kx', animated=True)
+        self._clock = self.axes.text(0.02, 0.95, '', transform=self.axes.transAxes, animated=True)
+        if bright_light is not None:
+            self.axes.plot(bright_light[0], bright_light[1], 'ro')
+            self._extend(np.asarray(bright_light, dtype=float)[None, :])
+        self.axes.set_xlabel('X [m]')
+        self.axes.set_ylabel('Y [m]')
+        self.axes.set_aspect('equal', adjustable='box')
+        self.axes.legend(frameon=False, loc='upper right')
+        if title:
+            self.axes.set_title(title)
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
+        plt.show(block=False)
+
+    def _on_draw(self, event):
+        """Cache the background after every full draw, including resizes"""
+        canvas = self.figure.canvas
+        self._background = canvas.copy_from_bbox(self.figure.bbox) if getattr(canvas, 'supports_blit', False) else None
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self.lines + [self._heads, self._clock]:
+            self.axes.draw_artist(artist)
+
+    def _extend(self, positions):
+        """Grow the data bounds by *positions*, True if they grew"""
+        low = np.minimum(self._low, positions.min(axis=0))
+        high = np.maximum(self._high, positions.max(axis=0))
+        grew = (low < self._low).any() or (high > self._high).any()
+        self._low, self._high = low, high
+        return grew
+
+    def update(self, t, positions, force=False):
+        """Add the (N_VEHICLES, 2) *positions* at time *t* seconds, redrawing
+        when a frame is due or *force* is True"""
+        positions = np.asarray(positions, dtype=float).reshape(self.N_VEHICLES, 2)
+        self._head[:] = positions
+        if self._updates % self.stride == 0:
+            if self._count == self.max_points:
+                # full: keep every other point, take half as many from now on
+                half = self.max_points // 2
+                self._buffer[:half] = self._buffer[0:self.max_points:2]
+                self._count = half
+                self.stride *= 2
+            if self._updates % self.stride == 0:
+                self._buffer[self._count] = positions
+                self._count += 1
+        self._updates += 1
+        self._time = t
+        if force or perf_counter() - self._last_draw >= self.interval:
+            self.draw()
+
+    def draw(self):
+        """Redraw now: blit the paths onto the cached background, or draw the
+        whole figure when the axes have to grow"""
+        kept = self._buffer[:self._count]
+        for k, line in enumerate(self.lines):
+            line.set_data(np.append(kept[:, k, 0], self._head[k, 0]), np.append(kept[:, k, 1], self._head[k, 1]))
+        self._heads.set_data(self._head[:, 0], self._head[:, 1])
+        self._clock.set_text('t = {:.1f} s'.format(getattr(self, '_time', 0.)))
+        canvas = self.figure.canvas
+        self._extend(self._head)
+        x_limits, y_limits = self.axes.get_xlim(), self.axes.get_ylim()
+        inside = (x_limits[0] <= self._low[0] and self._high[0] <= x_limits[1]
+                  and y_limits[0] <= self._low[1] and self._high[1] <= y_limits[1])
+        if self._background is None or not inside:
+            # margin of a quarter of the span, so the axes grow rarely
+            span = np.maximum(self._high - self._low, 1.)
+            self.axes.set_xlim(self._low[0] - span[0] / 4, self._high[0] + span[0] / 4)
+            self.axes.set_ylim(self._low[1] - span[1] / 4, self._high[1] + span[1] / 4)
+            canvas.draw()
+            self.full_draws += 1
+        else:
+            canvas.restore_region(self._background)
+            self._draw_animated()
+            canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+        self.frames += 1
+        self._last_draw = perf_counter()
+
+    def finish(self):
+        """Draw the final frame and leave the figure for plt.show()"""
+        self.draw()
+        for artist in self.lines + [self._heads, self._clock]:
+            artist.set_animated(False)
+        self._plt.ioff()
+
+if __name__ == '__main__':
+    # downsampling of a long noisy run, and a headless live view
+    import matplotlib
+    matplotlib.use('Agg')
+
+    rng = np.random.default_rng(0)
+    n = 2000000
+    t = np.arange(n) * 0.1
+    y = np.cumsum(rng.standard_normal(n))
+    y[n // 3] += 500        # one spike
+    for name, pick in (('lttb', lambda: lttb(t, y)), ('minmax', lambda: minmax(y))):
+        start = perf_counter()
+        indices = pick()
+        print('{:<7} {} -> {} points in {:.3f} s, spike kept: {}, range kept: {}'.format(
+            name, n, len(indices), perf_counter() - start, n // 3 in indices,
+            y[indices].max() == y.max() and y[indices].min() == y.min()))
+
+    start = perf_counter()
+    live = LivePlot(['Alfred', 'Bert'], [4., -1.])
+    angle = np.arange(200000) * 0.001
+    for step, a in enumerate(angle):
+        live.update(t[step], [[np.cos(a) * a, np.sin(a) * a], [np.cos(a) * a - 0.3, np.sin(a) * a]])
+    live.finish()
+    print('{} live updates in {:.2f} s, {} frames ({} full), {} points per path, stride {}'.format(
+        len(angle), perf_counter() - start, live.frames, live.full_draws, len(live.lines[0].get_xdata()),
+        live.stride))